@@ -44,6 +44,59 @@ export const getAlerts = async (req, res) => {
 };
 
 
+// Low-probability observations from the location model; query params (hours, threshold, limit)
+// are passed through to FastAPI.
+export const getAnomalousAlerts = async (req, res) => {
+  try {
+    const response = await axios.get("http://127.0.0.1:8000/alerts/anomalous", { params: req.query });
+    const data = response.data;
+
+    res.status(200).json({
+      status: "success",
+      alerts: data.alerts,
+      count: data.count,
+      threshold: data.threshold
+    });
+  } catch (error) {
+    console.error("Error fetching anomalous alerts:", error.message);
+    res.status(500).json({
+      status: "error",
+      message: "Failed to fetch anomalous alerts",
+      error: error.message
+    });
+  }
+};
+
+
+// Relays FastAPI's /alerts/stream (Server-Sent Events) to the browser; the upstream request
+// is aborted when the browser disconnects.
+export const streamAlerts = async (req, res) => {
+  const controller = new AbortController();
+  req.on("close", () => controller.abort());
+  try {
+    const upstream = await axios.get("http://127.0.0.1:8000/alerts/stream", {
+      responseType: "stream",
+      signal: controller.signal,
+    });
+    res.writeHead(200, {
+      "Content-Type": "text/event-stream",
+      "Cache-Control": "no-cache",
+      Connection: "keep-alive",
+    });
+    upstream.data.pipe(res);
+    upstream.data.on("end", () => res.end());
+  } catch (error) {
+    if (controller.signal.aborted) return;
+    console.error("Error streaming alerts:", error.message);
+    res.status(502).json({
+      status: "error",
+      message: "Failed to stream alerts",
+      error: error.message
+    });
+  }
+};
+
+
 export const getAllEntities = async (req, res) => {
   try {
     console.log("Fetching from pool");
@@ -136,4 +189,28 @@ export const train = async(req, res)=>{
       message: err.response?.data?.detail || "Training failed",
     });
   }
-};
\ No newline at end of file
+};
+
+export const trainStatus = async(req, res)=>{
+  try {
+    const response = await axios.get(`http://127.0.0.1:8000/train/${encodeURIComponent(req.params.jobId)}`);
+    res.json(response.data);
+  } catch (err) {
+    console.error("Train status failed:", err.response?.data || err.message);
+    res.status(err.response?.status || 500).json({
+      message: err.response?.data?.detail || "Failed to get training status",
+    });
+  }
+};
+
+export const cancelTrain = async(req, res)=>{
+  try {
+    const response = await axios.delete(`http://127.0.0.1:8000/train/${encodeURIComponent(req.params.jobId)}`);
+    res.json(response.data);
+  } catch (err) {
+    console.error("Cancel training failed:", err.response?.data || err.message);
+    res.status(err.response?.status || 500).json({
+      message: err.response?.data?.detail || "Failed to cancel training",
+    });
+  }
+};
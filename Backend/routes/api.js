@@ -1,15 +1,19 @@
 import express from 'express';
-import { getTimeline, getAlerts, getAllEntities, runPythonScript, getEntity, predict, train } from '../Controller/MonitorController.js';
+import { getTimeline, getAlerts, getAnomalousAlerts, streamAlerts, getAllEntities, runPythonScript, getEntity, predict, train, trainStatus, cancelTrain } from '../Controller/MonitorController.js';
 
 const router = express.Router();
 
 // Define the routes
 router.get('/timeline/:entityId', getTimeline);
 router.get('/alerts/inactive', getAlerts);
+router.get('/alerts/anomalous', getAnomalousAlerts);
+router.get('/alerts/stream', streamAlerts);
 router.get('/entities/:entityId', getEntity);
 router.post("/run-script", runPythonScript);
 router.post("/predict", predict);
 router.post("/train", train)
+router.get("/train/:jobId", trainStatus);
+router.delete("/train/:jobId", cancelTrain);
 router.get('/entity',getAllEntities);
 
 
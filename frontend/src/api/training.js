@@ -0,0 +1,37 @@
+import axios from "axios";
+
+const API = "http://localhost:5000/api";
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Queue a training job and poll it until it finishes.
+// onProgress receives the job status ({ status, progress, current_stage, stages, ... }) after every poll.
+export const trainAndWait = async (params, onProgress = () => {}, pollMs = 1000) => {
+  const res = await axios.post(`${API}/train`, params);
+  const jobId = res.data.job_id;
+  let job = res.data.job;
+  onProgress(job);
+  while (job.status === "queued" || job.status === "running") {
+    await sleep(pollMs);
+    job = (await axios.get(`${API}/train/${jobId}`)).data;
+    onProgress(job);
+  }
+  if (job.status !== "done") {
+    throw new Error(job.error || `Training ${job.status}`);
+  }
+  return job;
+};
+
+export const cancelTraining = async (jobId) => {
+  const res = await axios.delete(`${API}/train/${jobId}`);
+  return res.data;
+};
+
+// Human readable "stage (n/total)" for a job status
+export const describeTrainingJob = (job) => {
+  if (!job) return "";
+  if (job.status === "queued") return "Queued...";
+  const done = job.stages.filter((s) => s.status === "done").length;
+  const stage = (job.current_stage || "").replace(/_/g, " ");
+  return stage ? `${stage} (${done + 1}/${job.stages.length})` : `${Math.round(job.progress * 100)}%`;
+};
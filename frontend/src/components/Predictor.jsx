@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from "react";
 import axios from "axios";
+import { trainAndWait, describeTrainingJob } from "../api/training";
 import { MapPin, Calendar, TrendingUp, AlertCircle, Loader } from "lucide-react";
 
 function Predictor({ entityId }) {
@@ -13,6 +14,7 @@ function Predictor({ entityId }) {
     const [error, setError] = useState(null);
     const [training, setTraining] = useState(false);
     const [trained, setTrained] = useState(false);
+    const [trainingStatus, setTrainingStatus] = useState("");
 
     useEffect(() => {
         console.log("Predictor received entityId:", entityId);
@@ -25,20 +27,21 @@ function Predictor({ entityId }) {
         setTraining(true);
         setError(null);
         try {
-            const res = await axios.post("http://localhost:5000/api/train", {
+            const job = await trainAndWait({
                 data_dir: "data",
                 time_window_hours: 2,
                 n_clusters: null,
                 decay_half_life_hours: 2.0,
                 nearby_window_radius: 2
-            });
-            console.log("Training response:", res.data);
+            }, (job) => setTrainingStatus(describeTrainingJob(job)));
+            console.log("Training job finished:", job);
             setTrained(true);
         } catch (err) {
             console.error("Training failed:", err);
-            setError(err.response?.data?.detail || "Failed to train model.");
+            setError(err.response?.data?.message || err.message || "Failed to train model.");
         } finally {
             setTraining(false);
+            setTrainingStatus("");
         }
     };
 
@@ -143,10 +146,15 @@ function Predictor({ entityId }) {
 
                 <button
                     onClick={handlePredict}
-                    disabled={loading || !timestamp || !entityId}
+                    disabled={training || loading || !timestamp || !entityId}
                     className="w-full bg-gradient-to-r from-purple-600 to-indigo-600 hover:from-purple-700 hover:to-indigo-700 text-white font-semibold py-3 px-6 rounded-lg shadow-md hover:shadow-lg transition-all duration-200 disabled:opacity-50 disabled:cursor-not-allowed flex items-center justify-center gap-2"
                 >
-                    {loading ? (
+                    {training ? (
+                        <>
+                            <Loader size={20} className="animate-spin" />
+                            Training Model... {trainingStatus}
+                        </>
+                    ) : loading ? (
                         <>
                             <Loader size={20} className="animate-spin" />
                             Predicting...
@@ -1,5 +1,4 @@
 import React, { useEffect, useState, useMemo } from "react";
-import axios from "axios";
 import { AlertTriangle, Menu, X, Filter, Building } from "lucide-react";
 import { useNavigate, Link } from "react-router-dom";
 import AlertsPageSkeleton from "./AlertsPageSkeleton";
@@ -8,6 +7,7 @@ const AlertsPage = () => {
 
   const [alerts, setAlerts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [hours, setHours] = useState(12);
   const [isMenuOpen, setIsMenuOpen] = useState(false);
   const navigate = useNavigate();
 
@@ -15,20 +15,28 @@ const AlertsPage = () => {
   const [departmentFilter, setDepartmentFilter] = useState("");
 
   useEffect(() => {
-    const fetchAlerts = async () => {
-      try {
-        const res = await axios.get("http://localhost:5000/api/alerts/inactive");
-        setAlerts(res.data.alerts);
-      } catch (err) {
-        console.error(err);
-      } finally {
-        setLoading(false);
-      }
+    // The server pushes a snapshot of the inactive entities, then one event per transition;
+    // EventSource reconnects by itself and the next snapshot replaces the list
+    const source = new EventSource("http://localhost:5000/api/alerts/stream", { withCredentials: true });
+    source.addEventListener("snapshot", (e) => {
+      const data = JSON.parse(e.data);
+      setAlerts(data.alerts);
+      setHours(data.hours);
+      setLoading(false);
+    });
+    source.addEventListener("inactive", (e) => {
+      const alert = JSON.parse(e.data);
+      setAlerts((prev) => [...prev.filter((a) => a.entity_id !== alert.entity_id), alert]);
+    });
+    source.addEventListener("active", (e) => {
+      const { entity_id } = JSON.parse(e.data);
+      setAlerts((prev) => prev.filter((a) => a.entity_id !== entity_id));
+    });
+    source.onerror = (err) => {
+      console.error(err);
+      setLoading(false);
     };
-    
-    setTimeout(() => {
-      fetchAlerts();
-    }, 150); 
+    return () => source.close();
   }, []);
 
   const filteredAlerts = useMemo(() => {
@@ -121,7 +129,7 @@ const AlertsPage = () => {
                 <AlertTriangle size={36} /> Inactive Entities (Alerts)
               </h1>
               <p className="text-gray-600 mt-1">
-                Entities that haven’t logged any activity in the last 12 hours.
+                Entities that haven’t logged any activity in the last {hours} hours.
               </p>
             </div>
             
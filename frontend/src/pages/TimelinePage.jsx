@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from "react";
 import { useParams, Link } from "react-router-dom";
 import axios from "axios";
+import { trainAndWait, describeTrainingJob } from "../api/training";
 import { Activity, User, Menu, Building, Mail, Phone, Calendar, MapPin, Clock, FileText, TrendingUp, AlertCircle, Loader } from "lucide-react";
 import EventTimelineGraph from "../components/EventTimelineGraph";
 import { useNavigate } from "react-router-dom";
@@ -20,6 +21,7 @@ const TimelinePage = () => {
   const [predictionError, setPredictionError] = useState(null);
   const [training, setTraining] = useState(false);
   const [trained, setTrained] = useState(false);
+  const [trainingStatus, setTrainingStatus] = useState("");
 
   const navigate = useNavigate()
 
@@ -94,20 +96,21 @@ const TimelinePage = () => {
     setTraining(true);
     setPredictionError(null);
     try {
-      const res = await axios.post("http://localhost:5000/api/train", {
+      const job = await trainAndWait({
         data_dir: "data",
         time_window_hours: 2,
         n_clusters: null,
         decay_half_life_hours: 2.0,
         nearby_window_radius: 2
-      });
-      console.log("Training response:", res.data);
+      }, (job) => setTrainingStatus(describeTrainingJob(job)));
+      console.log("Training job finished:", job);
       setTrained(true);
     } catch (err) {
       console.error("Training failed:", err);
-      setPredictionError(err.response?.data?.detail || "Failed to train model.");
+      setPredictionError(err.response?.data?.message || err.message || "Failed to train model.");
     } finally {
       setTraining(false);
+      setTrainingStatus("");
     }
   };
 
@@ -346,7 +349,7 @@ const TimelinePage = () => {
               {training ? (
                 <>
                   <Loader size={20} className="animate-spin" />
-                  Training Model...
+                  Training Model... {trainingStatus}
                 </>
               ) : predictionLoading ? (
                 <>
@@ -0,0 +1,257 @@
+"""
+In-process inactivity alerts for the API, pushed to clients as they happen.
+
+The engine keeps every profile's last activity in memory and a min-heap of the
+moments they turn inactive (last activity + threshold). A timer task pops the
+heap when the earliest deadline passes and emits an "inactive" transition; new
+activity emits "active" for entities that were inactive.
+
+New activity is not polled from the event tables: the entity_last_activity
+triggers (create_tables.sql) bump a per-row seq, record the writing transaction
+and NOTIFY 'entity_activity' when an ingest commits, and the engine LISTENs on
+a connection of its own and reads only the rows written by transactions that
+had not committed at its previous read: from the xmin of the snapshot taken
+before that read, since loads commit in any order and a seq watermark would skip
+one that commits after a load with higher seqs. Rows read twice are recognised
+by their seq. A slow re-read every ALERT_POLL_SECONDS covers notifications lost
+while that connection was down.
+
+Subscribers (one per /alerts/stream client) get a snapshot of the inactive
+entities first and then the transitions. Messages are formatted once per
+transition and fanned out to bounded queues; a subscriber that falls
+ALERT_QUEUE_SIZE messages behind is closed and reconnects to a fresh snapshot.
+"""
+import asyncio
+import heapq
+import json
+import os
+from datetime import datetime, timedelta
+import asyncpg
+from dotenv import load_dotenv
+from get_info import INACTIVE_HOURS, inactive_entity_records
+
+load_dotenv()
+
+# Channel the entity_last_activity triggers notify on
+ACTIVITY_CHANNEL = "entity_activity"
+
+# Seconds between re-reads without a notification, and before reconnecting after an error
+ALERT_POLL_SECONDS = float(os.getenv("ALERT_POLL_SECONDS", "30"))
+# Messages a subscriber may fall behind before it is dropped
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+
+# Oldest transaction still running: everything committed later was written from this xid on
+SNAPSHOT_XMIN_SQL = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+# Profiles whose last activity was written from the given xid on (all of them for NULL)
+CHANGED_ACTIVITY_SQL = """
+SELECT ela.seq, p.entity_id, p.card_id, p.role, p.department, p.name, ela.last_activity
+FROM entity_last_activity ela
+JOIN student_or_staff_profiles p ON p.entity_id = ela.entity_id
+WHERE $1::bigint IS NULL OR ela.xid >= $1::bigint::text::xid8
+ORDER BY ela.seq
+"""
+
+# Fields of an alert, as in /alerts/inactive
+ALERT_FIELDS = ("entity_id", "card_id", "role", "department", "name", "last_activity")
+
+
+async def wait_event(event, timeout):
+    """event.wait() for at most timeout seconds. Unlike wait_for, a cancellation that
+    coincides with the event being set is never swallowed (Python 3.11)."""
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait([waiter], timeout=timeout)
+    finally:
+        waiter.cancel()
+
+
+def sse_message(event, data):
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AlertEngine:
+    def __init__(self, connect_kwargs, hours: float = INACTIVE_HOURS, poll_seconds: float = ALERT_POLL_SECONDS,
+                 queue_size: int = ALERT_QUEUE_SIZE, clock=datetime.now):
+        """
+        Args:
+            connect_kwargs: asyncpg.connect arguments for the main database
+            hours: inactivity threshold
+            poll_seconds: seconds between re-reads when no notification arrives
+            queue_size: messages a subscriber may fall behind before it is dropped
+            clock: returns the current (naive, local) time, like the event timestamps
+        """
+        self.connect_kwargs = connect_kwargs
+        self.hours = float(hours)
+        self.threshold = timedelta(hours=self.hours)
+        self.poll_seconds = float(poll_seconds)
+        self.queue_size = int(queue_size)
+        self.clock = clock
+
+        self.profiles = {}      # entity_id -> alert fields (last_activity as a datetime or None)
+        self.inactive = set()   # entity_ids currently inactive
+        self._heap = []         # (deadline, entity_id); entries whose deadline moved are skipped
+        self._seqs = {}         # entity_id -> entity_last_activity.seq applied
+        self._xmin = None       # snapshot xmin before the last read; None reads everything
+        self._subscribers = set()
+        self._changed = asyncio.Event()
+        self._rearm = asyncio.Event()
+        self._tasks = []
+        self.ready = False
+        self.transitions = 0
+        self.dropped_subscribers = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._timer())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for queue in list(self._subscribers):
+            self._close(queue)
+
+    async def _listen(self):
+        """Apply changed rows on every notification (or poll timeout); reconnect on errors."""
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(**self.connect_kwargs)
+                await conn.add_listener(ACTIVITY_CHANNEL, lambda *args: self._changed.set())
+                while True:
+                    self._changed.clear()
+                    await self.refresh(conn)
+                    await wait_event(self._changed, self.poll_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Alert engine: {e!r}; retrying in {self.poll_seconds:.0f}s")
+                await asyncio.sleep(self.poll_seconds)
+            finally:
+                if conn is not None:
+                    await conn.close()
+
+    async def refresh(self, conn):
+        """Read and apply the rows changed since the previous read on conn."""
+        xmin = await conn.fetchval(SNAPSHOT_XMIN_SQL)
+        self.apply(await conn.fetch(CHANGED_ACTIVITY_SQL, self._xmin))
+        self._xmin = xmin
+
+    async def _timer(self):
+        """Emit "inactive" as deadlines pass; sleeps until the earliest one or new activity."""
+        while True:
+            self._rearm.clear()
+            self.expire()
+            timeout = self.poll_seconds
+            if self._heap:
+                timeout = min(timeout, max(0.0, (self._heap[0][0] - self.clock()).total_seconds()))
+            await wait_event(self._rearm, timeout)
+
+    # ---------- state ----------
+    def _deadline(self, last_activity):
+        return last_activity + self.threshold if last_activity is not None else datetime.min
+
+    def apply(self, rows):
+        """Fold in (seq, entity_id, card_id, role, department, name, last_activity) rows."""
+        if not rows:
+            if not self.ready:
+                self._set_ready()
+            return
+        now = self.clock()
+        for row in rows:
+            seq, record = row[0], dict(zip(ALERT_FIELDS, tuple(row)[1:]))
+            entity_id = record["entity_id"]
+            if self._seqs.get(entity_id, -1) >= seq:
+                continue  # read before
+            self._seqs[entity_id] = seq
+            self.profiles[entity_id] = record
+            deadline = self._deadline(record["last_activity"])
+            if entity_id in self.inactive and deadline > now:
+                self.inactive.discard(entity_id)
+                self._publish("active", self.record(entity_id))
+            heapq.heappush(self._heap, (deadline, entity_id))
+        if len(self._heap) > 2 * len(self.profiles) + 1024:
+            self._heap = [(self._deadline(r["last_activity"]), e) for e, r in self.profiles.items()
+                          if e not in self.inactive]
+            heapq.heapify(self._heap)
+        if not self.ready:
+            # The first read is the starting state: what is inactive now goes into the snapshot
+            self.expire(publish=False)
+            self._set_ready()
+        self._rearm.set()
+
+    def expire(self, publish=True):
+        """Mark the entities whose deadline has passed inactive."""
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, entity_id = heapq.heappop(self._heap)
+            record = self.profiles.get(entity_id)
+            if record is None or self._deadline(record["last_activity"]) != deadline or entity_id in self.inactive:
+                continue
+            self.inactive.add(entity_id)
+            if publish:
+                self._publish("inactive", self.record(entity_id))
+
+    def _set_ready(self):
+        self.ready = True
+        message = self._snapshot_message()
+        for queue in list(self._subscribers):
+            self._offer(queue, message)
+
+    # ---------- views ----------
+    def record(self, entity_id):
+        return inactive_entity_records(ALERT_FIELDS, [tuple(self.profiles[entity_id][f] for f in ALERT_FIELDS)])[0]
+
+    def snapshot(self):
+        """Inactive entities like check_inactive_entities: by last activity, never-active last."""
+        order = sorted(self.inactive, key=lambda e: (self.profiles[e]["last_activity"] is None,
+                                                     self.profiles[e]["last_activity"] or datetime.min, e))
+        return [self.record(e) for e in order]
+
+    def _snapshot_message(self):
+        return sse_message("snapshot", {"hours": self.hours, "alerts": self.snapshot()})
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "hours": self.hours,
+            "entities": len(self.profiles),
+            "inactive": len(self.inactive),
+            "subscribers": len(self._subscribers),
+            "transitions": self.transitions,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+    # ---------- subscribers ----------
+    def subscribe(self):
+        """Queue of SSE messages for one client: the snapshot once ready, then transitions; None ends it."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        if self.ready:
+            queue.put_nowait(self._snapshot_message())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self, event, data):
+        self.transitions += 1
+        message = sse_message(event, data)
+        for queue in list(self._subscribers):
+            self._offer(queue, message)
+
+    def _offer(self, queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped_subscribers += 1
+            self._close(queue)
+
+    def _close(self, queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
@@ -0,0 +1,171 @@
+"""
+Benchmark for the alert engine behind /alerts/stream vs. polling /alerts/inactive.
+
+Seeds a scratch schema of the local Postgres configured in .env with history
+up to now and runs AlertEngine instances against it:
+
+ - with the clock frozen, the engine's starting snapshot must equal
+   INACTIVE_ENTITIES_SQL for the same cut-off (checked before any timing)
+ - with a short threshold (--threshold-seconds) and the real clock, card swipes
+   for inactive entities are loaded through db_insert's COPY path one at a time;
+   it reports the time from the start of the load to the "active" event (next
+   to the load alone), and how late the "inactive" event arrives after last
+   activity + threshold
+ - fan-out: the cost of pushing one transition to --subscribers clients vs.
+   that many browser tabs each polling /alerts/inactive once
+
+    python bench_alert_stream.py --entities 5000 --events 500000 --trials 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+import bench_utils
+import get_info
+import get_info_async
+from alert_engine import AlertEngine
+
+
+def engine_for_scratch(**kwargs):
+    connect_kwargs = {**get_info_async.DB_MAIN, "server_settings": {"search_path": bench_utils.SCRATCH_SCHEMA}}
+    return AlertEngine(connect_kwargs, **kwargs)
+
+
+async def until_ready(engine):
+    while not engine.ready:
+        await asyncio.sleep(0.01)
+
+
+async def next_event(queue, entity_id, event):
+    """Wait for `event` about entity_id on a subscriber queue; returns the arrival time."""
+    while True:
+        message = await queue.get()
+        name, data = [line.split(": ", 1)[1] for line in message.strip().split("\n")]
+        if name == event and json.loads(data)["entity_id"] == entity_id:
+            return time.perf_counter(), datetime.now()
+
+
+def load_swipe(conn, card_id, timestamp):
+    swipe = pd.DataFrame({"card_id": [card_id], "location_id": ["LOC_000"],
+                          "timestamp": [timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")]})
+    with contextlib.redirect_stdout(io.StringIO()):
+        bench_utils.copy_dataframe(swipe, "campus_card_swipes", conn)
+
+
+def fetch_inactive(conn, since):
+    cur = conn.cursor()
+    cur.execute(get_info.INACTIVE_ENTITIES_SQL, {"since": since})
+    cols = [desc[0] for desc in cur.description]
+    records = get_info.inactive_entity_records(cols, cur.fetchall())
+    cur.close()
+    conn.commit()
+    return records
+
+
+async def check_snapshot(conn, hours):
+    frozen = datetime.now()
+    engine = engine_for_scratch(hours=hours, clock=lambda: frozen)
+    await engine.start()
+    try:
+        await until_ready(engine)
+        expected = fetch_inactive(conn, frozen - timedelta(hours=hours))
+        assert engine.snapshot() == expected, "engine snapshot differs from INACTIVE_ENTITIES_SQL"
+        return len(expected), len(engine.profiles)
+    finally:
+        await engine.stop()
+
+
+async def measure_latency(conn, profiles, threshold_seconds, trials):
+    engine = engine_for_scratch(hours=threshold_seconds / 3600)
+    await engine.start()
+    try:
+        await until_ready(engine)
+        queue = engine.subscribe()
+        cards = profiles.set_index("entity_id")["card_id"]
+        load_ms, active_ms, late_ms = [], [], []
+        for entity_id in sorted(engine.inactive)[:trials]:
+            timestamp = datetime.now()
+            start = time.perf_counter()
+            await asyncio.to_thread(load_swipe, conn, cards[entity_id], timestamp)
+            load_ms.append((time.perf_counter() - start) * 1000)
+            arrived, _ = await next_event(queue, entity_id, "active")
+            active_ms.append((arrived - start) * 1000)
+            _, wall = await next_event(queue, entity_id, "inactive")
+            late_ms.append((wall - (timestamp + timedelta(seconds=threshold_seconds))).total_seconds() * 1000)
+        return load_ms, active_ms, late_ms
+    finally:
+        await engine.stop()
+
+
+async def measure_fan_out(conn, hours, subscribers, repeat):
+    engine = engine_for_scratch(hours=hours)
+    await engine.start()
+    try:
+        await until_ready(engine)
+        queues = [engine.subscribe() for _ in range(subscribers)]
+        entity_id = next(iter(engine.profiles))
+        publish_s = []
+        for _ in range(repeat):
+            for queue in queues:
+                while not queue.empty():
+                    queue.get_nowait()
+            start = time.perf_counter()
+            engine._publish("inactive", engine.record(entity_id))
+            publish_s.append(time.perf_counter() - start)
+        since = datetime.now() - timedelta(hours=hours)
+        query_s = [bench_utils.timed(fetch_inactive, conn, since)[1] for _ in range(repeat)]
+        return min(publish_s), min(query_s)
+    finally:
+        await engine.stop()
+
+
+async def run(args):
+    now = datetime.now()
+    start = (now - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    frames = bench_utils.synthetic_campus(args.entities, args.events, start=start, days=args.days)
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, frames)
+
+        n_inactive, n_entities = await check_snapshot(conn, args.hours)
+        print(f"{n_entities:,} entities, {n_inactive:,} inactive for {args.hours:g}h: "
+              f"engine snapshot identical to INACTIVE_ENTITIES_SQL")
+
+        load_ms, active_ms, late_ms = await measure_latency(conn, frames["student_or_staff_profiles"],
+                                                            args.threshold_seconds, args.trials)
+        publish_s, query_s = await measure_fan_out(conn, args.hours, args.subscribers, args.repeat)
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+    print(f"\n{'transition':<36}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for name, samples in (("load of one swipe (COPY + commit)", load_ms),
+                          ("load start -> 'active' event", active_ms),
+                          (f"'inactive' after {args.threshold_seconds:g}s threshold", late_ms)):
+        print(f"{name:<36}{bench_utils.percentile_ms([s / 1000 for s in samples], 50):>9.1f}"
+              f"{bench_utils.percentile_ms([s / 1000 for s in samples], 95):>9.1f}{max(samples):>9.1f}")
+    print(f"\n{args.subscribers:,} clients: one pushed transition {publish_s * 1000:.2f} ms in-process; "
+          f"one polling round {args.subscribers:,} x {query_s * 1000:.1f} ms = {args.subscribers * query_s:.1f}s of queries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=500_000, help="card swipe and wifi rows")
+    parser.add_argument("--days", type=int, default=30, help="length of the history, ending now")
+    parser.add_argument("--hours", type=float, default=get_info.INACTIVE_HOURS, help="threshold of the snapshot check")
+    parser.add_argument("--threshold-seconds", type=float, default=2.0, help="threshold of the latency runs")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--subscribers", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Benchmark for the anomaly rule engine (anomaly_rules.py).
+
+Builds synthetic unified events in memory: card swipes, most of them with a
+CCTV frame and a wifi association of the same entity close by, plus bookings
+(some not attended) in the swiped locations. Before printing timings it checks
+that
+
+ - feeding the events in --batch-minutes batches gives the same alerts as one
+   pass over everything (the rules' camera/card-holder sets are warmed with
+   all events first, so both see the same cameras)
+ - on the first --reference-events events, each rule's alerts equal a plain
+   per-event loop
+
+Throughput is events per second through RuleEngine.process in batches, next
+to the events per hour it covers. With --db it also seeds a scratch schema
+(bench_utils.synthetic_campus), runs detect_anomalies over it in slices and
+checks anomaly_alerts against the same slices run in memory, and that a
+second run finds nothing new to read.
+
+    python bench_anomaly_rules.py --events 1000000 5000000 --batch-minutes 5 --db
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import bench_utils
+import anomaly_rules
+from anomaly_rules import RuleEngine, default_rules
+from prediction_pipeline import CampusLocationPredictor
+
+
+def synthetic_events(n_events, n_entities=20_000, hours=24, seed=0):
+    """Unified events: swipes, frames/devices near most swipes, a few bookings; sorted by time."""
+    rng = np.random.default_rng(seed)
+    n_cards = max(1, int(n_events * 0.4))
+    entities = np.array([f"E{i:06d}" for i in range(n_entities)], dtype=object)
+    locations = np.array(bench_utils.LOCATIONS, dtype=object)
+    aps = np.array(bench_utils.ACCESS_POINTS, dtype=object)
+    start = pd.Timestamp("2025-01-01")
+
+    card_entity = entities[rng.integers(0, n_entities, n_cards)]
+    card_loc = locations[rng.integers(0, len(locations), n_cards)]
+    card_ts = start + pd.to_timedelta(rng.integers(0, hours * 3_600_000, n_cards), unit="ms")
+    frame = rng.random(n_cards) < 0.9
+    device = rng.random(n_cards) < 0.8
+    n_bookings = max(1, n_events // 50)
+    booking_ts = start + pd.to_timedelta(rng.integers(0, hours * 3600, n_bookings), unit="s")
+    parts = [
+        pd.DataFrame({"entity_id": card_entity, "timestamp": card_ts, "location_id": card_loc, "source": "card"}),
+        pd.DataFrame({"entity_id": card_entity[frame], "location_id": card_loc[frame], "source": "frame",
+                      "timestamp": card_ts[frame] + pd.to_timedelta(rng.integers(-90, 90, frame.sum()), unit="s")}),
+        pd.DataFrame({"entity_id": card_entity[device], "location_id": aps[rng.integers(0, len(aps), device.sum())],
+                      "source": "device",
+                      "timestamp": card_ts[device] + pd.to_timedelta(rng.integers(-90, 90, device.sum()), unit="min")}),
+        pd.DataFrame({"entity_id": entities[rng.integers(0, n_entities, n_bookings)], "timestamp": booking_ts,
+                      "location_id": locations[rng.integers(0, len(locations), n_bookings)], "source": "booking",
+                      "end_time": booking_ts + pd.Timedelta(hours=1),
+                      "attended": rng.choice(np.array(["YES", "NO"], dtype=object), n_bookings)}),
+    ]
+    events = pd.concat(parts, ignore_index=True)
+    events = events.sort_values("timestamp", kind="stable", ignore_index=True)
+    return events.iloc[:n_events].reset_index(drop=True)
+
+
+def warmed_engine(events):
+    engine = RuleEngine(default_rules())
+    for rule in engine.rules:
+        rule.observe(events)
+    return engine
+
+
+def run_batches(engine, events, minutes):
+    """Feed events in fixed time batches; returns the alerts and the seconds spent in process()."""
+    alerts, busy = [], 0.0
+    edges = pd.date_range(events["timestamp"].min().floor(f"{minutes}min"), events["timestamp"].max()
+                          + pd.Timedelta(minutes=minutes), freq=f"{minutes}min")
+    bounds = events["timestamp"].searchsorted(edges, side="right")
+    for lo, hi, now in zip(bounds[:-1], bounds[1:], edges[1:]):
+        found, elapsed = bench_utils.timed(engine.process, events.iloc[lo:hi], now=now)
+        alerts.append(found)
+        busy += elapsed
+    # Let the absence rules judge the tail
+    alerts.append(engine.process(events.iloc[:0], now=edges[-1] + pd.Timedelta(days=1)))
+    return pd.concat(alerts, ignore_index=True), busy
+
+
+def one_pass(engine, events):
+    return engine.process(events, now=events["timestamp"].max() + pd.Timedelta(days=1))
+
+
+def sorted_alerts(alerts):
+    keys = ["rule", "entity_id", "event_time", "location_id"]
+    return alerts.sort_values(keys).reset_index(drop=True)
+
+
+# ---------- per-event reference ----------
+def reference_alerts(events, rules):
+    """(rule, entity_id, event_time, location_id) of every alert, by looping over events."""
+    travel, face, device, no_show = rules
+    by_entity = {e: df for e, df in events.groupby("entity_id")}
+    found = set()
+    moves = events[events["source"].isin(travel.sources)]
+    for entity, mine in moves.groupby("entity_id"):
+        rows = list(mine.itertuples(index=False))
+        for prev, row in zip(rows, rows[1:]):
+            if prev.location_id != row.location_id and row.timestamp - prev.timestamp < travel.min_transit:
+                found.add((travel.name, entity, row.timestamp, row.location_id))
+    for row in events.itertuples(index=False):
+        mine = by_entity[row.entity_id]
+        if row.source == "card" and row.location_id in face.camera_locations and row.entity_id in face.faces:
+            near = mine[(mine["source"] == "frame") & (mine["location_id"] == row.location_id)
+                        & ((mine["timestamp"] - row.timestamp).abs() <= face.window)]
+            if near.empty:
+                found.add((face.name, row.entity_id, row.timestamp, row.location_id))
+        if row.source == "booking" and row.attended == "NO":
+            swipes = mine[(mine["source"] == "card") & (mine["location_id"] == row.location_id)
+                          & (mine["timestamp"] >= row.timestamp)
+                          & (mine["timestamp"] <= min(row.end_time, row.timestamp + no_show.delay))]
+            if len(swipes):
+                found.add((no_show.name, row.entity_id, row.timestamp, row.location_id))
+    seen = set()
+    for row in events[events["source"] == "device"].itertuples(index=False):
+        if row.entity_id not in device.card_holders:
+            continue
+        mine = by_entity[row.entity_id]
+        near = mine[(mine["source"] == "card") & ((mine["timestamp"] - row.timestamp).abs() <= device.window)]
+        bucket = (row.entity_id, row.timestamp.floor(device.window))
+        if near.empty and bucket not in seen:
+            seen.add(bucket)
+            found.add((device.name, row.entity_id, row.timestamp, row.location_id))
+    return found
+
+
+def check_reference(events):
+    engine = warmed_engine(events)
+    alerts = one_pass(engine, events)
+    got = set(zip(alerts["rule"], alerts["entity_id"], pd.to_datetime(alerts["event_time"]), alerts["location_id"]))
+    expected = reference_alerts(events, engine.rules)
+    assert got == expected, (len(got - expected), len(expected - got))
+    return alerts["rule"].value_counts().to_dict()
+
+
+# ---------- database ----------
+def sliced(events, slice_hours, horizon):
+    """detect_anomalies' slices in memory: (lo, hi] from the earliest event up to horizon, each with now=hi."""
+    engine, alerts = RuleEngine(), []
+    lo = events["timestamp"].min() - pd.Timedelta(microseconds=1)
+    while lo < horizon:
+        hi = min(lo + pd.Timedelta(hours=slice_hours), horizon)
+        batch = events[(events["timestamp"] > lo) & (events["timestamp"] <= hi)]
+        alerts.append(engine.process(batch, now=hi))
+        lo = hi
+    return pd.concat(alerts, ignore_index=True)
+
+
+def check_db(n_entities, n_events, days, slice_hours):
+    frames = bench_utils.synthetic_campus(n_entities, n_events, days=days)
+    conn = bench_utils.scratch_connection()
+    state_file = os.path.join(tempfile.mkdtemp(), "anomaly_state.joblib")
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, frames)
+            report, elapsed = bench_utils.timed(anomaly_rules.detect_anomalies, conn, state_file, slice_hours)
+            events, _ = CampusLocationPredictor(source="db").read_events_db(
+                conn=conn, sources=RuleEngine.SOURCES, extra_columns=anomaly_rules.EXTRA_COLUMNS)
+            again = anomaly_rules.detect_anomalies(conn, state_file, slice_hours)
+        assert again["events"] == again["late_events"] == 0, again
+        # The run stops at the latest event every source has reached (anomaly_rules.ingest_horizon)
+        horizon = anomaly_rules.load_engine(state_file).loaded_through
+        expected = sliced(events.sort_values("timestamp", kind="stable", ignore_index=True), slice_hours, horizon)
+        stored = pd.read_sql("SELECT rule, entity_id, event_time, location_id FROM anomaly_alerts", conn)
+        keys = ["rule", "entity_id", "event_time", "location_id"]
+        # Alerts with the same key (e.g. two swipes in one second) are one row in the table
+        expected = expected.drop_duplicates(keys)
+        pd.testing.assert_frame_equal(sorted_alerts(stored)[keys], sorted_alerts(expected)[keys], check_dtype=False)
+        print(f"db: {report['events']:,} events over {days} days in {report['slices']} slices -> "
+              f"{len(stored):,} alerts, identical to the same slices in memory; a second run reads nothing; "
+              f"{elapsed:.1f}s end to end")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--hours", type=float, default=1.0, help="hours the synthetic events span")
+    parser.add_argument("--batch-minutes", type=int, default=5)
+    parser.add_argument("--reference-events", type=int, default=20_000)
+    parser.add_argument("--db", action="store_true", help="also check detect_anomalies against Postgres")
+    parser.add_argument("--db-entities", type=int, default=2_000)
+    parser.add_argument("--db-events", type=int, default=200_000)
+    parser.add_argument("--db-days", type=int, default=7)
+    parser.add_argument("--slice-hours", type=float, default=24)
+    args = parser.parse_args()
+
+    sample = synthetic_events(args.reference_events, n_entities=500, hours=2, seed=1)
+    counts = check_reference(sample)
+    print(f"reference: {len(sample):,} events, alerts identical to a per-event loop {counts}")
+
+    rows = []
+    for n_events in args.events:
+        events = synthetic_events(n_events, hours=args.hours)
+        expected = sorted_alerts(one_pass(warmed_engine(events), events))
+        (alerts, busy), _ = bench_utils.timed(run_batches, warmed_engine(events), events, args.batch_minutes)
+        pd.testing.assert_frame_equal(sorted_alerts(alerts), expected, check_dtype=False)
+        rows.append((n_events, len(alerts), busy))
+        print(f"{n_events:,} events: batches of {args.batch_minutes} min give the same {len(alerts):,} alerts "
+              f"as one pass; {busy:.2f}s in process()", flush=True)
+
+    print(f"\n{'events':>12}{'alerts':>10}{'seconds':>10}{'events/s':>12}{'events/h covered':>18}")
+    for n_events, n_alerts, busy in rows:
+        print(f"{n_events:>12,}{n_alerts:>10,}{busy:>10.2f}{n_events / busy:>12,.0f}"
+              f"{n_events / args.hours:>18,.0f}")
+
+    if args.db:
+        check_db(args.db_entities, args.db_events, args.db_days, args.slice_hours)
+
+
+if __name__ == "__main__":
+    main()
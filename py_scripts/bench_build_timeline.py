@@ -0,0 +1,243 @@
+"""
+Benchmark for get_info.build_timeline: per-row iterrows vs. the vectorised builder.
+
+Seeds a scratch schema of the local Postgres configured in .env with a profile
+table and one heavy entity with tens of thousands of events, fetches its
+timeline once and then times both builders on the same rows. The two outputs
+are compared record by record before any timings are printed.
+
+    python bench_build_timeline.py --profiles 5000 --events 10000
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import numpy as np
+import pandas as pd
+from psycopg2 import pool
+import bench_utils
+import get_info
+
+
+def legacy_build_timeline(entity_dir, entity_id, conn_main, save_to_disk=True, data_dict=None):
+    """get_info.build_timeline before vectorisation, kept verbatim as the reference.
+    
+    Args:
+        entity_dir: directory path (only used when save_to_disk=True)
+        entity_id: the entity ID
+        conn_main: database connection
+        save_to_disk: whether to save timeline to disk
+        data_dict: dict mapping table names to dataframes (used when save_to_disk=False)
+    """
+    timeline_records = []
+
+    schema = [
+        "source", "event_id", "entity_id", "face_id", "card_id",
+        "device_hash", "location_id", "room_id", "ap_id", "book_id",
+        "category", "text", "start_time", "end_time", "timestamp",
+        "name", "summary"
+    ]
+
+    cur = conn_main.cursor()
+    try:
+        cur.execute("SELECT entity_id, card_id, device_hash, face_id, name FROM student_or_staff_profiles")
+        all_profiles = cur.fetchall()
+        cols = [desc[0] for desc in cur.description]
+        profiles_df = pd.DataFrame(all_profiles, columns=cols)
+    finally:
+        cur.close()
+
+    def get_names_by_field(field, value):
+        if value is None: return None
+        matches = profiles_df.loc[profiles_df[field] == value, "name"].unique()
+        return ", ".join(matches) if len(matches) > 0 else None
+
+    # Get data from either CSV files or passed data_dict
+    table_data = {}
+    if save_to_disk and entity_dir:
+        csv_files = glob.glob(os.path.join(entity_dir, "*.csv"))
+        for file in csv_files:
+            table = os.path.splitext(os.path.basename(file))[0]
+            table_data[table] = pd.read_csv(file)
+    elif data_dict:
+        table_data = data_dict
+    else:
+        # No data available
+        return []
+
+    for table, df in table_data.items():
+        if df.empty:
+            continue
+
+        if table == "lab_bookings":
+            for _, row in df.iterrows():
+                name = get_names_by_field("entity_id", row.get("entity_id"))
+                timeline_records.append({
+                    "source": table,
+                    "event_id": row.get("booking_id"),
+                    "entity_id": row.get("entity_id"),
+                    "room_id": row.get("room_id"),
+                    "start_time": row.get("start_time"),
+                    "end_time": row.get("end_time"),
+                    "timestamp": row.get("start_time"),
+                    "name": name,
+                    "summary": f"🧑‍🔬 {name} booked Room {row.get('room_id')} from {row.get('start_time')} to {row.get('end_time')}"
+                })
+
+        elif table == "wifi_associations_logs":
+            for _, row in df.iterrows():
+                name = get_names_by_field("device_hash", row.get("device_hash"))
+                timeline_records.append({
+                    "source": table,
+                    "device_hash": row.get("device_hash"),
+                    "ap_id": row.get("ap_id"),
+                    "timestamp": row.get("timestamp"),
+                    "name": name,
+                    "summary": f"{name} connected to WiFi AP {row.get('ap_id')} at {row.get('timestamp')}"
+                })
+
+        elif table == "library_checkouts":
+            for _, row in df.iterrows():
+                name = get_names_by_field("entity_id", row.get("entity_id"))
+                timeline_records.append({
+                    "source": table,
+                    "event_id": row.get("checkout_id"),
+                    "entity_id": row.get("entity_id"),
+                    "book_id": row.get("book_id"),
+                    "timestamp": row.get("timestamp"),
+                    "name": name,
+                    "summary": f"{name} checked out Book {row.get('book_id')} at {row.get('timestamp')}"
+                })
+
+        elif table == "free_text_notes":
+            for _, row in df.iterrows():
+                name = get_names_by_field("entity_id", row.get("entity_id"))
+                timeline_records.append({
+                    "source": table,
+                    "event_id": row.get("note_id"),
+                    "entity_id": row.get("entity_id"),
+                    "category": row.get("category"),
+                    "text": row.get("text"),
+                    "timestamp": row.get("timestamp"),
+                    "name": name,
+                    "summary": f"Note for {name}: {row.get('category')} - \"{row.get('text')}\""
+                })
+
+        elif table == "cctv_frames":
+            for _, row in df.iterrows():
+                name = get_names_by_field("face_id", row.get("face_id"))
+                timeline_records.append({
+                    "source": table,
+                    "event_id": row.get("frame_id"),
+                    "face_id": row.get("face_id"),
+                    "location_id": row.get("location_id"),
+                    "timestamp": row.get("timestamp"),
+                    "name": name,
+                    "summary": f"🎥 {name} seen in CCTV at {row.get('location_id')} on {row.get('timestamp')}"
+                })
+
+        elif table == "campus_card_swipes":
+            for _, row in df.iterrows():
+                names = get_names_by_field("card_id", row.get("card_id"))
+                timeline_records.append({
+                    "source": table,
+                    "card_id": row.get("card_id"),
+                    "location_id": row.get("location_id"),
+                    "timestamp": row.get("timestamp"),
+                    "name": names,
+                    "summary": f"Card {row.get('card_id')} (used by {names}) swiped at {row.get('location_id')} on {row.get('timestamp')}"
+                })
+    
+
+    timeline_df = pd.DataFrame(timeline_records, columns=schema)
+    timeline_df["timeline_timestamp"] = pd.to_datetime(
+        timeline_df["timestamp"].fillna(timeline_df["start_time"]),
+        errors="coerce"
+    )
+    timeline_df = timeline_df.sort_values("timeline_timestamp")
+    
+    if save_to_disk and entity_dir:
+        out_path = os.path.join(entity_dir, f"entity_{entity_id}_timeline.csv")
+        timeline_df.to_csv(out_path, index=False)
+        print(f"Timeline saved: {out_path}")
+    
+    # timeline_df is your DataFrame
+    timeline_df = timeline_df.replace({np.nan: None, np.inf: None, -np.inf: None})
+
+    # Convert to list of dicts for JSON
+    timeline_list = timeline_df.to_dict(orient="records")
+    return timeline_list
+
+
+def same_records(current, legacy):
+    """Compare two timelines; the old unstable sort leaves the order of equal timestamps unspecified."""
+    keys = ["timeline_timestamp", "source", "event_id", "summary"]
+    frames = [pd.DataFrame(records).sort_values(keys, kind="stable").reset_index(drop=True)
+              for records in (current, legacy)]
+    return frames[0].equals(frames[1])
+
+
+def heavy_entity_frames(n_profiles, n_events):
+    """Synthetic campus with n_events card swipes and wifi logs (a fifth of that for other sources) for E000001."""
+    frames = bench_utils.synthetic_campus(n_profiles, n_profiles)
+    heavy = frames["student_or_staff_profiles"].iloc[:1]
+    extra = bench_utils.synthetic_campus(1, n_events, seed=11)
+    for table, df in extra.items():
+        if table == "student_or_staff_profiles":
+            continue
+        df = df.copy()
+        for field in ("entity_id", "card_id", "device_hash", "face_id"):
+            if field in df.columns:
+                df[field] = heavy[field].iloc[0]
+        for id_col in ("frame_id", "booking_id", "checkout_id", "note_id"):
+            if id_col in df.columns:
+                df[id_col] = "X" + df[id_col]
+        frames[table] = pd.concat([frames[table], df], ignore_index=True)
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=10_000, help="card swipe and wifi rows of the heavy entity")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, heavy_entity_frames(args.profiles, args.events))
+        get_info._main_pool = pool.SimpleConnectionPool(1, 2, **bench_utils.scratch_params())
+        conn_main = get_info.connect_main()
+        cur = conn_main.cursor()
+        profile, events = get_info.fetch_entity_timeline(cur, {"entity_id": "E000001"})
+        cur.close()
+        data_dict = get_info.split_timeline_sources(events)
+        print(f"E000001: {len(events)} events, {args.profiles} profiles")
+
+        current = get_info.build_timeline(None, "E000001", conn_main, save_to_disk=False, events=events)
+        legacy = legacy_build_timeline(None, "E000001", conn_main, save_to_disk=False, data_dict=data_dict)
+        assert same_records(current, legacy), "vectorised timeline differs from the iterrows one"
+
+        timings = {"iterrows": [], "vectorised": []}
+        for _ in range(args.repeat):
+            timings["iterrows"].append(bench_utils.timed(
+                legacy_build_timeline, None, "E000001", conn_main, save_to_disk=False, data_dict=data_dict)[1])
+            timings["vectorised"].append(bench_utils.timed(
+                get_info.build_timeline, None, "E000001", conn_main, save_to_disk=False, events=events)[1])
+
+        print(f"\n{'builder':<12}{'events':>10}{'best ms':>12}")
+        for name, samples in timings.items():
+            print(f"{name:<12}{len(events):>10}{min(samples) * 1000:>12.1f}")
+        print(f"speed-up: {min(timings['iterrows']) / min(timings['vectorised']):.0f}x")
+    finally:
+        if get_info._main_pool:
+            get_info._main_pool.closeall()
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark for CampusLocationPredictor.build_feature_matrix_and_cluster: dense
+KMeans vs. the scalable modes (sparse one-hot features, SVD, MiniBatchKMeans).
+
+Builds synthetic aggregated_data (what temporal_aggregation produces) for a
+semester of 2h windows: every entity follows one of --archetypes weekly
+schedules (timetables) with personal noise. For each size and mode it reports
+wall time, the peak memory traced while building features and clustering, the
+size of the feature matrix, and the adjusted Rand index of the clusters against
+the archetypes (1.0 = schedules recovered exactly). The dense mode is skipped
+past --dense-max-entities.
+
+    python bench_clustering.py --entities 2000 10000 30000 60000
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import adjusted_rand_score
+import bench_utils
+from prediction_pipeline import CampusLocationPredictor
+
+PLACES = np.array(bench_utils.LOCATIONS + bench_utils.ACCESS_POINTS + bench_utils.ROOMS, dtype=object)
+
+# name -> CampusLocationPredictor parameters
+MODES = {
+    "dense+kmeans": dict(features="dense", clusterer="kmeans"),
+    "onehot+kmeans": dict(features="onehot", clusterer="kmeans"),
+    "onehot+minibatch": dict(features="onehot", clusterer="minibatch"),
+    "onehot+svd50+minibatch": dict(features="onehot", svd_components=50, clusterer="minibatch"),
+}
+
+
+def synthetic_aggregated(n_entities, n_archetypes=12, weeks=16, time_window_hours=2, seed=0):
+    """aggregated_data-shaped rows and each entity's archetype.
+
+    An archetype is present in a weekly slot with some probability and then at one
+    place; entities skip a slot now and then and go somewhere else 30% of the time.
+    """
+    rng = np.random.default_rng(seed)
+    slots = 7 * 24 // time_window_hours
+    n_windows = weeks * slots
+    presence = rng.random((n_archetypes, slots)) * (rng.random((n_archetypes, slots)) < 0.5)
+    place = rng.integers(0, len(PLACES), size=(n_archetypes, slots))
+
+    archetype = rng.integers(0, n_archetypes, size=n_entities)
+    slot = np.arange(n_windows) % slots
+    entity, window = np.nonzero(rng.random((n_entities, n_windows)) < presence[archetype][:, slot] * 0.9)
+    location = np.where(rng.random(len(entity)) < 0.7,
+                        place[archetype[entity], slot[window]],
+                        rng.integers(0, len(PLACES), size=len(entity)))
+    entity_ids = np.array([f"E{i:06d}" for i in range(n_entities)], dtype=object)
+    windows = pd.date_range("2025-01-06", periods=n_windows, freq=f"{time_window_hours}h")
+    aggregated = pd.DataFrame({
+        "entity_id": entity_ids[entity],
+        "time_window": windows[window],
+        "location_id": PLACES[location],
+        "sources": "card",
+        "event_count": 1,
+    })
+    return aggregated, dict(zip(entity_ids, archetype))
+
+
+def matrix_mb(X):
+    if sparse.issparse(X):
+        return (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2**20
+    return X.values.nbytes / 2**20
+
+
+def run_mode(aggregated, archetypes, n_clusters, params):
+    predictor = CampusLocationPredictor(n_clusters=n_clusters, **params)
+    predictor.aggregated_data = aggregated
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        clusters = predictor.build_feature_matrix_and_cluster()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    assert len(clusters) == len(archetypes), "every entity must get a cluster"
+    entities = list(archetypes)
+    ari = adjusted_rand_score([archetypes[e] for e in entities], [clusters[e] for e in entities])
+    return seconds, peak, matrix_mb(predictor.feature_matrix), ari
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, nargs="+", default=[2_000, 10_000, 30_000, 60_000])
+    parser.add_argument("--weeks", type=int, default=16, help="semester length")
+    parser.add_argument("--archetypes", type=int, default=12, help="distinct weekly schedules (and clusters fitted)")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--dense-max-entities", type=int, default=30_000,
+                        help="largest size the dense mode is run at")
+    args = parser.parse_args()
+
+    rows = []
+    for n_entities in args.entities:
+        aggregated, archetypes = synthetic_aggregated(n_entities, args.archetypes, args.weeks)
+        print(f"{n_entities:,} entities, {aggregated['time_window'].nunique():,} windows, "
+              f"{len(aggregated):,} entity-windows", flush=True)
+        for mode in args.modes:
+            if MODES[mode]["features"] == "dense" and n_entities > args.dense_max_entities:
+                rows.append((n_entities, mode, None, None, None, None))
+                continue
+            seconds, peak, mb, ari = run_mode(aggregated, archetypes, args.archetypes, MODES[mode])
+            rows.append((n_entities, mode, seconds, peak, mb, ari))
+            print(f"  {mode}: {seconds:.1f}s, peak {peak:,.0f} MB, features {mb:,.0f} MB, ARI {ari:.3f}", flush=True)
+        del aggregated
+
+    print(f"\n{'entities':>9}  {'mode':<24}{'seconds':>9}{'peak MB':>10}{'matrix MB':>11}{'ARI':>7}")
+    for n_entities, mode, seconds, peak, mb, ari in rows:
+        if seconds is None:
+            print(f"{n_entities:>9,}  {mode:<24}{'-':>9}{'-':>10}{'-':>11}{'-':>7}")
+        else:
+            print(f"{n_entities:>9,}  {mode:<24}{seconds:>9.1f}{peak:>10,.0f}{mb:>11,.1f}{ari:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Throughput benchmark for db_insert: per-row inserts vs. COPY + staging merge.
+
+Loads synthetic campus_card_swipes and wifi_associations_logs into a scratch
+schema of the local Postgres configured in .env and prints rows/sec per mode.
+
+    python bench_db_insert.py --rows 50000
+"""
+import argparse
+import bench_utils
+from db_insert import insert_dataframe, copy_dataframe
+
+MODES = {
+    'row': insert_dataframe,
+    'copy': copy_dataframe,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help='rows per table')
+    parser.add_argument('--entities', type=int, default=5_000)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    profiles = bench_utils.synthetic_profiles(args.entities)
+    frames = {
+        'campus_card_swipes': bench_utils.synthetic_card_swipes(args.rows, profiles),
+        'wifi_associations_logs': bench_utils.synthetic_wifi_logs(args.rows, profiles),
+    }
+
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        results = []
+        for table, df in frames.items():
+            for mode in args.modes:
+                bench_utils.truncate(conn, table)
+                _, elapsed = bench_utils.timed(MODES[mode], df, table, conn)
+                results.append((table, mode, len(df), elapsed))
+
+        print(f"\n{'table':<26}{'mode':<6}{'rows':>10}{'seconds':>10}{'rows/sec':>12}")
+        for table, mode, rows, elapsed in results:
+            print(f"{table:<26}{mode:<6}{rows:>10}{elapsed:>10.2f}{rows / elapsed:>12,.0f}")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for loading training events: the CSV loader (read_events) vs. reading
+the Postgres tables (read_events_db, COPY into typed frames).
+
+Seeds a scratch schema of the local Postgres configured in .env with
+bench_utils.synthetic_campus, writes the same rows to the CSV files the loader
+looks for, and checks before printing timings that
+
+ - both loaders return the same merged events (entity_id, timestamp,
+   location_id, source), row order aside, and the same per-source row and mapped counts
+ - a read of the last --range-days equals the CSV events within that range
+
+    python bench_db_training_load.py --entities 5000 --events 1000000
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import pandas as pd
+import bench_utils
+from prediction_pipeline import CampusLocationPredictor
+
+# table -> file name read_events looks for first
+CSV_FILES = {
+    "student_or_staff_profiles": "student or staff profiles.csv",
+    "free_text_notes": "free_text_notes (helpdesk or RSVPs).csv",
+    "wifi_associations_logs": "wifi_associations_logs.csv",
+    "lab_bookings": "lab_bookings.csv",
+    "cctv_frames": "cctv_frames.csv",
+    "campus_card_swipes": "campus card_swipes.csv",
+    "library_checkouts": "library_checkouts.csv",
+}
+
+
+def sorted_events(events):
+    keys = ['entity_id', 'timestamp', 'source', 'location_id']
+    return events[keys].sort_values(keys, kind="stable").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=1_000_000, help="card swipe and wifi rows")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--range-days", type=int, default=7, help="length of the time-range read checked")
+    args = parser.parse_args()
+
+    frames = bench_utils.synthetic_campus(args.entities, args.events, days=args.days)
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, frames)
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            for table, df in frames.items():
+                df.to_csv(os.path.join(data_dir, CSV_FILES[table]), index=False)
+            predictor = CampusLocationPredictor(data_dir=data_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                (csv_events, csv_report), csv_s = bench_utils.timed(predictor.read_events, data_dir)
+                (db_events, db_report), db_s = bench_utils.timed(predictor.read_events_db, conn=conn)
+
+        pd.testing.assert_frame_equal(sorted_events(db_events), sorted_events(csv_events))
+        pd.testing.assert_frame_equal(db_report[['rows', 'mapped']], csv_report[['rows', 'mapped']])
+
+        end = pd.Timestamp("2025-01-01") + pd.Timedelta(days=args.days)
+        start = end - pd.Timedelta(days=args.range_days)
+        with contextlib.redirect_stdout(io.StringIO()):
+            (range_events, _), range_s = bench_utils.timed(predictor.read_events_db, start, end, conn=conn)
+        in_range = csv_events[(csv_events['timestamp'] >= start) & (csv_events['timestamp'] < end)]
+        pd.testing.assert_frame_equal(sorted_events(range_events), sorted_events(in_range))
+        print(f"{len(csv_events):,} events: CSV and database loads identical; "
+              f"last {args.range_days} days ({len(range_events):,} events) identical")
+
+        print(f"\n{'loader':<24}{'events':>12}{'seconds':>10}")
+        print(f"{'csv':<24}{len(csv_events):>12,}{csv_s:>10.2f}")
+        print(f"{'db':<24}{len(db_events):>12,}{db_s:>10.2f}")
+        print(f"{f'db, last {args.range_days} days':<24}{len(range_events):>12,}{range_s:>10.2f}")
+        print(f"speed-up: {csv_s / db_s:.1f}x")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Benchmark for deviation scoring (CampusLocationPredictor.score_observations and
+deviation_scores.py).
+
+Trains the predictor on --days of synthetic merged events
+(bench_temporal_aggregation.synthetic_merged) and scores the day after them,
+drawn from the same entities' favourite places.
+Before printing timings it checks that, on --reference observations drawn from
+the new day, the training days, unseen locations and unknown entities, every
+probability and method equals a per-row lookup in cluster_prob_table,
+cluster_prior and global_location_prior.
+
+Timings are for deviation_scores.observations (count per entity, window and
+location, then score) over a full day of events of each --events size. With
+--db it also seeds a scratch schema (bench_utils.synthetic_campus) without a
+tenth of the last day's swipes and wifi associations, trains on all but the
+last day, runs score_new_events, then loads the held back rows late and runs
+it again. It checks deviation_scores against the whole last day scored in
+memory (so late rows are scored and windows scored twice are not counted
+twice), and that a third run scores nothing.
+
+    python bench_deviation_scores.py --events 1000000 5000000 --db
+"""
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import bench_utils
+import deviation_scores
+from bench_incremental_update import trained
+from bench_temporal_aggregation import synthetic_merged
+from db_insert import copy_dataframe
+from prediction_pipeline import CampusLocationPredictor
+
+
+def split_last_day(events):
+    """Training events and the last day of events, which the model has not seen."""
+    cutoff = events['timestamp'].max().floor('D')
+    before = events['timestamp'] < cutoff
+    return events[before].reset_index(drop=True), events[~before].reset_index(drop=True)
+
+
+def full_day(held_out, n_events, seed):
+    """n_events drawn from the held-out day's entity/location pairs, spread over that day."""
+    rng = np.random.default_rng(seed)
+    new = held_out.sample(n_events, replace=True, random_state=seed).reset_index(drop=True)
+    new['timestamp'] = (held_out['timestamp'].min().floor('D')
+                        + pd.to_timedelta(rng.integers(0, 86_400, size=n_events), unit="s"))
+    return new
+
+
+# ---------- per-row reference ----------
+def reference_score(model, by_cluster, entity, timestamp, location):
+    """(probability, method) by filtering the model's tables for one observation."""
+    cluster = model.entity_clusters.get(entity)
+    if cluster is None:
+        return np.nan, 'entity_not_found'
+    step = pd.Timedelta(hours=model.time_window_hours)
+    window = timestamp.floor(step)
+    last, method = model.cluster_prob_table['time_window'].max(), 'probabilistic_generalization'
+    if window > last:
+        window -= (window - last).ceil('D')
+        method = 'previous_day_window'
+    mine = by_cluster.get(cluster, model.cluster_prob_table.iloc[:0])
+    exact = mine[mine['time_window'] == window]
+    if len(exact):
+        return float(exact.loc[exact['location_id'] == location, 'prob'].sum()), method
+    num = den = 0.0
+    for offset in range(-model.nearby_window_radius, model.nearby_window_radius + 1):
+        near = mine[mine['time_window'] == window + offset * step]
+        if len(near):
+            weight = model._decay_weight(offset * model.time_window_hours)
+            num += weight * near.loc[near['location_id'] == location, 'prob'].sum()
+            den += weight * near['prob'].sum()
+    if den > 0:
+        return num / den, method
+    prior = model.cluster_prior[model.cluster_prior['cluster'] == cluster]
+    if len(prior):
+        return float(prior.loc[prior['location_id'] == location, 'prob'].sum()), 'cluster_prior'
+    if len(model.global_location_prior):
+        return float(model.global_location_prior.get(location, 0.0)), 'global_prior'
+    return np.nan, 'no_data'
+
+
+def check_reference(model, train, new, n, seed=1):
+    by_cluster = dict(list(model.cluster_prob_table.groupby('cluster')))
+    rng = np.random.default_rng(seed)
+    sample = pd.concat([new.sample(n // 2, random_state=seed), train.sample(n // 4, random_state=seed)],
+                       ignore_index=True)
+    odd = sample.sample(n // 4, random_state=seed + 1).reset_index(drop=True)
+    odd['location_id'] = np.where(rng.random(len(odd)) < 0.5, "NOWHERE", odd['location_id'])
+    odd['entity_id'] = np.where(rng.random(len(odd)) < 0.2, "NOBODY", odd['entity_id'])
+    sample = pd.concat([sample, odd], ignore_index=True)
+
+    scores = model.score_observations(sample['entity_id'], sample['timestamp'], sample['location_id'])
+    expected = [reference_score(model, by_cluster, e, t, l)
+                for e, t, l in zip(sample['entity_id'], sample['timestamp'], sample['location_id'])]
+    expected_p = np.array([p for p, _ in expected])
+    assert list(scores['method']) == [m for _, m in expected]
+    # prob is float32 in the lookup
+    np.testing.assert_allclose(scores['probability'], expected_p, rtol=1e-6, atol=1e-7)
+    return scores['method'].value_counts().to_dict()
+
+
+# ---------- database ----------
+def check_db(n_entities, n_events, days):
+    frames = bench_utils.synthetic_campus(n_entities, n_events, days=days)
+    late = {}
+    rng = np.random.default_rng(7)
+    for table in ('campus_card_swipes', 'wifi_associations_logs'):
+        df = frames[table]
+        times = pd.to_datetime(df['timestamp'])
+        held = (times >= times.max().floor('D')) & (rng.random(len(df)) < 0.1)
+        frames[table], late[table] = df[~held], df[held]
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, frames)
+            model = CampusLocationPredictor(source="db")
+            events, _ = model.read_events_db(conn=conn)
+            cutoff = events['timestamp'].max().floor('D')
+            model.merged_data = events[events['timestamp'] < cutoff].reset_index(drop=True)
+            model.temporal_aggregation()
+            model.build_feature_matrix_and_cluster()
+            model.build_cluster_prob_table()
+            conn.cursor().execute(f"DELETE FROM {deviation_scores.SCORES_TABLE}")
+            report, elapsed = bench_utils.timed(deviation_scores.score_new_events, conn, model)
+            for table, df in late.items():
+                copy_dataframe(df, table, conn)
+            late_report = deviation_scores.score_new_events(conn, model)
+            again = deviation_scores.score_new_events(conn, model)
+            events, _ = model.read_events_db(conn=conn)
+        assert again['events'] == 0, again
+        stored = pd.read_sql(f"SELECT * FROM {deviation_scores.SCORES_TABLE}", conn)
+        horizon = stored['last_seen'].max()
+        # Windows are scored whole, from the one holding the model's latest event
+        first = model.next_event_time().floor(pd.Timedelta(hours=model.time_window_hours))
+        new = events[(events['timestamp'] >= first) & (events['timestamp'] <= horizon)]
+        expected = deviation_scores.observations(model, new)
+        keys = ['entity_id', 'time_window', 'location_id']
+        stored = stored.sort_values(keys).reset_index(drop=True)
+        expected = expected.sort_values(keys).reset_index(drop=True)
+        pd.testing.assert_frame_equal(stored[keys], expected[keys], check_dtype=False)
+        for column in ('event_count', 'method'):
+            assert (stored[column].to_numpy() == expected[column].to_numpy()).all(), column
+        np.testing.assert_allclose(stored['probability'], expected['probability'], rtol=1e-6)
+        print(f"db: {report['events']:,} events of the last day -> {len(stored):,} scored observations, "
+              f"{report['anomalous']:,} below {deviation_scores.DEVIATION_THRESHOLD}; "
+              f"{sum(map(len, late.values())):,} rows loaded late, their windows re-read "
+              f"({late_report['events']:,} events); identical to scoring the whole day in memory; "
+              f"a third run scores nothing; {elapsed:.1f}s end to end")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train-events", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=14, help="days the training events span")
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 5_000_000],
+                        help="events in the scored day")
+    parser.add_argument("--reference", type=int, default=4_000)
+    parser.add_argument("--db", action="store_true", help="also check score_new_events against Postgres")
+    parser.add_argument("--db-entities", type=int, default=2_000)
+    parser.add_argument("--db-events", type=int, default=200_000)
+    parser.add_argument("--db-days", type=int, default=7)
+    args = parser.parse_args()
+
+    train, held_out = split_last_day(synthetic_merged(args.train_events, days=args.days + 1))
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = trained(train)
+    counts = check_reference(model, train, held_out, args.reference)
+    print(f"reference: {args.reference:,} observations identical to a per-row table lookup {counts}")
+
+    rows = []
+    for n_events in args.events:
+        new = full_day(held_out, n_events, seed=3)
+        scores, seconds = bench_utils.timed(deviation_scores.observations, model, new)
+        flagged = int((scores['probability'] < deviation_scores.DEVIATION_THRESHOLD).sum())
+        rows.append((n_events, len(scores), flagged, seconds))
+        print(f"{n_events:,} events of one day -> {len(scores):,} observations in {seconds:.2f}s", flush=True)
+
+    print(f"\n{'events':>12}{'observations':>14}{'flagged':>10}{'seconds':>10}{'events/s':>12}")
+    for n_events, n_obs, flagged, seconds in rows:
+        print(f"{n_events:>12,}{n_obs:>14,}{flagged:>10,}{seconds:>10.2f}{n_events / seconds:>12,.0f}")
+
+    if args.db:
+        check_db(args.db_entities, args.db_events, args.db_days)
+
+
+if __name__ == "__main__":
+    main()
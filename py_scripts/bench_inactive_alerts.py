@@ -0,0 +1,183 @@
+"""
+Benchmark for /alerts/inactive: the six-way UNION ALL over the whole event
+history vs. the entity_last_activity table the insert triggers keep current.
+
+Seeds a scratch schema of the local Postgres configured in .env with
+--days of history (bench_utils.synthetic_campus). Some profiles are held back
+and inserted after their events (the profile trigger has to find their
+history), plus some that never had any activity. Before printing timings it
+checks that
+
+ - entity_last_activity equals the aggregate over every source
+ - both queries return the same inactive entities and last activity, never-active
+   entities last
+
+It also times loading --ingest-rows more card swipes with the trigger enabled
+and disabled, i.e. what keeping the table current costs at ingest.
+
+    python bench_inactive_alerts.py --entities 5000 --events 2000000 --days 365
+"""
+import argparse
+import contextlib
+import io
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import bench_utils
+import get_info
+
+# get_info.INACTIVE_ENTITIES_SQL before entity_last_activity, kept verbatim as the reference
+LEGACY_INACTIVE_ENTITIES_SQL = """
+WITH all_events AS (
+    -- WiFi associations
+    SELECT p.entity_id, w.timestamp
+    FROM wifi_associations_logs w
+    JOIN student_or_staff_profiles p ON w.device_hash = p.device_hash
+    WHERE p.device_hash IS NOT NULL
+
+    UNION ALL
+
+    -- Library checkouts
+    SELECT entity_id, timestamp
+    FROM library_checkouts
+
+    UNION ALL
+
+    -- Lab bookings
+    SELECT entity_id, start_time AS timestamp
+    FROM lab_bookings
+
+    UNION ALL
+
+    -- Free text notes
+    SELECT entity_id, timestamp
+    FROM free_text_notes
+
+    UNION ALL
+
+    -- CCTV frames
+    SELECT p.entity_id, c.timestamp
+    FROM cctv_frames c
+    JOIN student_or_staff_profiles p ON c.face_id = p.face_id
+    WHERE p.face_id IS NOT NULL
+
+    UNION ALL
+
+    -- Campus card swipes
+    SELECT p.entity_id, s.timestamp
+    FROM campus_card_swipes s
+    JOIN student_or_staff_profiles p ON s.card_id = p.card_id
+    WHERE p.card_id IS NOT NULL
+),
+entity_last_activity AS (
+    SELECT
+        entity_id,
+        MAX(timestamp) AS last_activity
+    FROM all_events
+    GROUP BY entity_id
+)
+SELECT
+    p.entity_id,
+    p.card_id,
+    p.role,
+    p.department,
+    p.name,
+    COALESCE(ela.last_activity, NULL) AS last_activity
+FROM student_or_staff_profiles p
+LEFT JOIN entity_last_activity ela ON p.entity_id = ela.entity_id
+WHERE ela.last_activity IS NULL OR ela.last_activity < %(since)s
+ORDER BY ela.last_activity NULLS LAST
+"""
+
+
+def fetch(conn, sql, params=None):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    cols = [desc[0] for desc in cur.description]
+    rows = cur.fetchall()
+    cur.close()
+    conn.commit()
+    return pd.DataFrame(rows, columns=cols)
+
+
+def same_rows(a, b, keys):
+    return a.sort_values(keys).reset_index(drop=True).equals(b.sort_values(keys).reset_index(drop=True))
+
+
+def timed_load(conn, df, trigger_enabled):
+    cur = conn.cursor()
+    cur.execute(f"ALTER TABLE campus_card_swipes {'ENABLE' if trigger_enabled else 'DISABLE'} TRIGGER last_activity_card")
+    conn.commit()
+    cur.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, seconds = bench_utils.timed(bench_utils.copy_dataframe, df, "campus_card_swipes", conn)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=2_000_000, help="card swipe and wifi rows")
+    parser.add_argument("--days", type=int, default=365, help="length of the history")
+    parser.add_argument("--hours", type=float, default=get_info.INACTIVE_HOURS, help="inactivity threshold")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ingest-rows", type=int, default=100_000, help="card swipes loaded to time the trigger")
+    args = parser.parse_args()
+
+    start = pd.Timestamp("2025-01-01")
+    frames = bench_utils.synthetic_campus(args.entities, args.events, start=str(start.date()), days=args.days)
+    profiles = frames["student_or_staff_profiles"]
+    held_back = profiles.tail(args.entities // 20)
+    frames["student_or_staff_profiles"] = profiles.drop(held_back.index)
+    never_active = bench_utils.synthetic_profiles(args.entities + args.entities // 50).iloc[args.entities:]
+
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, seed_s = bench_utils.timed(bench_utils.seed_scratch_schema, conn, frames)
+            bench_utils.copy_dataframe(pd.concat([held_back, never_active]), "student_or_staff_profiles", conn)
+        n_events = sum(len(df) for table, df in frames.items() if table != "student_or_staff_profiles")
+        print(f"{n_events:,} events over {args.days} days, {args.entities + len(never_active):,} profiles "
+              f"(seeded in {seed_s:.0f}s)")
+
+        # The table must hold exactly what the full aggregate computes
+        everything = fetch(conn, LEGACY_INACTIVE_ENTITIES_SQL, {"since": datetime.max})
+        table = fetch(conn, "SELECT entity_id, last_activity FROM entity_last_activity")
+        assert same_rows(everything[["entity_id", "last_activity"]], table, ["entity_id"]), \
+            "entity_last_activity differs from the aggregate over every source"
+
+        since = (start + pd.Timedelta(days=args.days) - pd.Timedelta(hours=args.hours)).to_pydatetime()
+        legacy = fetch(conn, LEGACY_INACTIVE_ENTITIES_SQL, {"since": since})
+        current = fetch(conn, get_info.INACTIVE_ENTITIES_SQL, {"since": since})
+        assert same_rows(current, legacy, ["entity_id"]), "inactive entities differ"
+        active = current["last_activity"].notna().sum()
+        assert current["last_activity"].iloc[:active].is_monotonic_increasing, "not ordered by last activity"
+        assert current["last_activity"].iloc[active:].isna().all(), "never-active entities not last"
+        print(f"inactive for {args.hours:g}h: {len(current):,} entities ({len(never_active):,} never active), identical")
+
+        timings = {"union all": [], "entity_last_activity": []}
+        for _ in range(args.repeat):
+            timings["union all"].append(bench_utils.timed(fetch, conn, LEGACY_INACTIVE_ENTITIES_SQL, {"since": since})[1])
+            timings["entity_last_activity"].append(
+                bench_utils.timed(fetch, conn, get_info.INACTIVE_ENTITIES_SQL, {"since": since})[1])
+
+        next_day = str((start + pd.Timedelta(days=args.days)).date())
+        without_s = timed_load(conn, bench_utils.synthetic_card_swipes(
+            args.ingest_rows, profiles, start=next_day, days=1, seed=10), trigger_enabled=False)
+        with_s = timed_load(conn, bench_utils.synthetic_card_swipes(
+            args.ingest_rows, profiles, start=next_day, days=1, seed=11), trigger_enabled=True)
+
+        print(f"\n{'query':<24}{'median ms':>12}{'best ms':>10}")
+        for name, samples in timings.items():
+            print(f"{name:<24}{bench_utils.percentile_ms(samples, 50):>12.1f}{min(samples) * 1000:>10.1f}")
+        print(f"speed-up: {np.median(timings['union all']) / np.median(timings['entity_last_activity']):.0f}x")
+        print(f"\nloading {args.ingest_rows:,} card swipes: {without_s * 1000:.0f} ms without the trigger, "
+              f"{with_s * 1000:.0f} ms with it")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
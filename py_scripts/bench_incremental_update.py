@@ -0,0 +1,86 @@
+"""
+Benchmark for CampusLocationPredictor.update_from_events: folding the last hour of
+events into a trained model vs. retraining on everything.
+
+For each size, trains on synthetic merged events (bench_temporal_aggregation)
+up to --delta-hours before the latest event, then adds the remaining events
+with update_from_events (no re-clustering). Before printing timings it checks
+that the update matches a retrain with the same clusters:
+
+ - aggregated_data equals temporal_aggregation of all events (row order aside)
+ - the count and probability tables, priors and compiled lookup equal
+   build_cluster_prob_table on the updated aggregated_data
+
+The retrain timing covers temporal_aggregation, build_feature_matrix_and_cluster
+and build_cluster_prob_table; reading the CSVs would add to it.
+
+    python bench_incremental_update.py --events 1000000 10000000 --delta-hours 1
+"""
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import bench_utils
+from bench_temporal_aggregation import synthetic_merged
+from prediction_pipeline import CampusLocationPredictor
+
+
+def trained(events, **params):
+    predictor = CampusLocationPredictor(**params)
+    predictor.merged_data = events
+    predictor.temporal_aggregation()
+    predictor.build_feature_matrix_and_cluster()
+    predictor.build_cluster_prob_table()
+    return predictor
+
+
+def check(updated, full_aggregated):
+    keys = ['entity_id', 'time_window']
+    pd.testing.assert_frame_equal(
+        updated.aggregated_data.sort_values(keys).reset_index(drop=True),
+        full_aggregated.sort_values(keys).reset_index(drop=True),
+    )
+    rebuilt = CampusLocationPredictor(time_window_hours=updated.time_window_hours)
+    rebuilt.aggregated_data = updated.aggregated_data
+    rebuilt.entity_clusters = updated.entity_clusters
+    rebuilt.build_cluster_prob_table()
+    for name in ('cluster_counts', 'cluster_prob_table', 'cluster_prior'):
+        pd.testing.assert_frame_equal(getattr(updated, name), getattr(rebuilt, name), check_exact=True)
+    pd.testing.assert_series_equal(updated.global_location_prior, rebuilt.global_location_prior)
+    for key, value in updated._lookup.items():
+        other = rebuilt._lookup[key]
+        assert np.array_equal(value, other) if isinstance(value, np.ndarray) else value == other, key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--delta-hours", type=float, default=1.0, help="newest events passed to the update")
+    parser.add_argument("--time-window-hours", type=int, default=2)
+    args = parser.parse_args()
+
+    rows = []
+    for n_events in args.events:
+        events = synthetic_merged(n_events)
+        cutoff = events['timestamp'].max() - pd.Timedelta(hours=args.delta_hours)
+        base, delta = events[events['timestamp'] <= cutoff], events[events['timestamp'] > cutoff]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            predictor = trained(base.reset_index(drop=True), time_window_hours=args.time_window_hours)
+            stats, update_s = bench_utils.timed(predictor.update_from_events, delta, drift_threshold=1.0)
+            full, retrain_s = bench_utils.timed(trained, events, time_window_hours=args.time_window_hours)
+            check(predictor, full.aggregated_data)
+        rows.append((n_events, len(delta), stats['rows_added'], stats['rows_changed'], retrain_s, update_s))
+        print(f"{n_events:,} events, {len(delta):,} new: identical to a retrain with the same clusters; "
+              f"retrain {retrain_s:.1f}s, update {update_s:.2f}s", flush=True)
+        del events, base, delta, predictor, full
+
+    print(f"\n{'events':>12}{'new':>9}{'rows +':>9}{'rows ~':>9}{'retrain s':>11}{'update s':>10}{'speed-up':>10}")
+    for n_events, n_delta, added, changed, retrain_s, update_s in rows:
+        print(f"{n_events:>12,}{n_delta:>9,}{added:>9,}{changed:>9,}{retrain_s:>11.1f}{update_s:>10.2f}"
+              f"{retrain_s / update_s:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
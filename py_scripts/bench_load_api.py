@@ -0,0 +1,194 @@
+"""
+Load test for /run-query: async endpoints on asyncpg vs. the old sync endpoints.
+
+Seeds a scratch schema of the local Postgres configured in .env, then for each
+mode starts the API in a subprocess (uvicorn, one worker, response cache off)
+and drives it with N concurrent keep-alive HTTP clients. "sync" serves the
+same handler as a plain `def` over get_info's blocking psycopg2 pools in
+Starlette's threadpool, which is how main.py served it before. Prints throughput, p50/p95 latency and errors per
+mode and concurrency level.
+
+    python bench_load_api.py --clients 50 200 1000 --requests 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import bench_utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MODES = ("async", "sync")
+
+
+# ---------- SERVER (subprocess) ----------
+def sync_app():
+    """The pre-async /run-query: a sync handler over get_info.query_entity in Starlette's threadpool."""
+    from fastapi import FastAPI, HTTPException
+    import get_info
+    import main as api
+
+    app = FastAPI()
+
+    @app.post("/run-query")
+    def run_query(input: api.QueryInput):
+        user_input = {
+            "identifier": {input.identifier_type: input.identifier_value},
+            "start_time": input.start_time,
+            "end_time": input.end_time,
+            "location": input.location
+        }
+        result = get_info.query_entity(user_input, save_to_disk=False)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Entity not found::()")
+        return {"status": "success", "data": result}
+
+    return app
+
+
+def serve(mode, port, schema):
+    import uvicorn
+    import get_info
+    from db_pool import BlockingConnectionPool
+    import get_info_async
+
+    params = bench_utils.scratch_params(schema)
+    if mode == "async":
+        get_info_async.DB_MAIN["server_settings"] = {"search_path": schema}
+        import main as api
+        app = api.app
+    else:
+        # Same pools as get_info._initialize_pools
+        get_info._main_pool = BlockingConnectionPool(2, 20, name="main", **params)
+        get_info._images_pool = BlockingConnectionPool(1, 5, name="images", **params)
+        app = sync_app()
+    with contextlib.redirect_stdout(io.StringIO()):
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False, backlog=4096)
+
+
+# ---------- LOAD GENERATOR ----------
+async def client(port, bodies, budget, results):
+    """One keep-alive connection issuing POST /run-query until the shared request budget is used up."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while budget[0] > 0:
+            budget[0] -= 1
+            body = bodies[budget[0] % len(bodies)]
+            request = (
+                f"POST /run-query HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode() + body
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            results.append((time.perf_counter() - start, status))
+    except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+        results.append((None, None))
+    finally:
+        writer.close()
+
+
+async def run_load(port, n_clients, n_requests, entity_ids):
+    bodies = [json.dumps({"identifier_type": "entity_id", "identifier_value": e}).encode() for e in entity_ids]
+    budget = [n_requests]
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, bodies, budget, results) for _ in range(n_clients)))
+    return results, time.perf_counter() - start
+
+
+def wait_for_port(port, proc, timeout=60):
+    async def probe():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.close()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("API process exited during startup (run with --serve MODE to see why)")
+        try:
+            asyncio.run(probe())
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"API did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=2_000)
+    parser.add_argument("--events", type=int, default=200_000, help="card swipe and wifi rows; other sources get a fifth")
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--requests", type=int, default=2_000, help="requests per concurrency level")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--schema", default=bench_utils.SCRATCH_SCHEMA, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.schema)
+        return
+
+    if resource is not None:
+        # Client and server sockets of 1000+ connections need more than the usual 1024 descriptors
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, bench_utils.synthetic_campus(args.entities, args.events))
+        rng = np.random.default_rng(0)
+        entity_ids = [f"E{i:06d}" for i in rng.integers(1, args.entities + 1, size=1000)]
+
+        rows = []
+        for mode in args.modes:
+            env = dict(os.environ, RESPONSE_CACHE_SIZE="0")
+            proc = subprocess.Popen(
+                [sys.executable, __file__, "--serve", mode, "--port", str(args.port), "--schema", bench_utils.SCRATCH_SCHEMA],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                wait_for_port(args.port, proc)
+                asyncio.run(run_load(args.port, 4, 40, entity_ids))  # warm up pools and the identity index
+                for n_clients in args.clients:
+                    results, elapsed = asyncio.run(run_load(args.port, n_clients, args.requests, entity_ids))
+                    latencies = [lat for lat, status in results if status == 200]
+                    errors = len(results) - len(latencies)
+                    rows.append((mode, n_clients, len(latencies), errors, len(latencies) / elapsed,
+                                 bench_utils.percentile_ms(latencies, 50) if latencies else float("nan"),
+                                 bench_utils.percentile_ms(latencies, 95) if latencies else float("nan")))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+        print(f"\n{'mode':<7}{'clients':>8}{'ok':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for mode, n_clients, ok, errors, rate, p50, p95 in rows:
+            print(f"{mode:<7}{n_clients:>8}{ok:>8}{errors:>8}{rate:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Benchmark for time-partitioned event tables (create_partitioned_tables.sql,
+partitions.py) against the plain tables of create_tables.sql.
+
+Seeds two scratch schemas of the local Postgres configured in .env with the
+same bench_utils.synthetic_campus rows, one plain and one partitioned by
+--period (partitions created by the load itself, indexes built partition by
+partition as run_create_indexes.py does). Before printing timings it checks
+that
+
+ - no row ended up in a default partition, every partition carries every
+   parent index, and the parent indexes are valid
+ - both schemas hold the same rows and the same entity_last_activity (the
+   statement triggers fire on the partitioned parents)
+ - time-bounded query_table lookups, entity timelines (get_info) and
+   per-location counts over a time range return the same rows, and the
+   partitioned plan touches only the partitions in range
+ - maintain_partitions detaches exactly the rows a retention DELETE removes,
+   creates the periods ahead, moves rows inserted past them out of the default
+   partition, and does nothing when run again
+ - a load opening a new period merges without holding a lock on the default
+   partition, and late rows of a detached period get no partition of their own:
+   the next maintenance run appends them to that period's archived table, as it
+   does with a partition whose name is already taken in the archive
+
+    python bench_partitions.py --entities 5000 --events 2000000 --days 180 --period month
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import bench_utils
+import db_insert
+import get_info
+import partitions
+
+PARTITIONED_SCHEMA = "bench_part"
+ARCHIVE_SCHEMA = "bench_archive"
+CREATE_PARTITIONED_SQL = os.path.join(os.path.dirname(__file__), "create_partitioned_tables.sql")
+
+
+def fetch(conn, sql, params=None):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def row_counts(conn):
+    return {table: fetch(conn, f"SELECT COUNT(*) FROM {table}")[0][0] for table in partitions.PARTITION_KEYS}
+
+
+def seed(conn, frames, partitioned):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, load_s = bench_utils.timed(bench_utils.seed_scratch_schema, conn, frames, with_indexes=False)
+        with open(bench_utils.CREATE_INDEXES_SQL) as f:
+            sql = f.read()
+        start = time.perf_counter()
+        if partitioned:
+            partitions.index_partitions(conn, sql)
+        bench_utils.run_sql_file(conn, bench_utils.CREATE_INDEXES_SQL)
+    return load_s, time.perf_counter() - start
+
+
+def check_layout(conn):
+    n_partitions = 0
+    for table in partitions.PARTITION_KEYS:
+        parts = partitions.list_partitions(conn.cursor(), table)
+        default = [name for name, lower, _ in parts if lower is None]
+        assert fetch(conn, f"SELECT COUNT(*) FROM ONLY {default[0]}")[0][0] == 0, default
+        parent_indexes = fetch(conn, """
+            SELECT i.indexrelid::regclass::text, i.indisvalid FROM pg_index i
+            WHERE i.indrelid = to_regclass(%s)""", (table,))
+        assert all(valid for _, valid in parent_indexes), parent_indexes
+        for name, _, _ in parts:
+            count = fetch(conn, "SELECT COUNT(*) FROM pg_index WHERE indrelid = to_regclass(%s)", (name,))[0][0]
+            assert count == len(parent_indexes), (name, count, len(parent_indexes))
+        n_partitions += len(parts)
+    return n_partitions
+
+
+def scanned_partitions(conn, sql, params, table):
+    plan = "\n".join(row[0] for row in fetch(conn, "EXPLAIN " + sql, params))
+    return set(re.findall(rf"\b({table}_(?:p\d{{8}}|default))\b", plan))
+
+
+def run_queries(conn, queries):
+    """Each query once; returns (results, seconds)."""
+    cur = conn.cursor()
+    results = []
+    start = time.perf_counter()
+    for sql, params in queries:
+        cur.execute(sql, params)
+        results.append(sorted(cur.fetchall(), key=repr))
+    elapsed = time.perf_counter() - start
+    cur.close()
+    return results, elapsed
+
+
+def lookups(frames, n, range_days, seed=0):
+    """query_table lookups on cards and devices plus entity timelines, each over range_days near the end."""
+    rng = np.random.default_rng(seed)
+    profiles = frames["student_or_staff_profiles"]
+    end_of_data = pd.to_datetime(frames["campus_card_swipes"]["timestamp"]).max()
+    queries = []
+    for i in range(n):
+        end = end_of_data - pd.Timedelta(days=int(rng.integers(0, 30)))
+        params = [(end - pd.Timedelta(days=range_days)).to_pydatetime(), end.to_pydatetime()]
+        row = profiles.iloc[int(rng.integers(0, len(profiles)))]
+        kind = i % 3
+        if kind == 0:
+            queries.append(("SELECT * FROM campus_card_swipes WHERE card_id=%s AND timestamp BETWEEN %s AND %s",
+                            [row["card_id"]] + params))
+        elif kind == 1:
+            queries.append(("SELECT * FROM wifi_associations_logs WHERE device_hash=%s AND timestamp BETWEEN %s AND %s",
+                            [row["device_hash"]] + params))
+        else:
+            queries.append((get_info._timeline_sql("entity_id", True, False),
+                            {"value": row["entity_id"], "start": params[0], "end": params[1]}))
+    return queries
+
+
+def range_scans(frames, n, range_days, seed=1):
+    """Per-location counts of every swipe and association in range_days, like the readers of the ingest delta."""
+    rng = np.random.default_rng(seed)
+    start_of_data = pd.to_datetime(frames["campus_card_swipes"]["timestamp"]).min()
+    days = (pd.to_datetime(frames["campus_card_swipes"]["timestamp"]).max() - start_of_data).days - range_days
+    queries = []
+    for i in range(n):
+        start = start_of_data + pd.Timedelta(days=int(rng.integers(0, max(1, days))))
+        params = (start.to_pydatetime(), (start + pd.Timedelta(days=range_days)).to_pydatetime())
+        table, column = (("campus_card_swipes", "location_id") if i % 2 == 0
+                         else ("wifi_associations_logs", "ap_id"))
+        queries.append((f"SELECT {column}, COUNT(*) FROM {table} WHERE timestamp >= %s AND timestamp < %s "
+                        f"GROUP BY {column}", params))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=2_000_000, help="card swipe and wifi rows")
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--period", choices=partitions.PERIODS, default="month")
+    parser.add_argument("--queries", type=int, default=600)
+    parser.add_argument("--scans", type=int, default=20)
+    parser.add_argument("--range-days", type=int, default=7, help="length of the time range of each lookup and scan")
+    parser.add_argument("--retention", type=int, default=2, help="periods kept before the current one")
+    parser.add_argument("--ahead", type=int, default=3)
+    args = parser.parse_args()
+    partitions.EVENT_PARTITIONING = args.period
+
+    frames = bench_utils.synthetic_campus(args.entities, args.events, days=args.days)
+    plain = bench_utils.scratch_connection()
+    part = bench_utils.scratch_connection(PARTITIONED_SCHEMA)
+    try:
+        bench_utils.create_scratch_schema(plain)
+        bench_utils.create_scratch_schema(part, PARTITIONED_SCHEMA, sql_files=(
+            CREATE_PARTITIONED_SQL, bench_utils.CREATE_TABLES_SQL, bench_utils.CREATE_IMAGES_SQL))
+        plain_load, plain_index = seed(plain, frames, partitioned=False)
+        part_load, part_index = seed(part, frames, partitioned=True)
+        n_partitions = check_layout(part)
+        assert row_counts(plain) == row_counts(part)
+        activity = "SELECT entity_id, last_activity FROM entity_last_activity ORDER BY entity_id"
+        assert fetch(plain, activity) == fetch(part, activity)
+        print(f"load: {sum(row_counts(part).values()):,} event rows into {n_partitions} partitions "
+              f"({args.period}), none in a default partition; same rows and entity_last_activity as the "
+              f"plain tables")
+
+        queries = lookups(frames, args.queries, args.range_days)
+        sql, params = queries[0]
+        touched = scanned_partitions(part, sql, params, "campus_card_swipes")
+        assert 0 < len(touched) <= 2, touched
+        run_queries(plain, queries)  # warm both caches
+        run_queries(part, queries)
+        plain_rows, plain_s = run_queries(plain, queries)
+        part_rows, part_s = run_queries(part, queries)
+        assert plain_rows == part_rows
+        scans = range_scans(frames, args.scans, args.range_days)
+        run_queries(plain, scans)
+        run_queries(part, scans)
+        plain_rows, plain_scan_s = run_queries(plain, scans)
+        part_rows, part_scan_s = run_queries(part, scans)
+        assert plain_rows == part_rows
+        print(f"lookups: {len(queries)} time-bounded lookups/timelines and {len(scans)} range scans identical; "
+              f"a {args.range_days}-day card lookup scans {sorted(touched)}")
+
+        # Retention: DELETE on the plain tables vs. maintain_partitions detaching whole periods
+        now = pd.to_datetime(frames["campus_card_swipes"]["timestamp"]).max()
+        cutoff = partitions.shift_period(partitions.period_start(now, args.period), args.period, -args.retention)
+        plain_cur = plain.cursor()
+        start = time.perf_counter()
+        for table, key in partitions.PARTITION_KEYS.items():
+            plain_cur.execute(f"DELETE FROM {table} WHERE {key} < %s", (cutoff.to_pydatetime(),))
+        plain.commit()
+        delete_s = time.perf_counter() - start
+        plain_cur.close()
+        part.cursor().execute(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE")
+        part.commit()
+        before = sum(row_counts(part).values())
+        with contextlib.redirect_stdout(io.StringIO()):
+            report, detach_s = bench_utils.timed(partitions.maintain_partitions, part, args.ahead, args.retention,
+                                                 ARCHIVE_SCHEMA, now)
+        assert row_counts(plain) == row_counts(part)
+        archived = before - sum(row_counts(part).values())
+        detached = sum(len(r["detached"]) for r in report.values())
+        tables = fetch(part, "SELECT tablename FROM pg_tables WHERE schemaname = %s", (ARCHIVE_SCHEMA,))
+        assert len(tables) == detached and archived == sum(
+            fetch(part, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{name}")[0][0] for (name,) in tables)
+        last_period = partitions.shift_period(partitions.period_start(now, args.period), args.period, args.ahead)
+        for table in partitions.PARTITION_KEYS:
+            lowers = [lower for _, lower, _ in partitions.list_partitions(part.cursor(), table) if lower is not None]
+            assert max(lowers) == last_period and min(lowers) == cutoff, (table, min(lowers), max(lowers))
+
+        # A row past the periods ahead lands in the default partition until the next run moves it
+        far = partitions.shift_period(last_period, args.period, 6) + pd.Timedelta(hours=1)
+        cur = part.cursor()
+        cur.execute("INSERT INTO campus_card_swipes (card_id, location_id, timestamp) VALUES ('C', 'L', %s)",
+                    (far.to_pydatetime(),))
+        part.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            moved = partitions.maintain_partitions(part, args.ahead, args.retention, ARCHIVE_SCHEMA, now)
+            again = partitions.maintain_partitions(part, args.ahead, args.retention, ARCHIVE_SCHEMA, now)
+        assert moved["campus_card_swipes"]["created"] == [f"campus_card_swipes_p{partitions.period_start(far, args.period):%Y%m%d}"]
+        assert fetch(part, "SELECT COUNT(*) FROM ONLY campus_card_swipes_default")[0][0] == 0
+        assert all(not r["created"] and not r["detached"] for r in again.values()), again
+        check_layout(part)
+        print(f"retention: {detached} partitions before {cutoff:%Y-%m-%d} detached to {ARCHIVE_SCHEMA} "
+              f"({archived:,} rows), leaving the same rows as the DELETE; {args.ahead} periods ahead exist; "
+              f"rows past them move out of the default partition; a second run changes nothing")
+
+        # A load opening a new period, plus a late row of a detached period (a load's retention counts from today)
+        newer = partitions.shift_period(partitions.period_start(pd.Timestamp.now(), args.period), args.period, 12)
+        late = partitions.shift_period(cutoff, args.period, -1) + pd.Timedelta(hours=1)
+        late_name = f"campus_card_swipes_p{partitions.period_start(late, args.period):%Y%m%d}"
+        archived_late = fetch(part, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{late_name}")[0][0]
+        held = []
+
+        def default_locks(cur, rows):
+            cur.execute("SELECT mode FROM pg_locks WHERE pid = pg_backend_pid() "
+                        "AND relation = to_regclass('campus_card_swipes_default')")
+            held.extend(mode for (mode,) in cur.fetchall())
+
+        rows = pd.DataFrame({"card_id": ["C", "C"], "location_id": ["L", "L"],
+                             "timestamp": [newer.to_pydatetime(), late.to_pydatetime()]})
+        retention, partitions.PARTITION_RETENTION = partitions.PARTITION_RETENTION, args.retention
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                db_insert.copy_chunks([rows], "campus_card_swipes", part, before_commit=default_locks)
+        finally:
+            partitions.PARTITION_RETENTION = retention
+        assert "AccessExclusiveLock" not in held and "ShareUpdateExclusiveLock" not in held, held
+        names = [name for name, _, _ in partitions.list_partitions(part.cursor(), "campus_card_swipes")]
+        assert f"campus_card_swipes_p{partitions.period_start(newer, args.period):%Y%m%d}" in names
+        assert late_name not in names
+        assert fetch(part, "SELECT COUNT(*) FROM ONLY campus_card_swipes_default")[0][0] == 1
+
+        # A partition of a detached period (as loads created them before) collides with its archived table
+        cur = part.cursor()
+        lower = partitions.period_start(cutoff - pd.Timedelta(days=1), args.period)
+        collided = f"wifi_associations_logs_p{lower:%Y%m%d}"
+        archived_collided = fetch(part, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{collided}")[0][0]
+        partitions.create_partition(cur, "wifi_associations_logs", lower,
+                                    partitions.shift_period(lower, args.period, 1), "wifi_associations_logs_default")
+        cur.execute("INSERT INTO wifi_associations_logs (device_hash, ap_id, timestamp) VALUES ('D', 'A', %s)",
+                    ((lower + pd.Timedelta(hours=1)).to_pydatetime(),))
+        part.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            late_run = partitions.maintain_partitions(part, args.ahead, args.retention, ARCHIVE_SCHEMA, now)
+            again = partitions.maintain_partitions(part, args.ahead, args.retention, ARCHIVE_SCHEMA, now)
+        assert late_run["campus_card_swipes"]["expired_rows"] == 1, late_run
+        assert late_run["wifi_associations_logs"]["detached"] == [collided], late_run
+        assert fetch(part, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{late_name}")[0][0] == archived_late + 1
+        assert fetch(part, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{collided}")[0][0] == archived_collided + 1
+        assert fetch(part, "SELECT COUNT(*) FROM ONLY campus_card_swipes_default")[0][0] == 0
+        assert all(not r["created"] and not r["detached"] and not r["expired_rows"] for r in again.values()), again
+        print("late rows: a load opening a new period merges without locking the default partition; a row of "
+              "a detached period stays in the default partition until maintenance archives it, and a "
+              "partition colliding with an archived one is appended to it")
+
+        print(f"\n{'':<34}{'plain':>10}{'partitioned':>14}")
+        print(f"{'load (s)':<34}{plain_load:>10.2f}{part_load:>14.2f}")
+        print(f"{'indexes (s)':<34}{plain_index:>10.2f}{part_index:>14.2f}")
+        print(f"{f'{len(queries)} lookups (ms each)':<34}{plain_s / len(queries) * 1000:>10.3f}"
+              f"{part_s / len(queries) * 1000:>14.3f}")
+        print(f"{f'{len(scans)} range scans (ms each)':<34}{plain_scan_s / len(scans) * 1000:>10.1f}"
+              f"{part_scan_s / len(scans) * 1000:>14.1f}")
+        print(f"{'retention (s)':<34}{delete_s:>10.2f}{detach_s:>14.2f}")
+    finally:
+        part.rollback()
+        part.cursor().execute(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE")
+        part.commit()
+        bench_utils.drop_scratch_schema(part, PARTITIONED_SCHEMA)
+        bench_utils.drop_scratch_schema(plain)
+        part.close()
+        plain.close()
+
+
+if __name__ == "__main__":
+    main()
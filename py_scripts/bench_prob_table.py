@@ -0,0 +1,69 @@
+"""
+Benchmark for CampusLocationPredictor.build_cluster_prob_table: groupby-apply
+normalisation vs. the transform-based tables and their integer-coded form.
+
+Uses the synthetic semester of bench_clustering (entities clustered by their
+weekly schedule). tests/test_prob_table.py checks that both versions give the
+same tables and that prob_codes and the prob cube hold exactly those probs.
+
+The new timing is the whole build_cluster_prob_table, i.e. it also covers the
+integer coding and _compile_lookup, which the groupby-apply version did not do.
+
+    python bench_prob_table.py --entities 2000 10000 30000
+"""
+import argparse
+import contextlib
+import io
+import numpy as np
+import bench_utils
+from bench_clustering import synthetic_aggregated
+from prediction_pipeline import CampusLocationPredictor
+
+
+def legacy_prob_tables(predictor):
+    """build_cluster_prob_table's tables before the rewrite, kept verbatim as the reference."""
+    agg = predictor.aggregated_data.copy()
+    agg['cluster'] = agg['entity_id'].map(predictor.entity_clusters)
+    count_tbl = agg.groupby(['cluster', 'time_window', 'location_id']).size().reset_index(name='count')
+    prob_tbl = count_tbl.groupby(['cluster', 'time_window']).apply(
+        lambda g: g.assign(prob=g['count'] / g['count'].sum())
+    ).reset_index(drop=True)
+    cluster_prob_table = prob_tbl[['cluster', 'time_window', 'location_id', 'prob']]
+    cluster_prior = agg.groupby(['cluster', 'location_id']).size().reset_index(name='count')
+    cluster_prior = cluster_prior.groupby('cluster').apply(lambda g: g.assign(prob=g['count'] / g['count'].sum())).reset_index(drop=True)
+    return cluster_prob_table, cluster_prior[['cluster', 'location_id', 'prob']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, nargs="+", default=[2_000, 10_000, 30_000])
+    parser.add_argument("--weeks", type=int, default=16, help="semester length")
+    parser.add_argument("--clusters", type=int, default=12)
+    args = parser.parse_args()
+
+    rows = []
+    for n_entities in args.entities:
+        aggregated, archetypes = synthetic_aggregated(n_entities, args.clusters, args.weeks)
+        predictor = CampusLocationPredictor()
+        predictor.aggregated_data = aggregated
+        predictor.entity_clusters = {e: np.int32(c) for e, c in archetypes.items()}
+
+        (legacy_table, legacy_prior), legacy_s = bench_utils.timed(legacy_prob_tables, predictor)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, current_s = bench_utils.timed(predictor.build_cluster_prob_table)
+
+        table_mb = predictor.cluster_prob_table.memory_usage(deep=True).sum() / 2**20
+        codes_mb = sum(predictor.prob_codes[k].nbytes for k in ('cluster', 'window', 'location', 'prob')) / 2**20
+        rows.append((n_entities, len(legacy_table), legacy_s, current_s, table_mb, codes_mb))
+        print(f"{n_entities:,} entities -> {len(legacy_table):,} prob rows: "
+              f"groupby-apply {legacy_s:.1f}s, transform + coded {current_s:.2f}s", flush=True)
+        del predictor, aggregated, legacy_table, legacy_prior
+
+    print(f"\n{'entities':>9}{'prob rows':>11}{'apply s':>9}{'new s':>8}{'speed-up':>10}{'table MB':>10}{'coded MB':>10}")
+    for n_entities, n_rows, legacy_s, current_s, table_mb, codes_mb in rows:
+        print(f"{n_entities:>9,}{n_rows:>11,}{legacy_s:>9.1f}{current_s:>8.2f}{legacy_s / current_s:>9.0f}x"
+              f"{table_mb:>10.1f}{codes_mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
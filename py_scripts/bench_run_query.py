@@ -0,0 +1,127 @@
+"""
+Latency benchmark for /run-query: per-table queries vs. the single UNION ALL statement.
+
+Seeds a scratch schema of the local Postgres configured in .env, points
+get_info's pools at it and reports p50/p95 latency of the query behind
+/run-query. "before" replays the old flow (resolve_entity + one query_table
+per source), "after" is the current get_info.query_entity; the fetch rows
+time only the main-DB part of each flow.
+
+    python bench_run_query.py --entities 2000 --events 500000 --requests 200
+"""
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+from psycopg2 import pool
+import bench_utils
+import get_info
+
+
+def legacy_fetch(cur_main, user_input):
+    """The pre-UNION ALL data access: resolve_entity, then one round trip per source table."""
+    resolved = get_info.resolve_entity(cur_main, user_input["identifier"])
+    if not resolved:
+        return None, {}
+    entity_id = resolved["entity_id"]
+    ids = {"entity_id": entity_id, "card_id": resolved.get("card_id"),
+           "device_hash": resolved.get("device_hash"), "face_id": "F" + entity_id[1:]}
+    data_dict = {}
+    for table, (id_field, time_field) in get_info.TABLES.items():
+        if not ids[id_field]:
+            continue
+        df = get_info.query_table(cur_main, table, id_field, ids[id_field], time_field)
+        if not df.empty:
+            data_dict[table] = df
+    return resolved, data_dict
+
+
+def current_fetch(cur_main, user_input):
+    resolved, events = get_info.fetch_entity_timeline(cur_main, user_input["identifier"])
+    return resolved, get_info.split_timeline_sources(events) if resolved else {}
+
+
+def legacy_query_entity(user_input, save_to_disk=False):
+    conn_main = get_info.connect_main()
+    try:
+        cur_main = conn_main.cursor()
+        resolved, data_dict = legacy_fetch(cur_main, user_input)
+        if not resolved:
+            return None
+        get_info.save_images(resolved["entity_id"], None, save_to_disk=False)
+        timeline = get_info.build_timeline(None, resolved["entity_id"], conn_main, save_to_disk=False, data_dict=data_dict)
+        cur_main.close()
+        return timeline
+    finally:
+        get_info.release_main(conn_main)
+
+
+def user_input_for(entity_id):
+    return {"identifier": {"entity_id": entity_id}, "start_time": None, "end_time": None, "location": None}
+
+
+def measure_fetch(fetch, entity_ids):
+    samples = []
+    conn_main = get_info.connect_main()
+    try:
+        cur_main = conn_main.cursor()
+        for entity_id in entity_ids:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                fetch(cur_main, user_input_for(entity_id))
+            samples.append(time.perf_counter() - start)
+        cur_main.close()
+    finally:
+        get_info.release_main(conn_main)
+    return samples
+
+
+def measure_query(query_entity, entity_ids):
+    """Time a full query_entity implementation (fetch, images and timeline build)."""
+    samples = []
+    for entity_id in entity_ids:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_entity(user_input_for(entity_id), save_to_disk=False)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=2_000)
+    parser.add_argument("--events", type=int, default=500_000, help="card swipe and wifi rows; other sources get a fifth")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = bench_utils.scratch_connection()
+    try:
+        bench_utils.create_scratch_schema(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bench_utils.seed_scratch_schema(conn, bench_utils.synthetic_campus(args.entities, args.events))
+
+        params = bench_utils.scratch_params()
+        get_info._main_pool = pool.SimpleConnectionPool(1, 4, **params)
+        get_info._images_pool = pool.SimpleConnectionPool(1, 4, **params)
+
+        rng = np.random.default_rng(0)
+        entity_ids = [f"E{i:06d}" for i in rng.integers(1, args.entities + 1, size=args.requests)]
+
+        results = {
+            "before fetch": measure_fetch(legacy_fetch, entity_ids),
+            "after fetch": measure_fetch(current_fetch, entity_ids),
+            "before query": measure_query(legacy_query_entity, entity_ids),
+            "after query": measure_query(get_info.query_entity, entity_ids),
+        }
+        print(f"\n{'path':<20}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, samples in results.items():
+            print(f"{name:<20}{len(samples):>10}{bench_utils.percentile_ms(samples, 50):>10.1f}"
+                  f"{bench_utils.percentile_ms(samples, 95):>10.1f}")
+    finally:
+        bench_utils.drop_scratch_schema(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
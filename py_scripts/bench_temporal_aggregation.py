@@ -0,0 +1,88 @@
+"""
+Benchmark for CampusLocationPredictor.temporal_aggregation: per-group lambdas vs. the vectorised engine.
+
+Builds synthetic merged_data (what load_and_integrate_data produces) in memory
+for each size, runs both aggregations on it and checks that they agree row for
+row (same modal location incl. tie-breaks, same source sets and counts) before
+printing timings. The lambda version takes minutes past a few million events, so
+it only runs up to --legacy-max-events.
+
+    python bench_temporal_aggregation.py --events 1000000 10000000 50000000
+"""
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import bench_utils
+from prediction_pipeline import CampusLocationPredictor
+
+SOURCES = np.array(["booking", "card", "device", "frame", "library", "note"], dtype=object)
+PLACES = np.array(bench_utils.LOCATIONS + bench_utils.ACCESS_POINTS + bench_utils.ROOMS, dtype=object)
+
+
+def legacy_temporal_aggregation(predictor):
+    """CampusLocationPredictor.temporal_aggregation before vectorisation, kept verbatim as the reference."""
+    df = predictor.merged_data.copy()
+    df['time_window'] = df['timestamp'].dt.floor(f"{predictor.time_window_hours}H")
+
+    # For each entity/time_window choose the mode location (if tie pick first)
+    aggregated = df.groupby(['entity_id', 'time_window']).agg(
+        location_id=('location_id', lambda x: x.mode().iloc[0] if len(x.mode()) > 0 else x.iloc[0]),
+        sources=('source', lambda s: ",".join(sorted(set(s)))),
+        event_count=('timestamp', 'count'),
+    ).reset_index()
+    return aggregated
+
+
+def synthetic_merged(n_events, events_per_entity=2_000, days=30, seed=0):
+    """merged_data-shaped events: each entity keeps to a few favourite places, so windows have real modes and ties."""
+    rng = np.random.default_rng(seed)
+    n_entities = max(1, n_events // events_per_entity)
+    entity = rng.integers(0, n_entities, size=n_events)
+    favourites = rng.integers(0, len(PLACES), size=(n_entities, 4))
+    place = np.where(rng.random(n_events) < 0.7,
+                     favourites[entity, rng.integers(0, 4, size=n_events)],
+                     rng.integers(0, len(PLACES), size=n_events))
+    entity_ids = np.array([f"E{i:06d}" for i in range(n_entities)], dtype=object)
+    return pd.DataFrame({
+        "entity_id": entity_ids[entity],
+        "timestamp": pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, days * 86_400, size=n_events), unit="s"),
+        "location_id": PLACES[place],
+        "source": SOURCES[rng.integers(0, len(SOURCES), size=n_events)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--legacy-max-events", type=int, default=10_000_000,
+                        help="largest size the lambda version is run (and checked) at")
+    parser.add_argument("--time-window-hours", type=int, default=2)
+    args = parser.parse_args()
+
+    rows = []
+    for n_events in args.events:
+        predictor = CampusLocationPredictor(time_window_hours=args.time_window_hours)
+        predictor.merged_data = synthetic_merged(n_events)
+        with contextlib.redirect_stdout(io.StringIO()):
+            current, current_s = bench_utils.timed(predictor.temporal_aggregation)
+        legacy_s = None
+        if n_events <= args.legacy_max_events:
+            legacy, legacy_s = bench_utils.timed(legacy_temporal_aggregation, predictor)
+            pd.testing.assert_frame_equal(current, legacy)
+            del legacy
+        rows.append((n_events, len(current), legacy_s, current_s))
+        print(f"{n_events:,} events -> {len(current):,} entity-windows: "
+              f"lambdas {'-' if legacy_s is None else f'{legacy_s:.1f}s'}, vectorised {current_s:.2f}s", flush=True)
+        del predictor, current
+
+    print(f"\n{'events':>12}{'groups':>12}{'lambdas s':>12}{'vector s':>12}{'speed-up':>10}")
+    for n_events, groups, legacy_s, current_s in rows:
+        legacy = f"{legacy_s:.1f}" if legacy_s is not None else "-"
+        speedup = f"{legacy_s / current_s:.0f}x" if legacy_s is not None else "-"
+        print(f"{n_events:>12,}{groups:>12,}{legacy:>12}{current_s:>12.2f}{speedup:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Shared helpers for the benchmark scripts (bench_*.py).
+
+Benchmarks never touch the real tables: they create a scratch schema in the
+main database, load create_tables.sql into it and point their connections at it
+through search_path. The scratch schema is dropped again when the run finishes.
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from db_insert import copy_dataframe
+
+load_dotenv()
+
+SCRATCH_SCHEMA = "bench"
+CREATE_TABLES_SQL = os.path.join(os.path.dirname(__file__), "create_tables.sql")
+CREATE_IMAGES_SQL = os.path.join(os.path.dirname(__file__), "create_images_table.sql")
+CREATE_INDEXES_SQL = os.path.join(os.path.dirname(__file__), "create_indexes.sql")
+
+LOCATIONS = [f"LOC_{i:03d}" for i in range(40)]
+ACCESS_POINTS = [f"AP_{i:03d}" for i in range(60)]
+ROOMS = [f"ROOM_{i:03d}" for i in range(20)]
+
+
+def scratch_params(schema=SCRATCH_SCHEMA):
+    """Connection keyword arguments for the main database with search_path set to the scratch schema."""
+    return {
+        "host": os.getenv("DB_MAIN_HOST"),
+        "port": os.getenv("DB_MAIN_PORT"),
+        "user": os.getenv("DB_MAIN_USER"),
+        "password": os.getenv("DB_MAIN_PASSWORD"),
+        "database": os.getenv("DB_MAIN_NAME"),
+        "options": f"-c search_path={schema}",
+    }
+
+
+def scratch_connection(schema=SCRATCH_SCHEMA):
+    """Open a plain connection to the main database with search_path set to the scratch schema."""
+    return psycopg2.connect(**scratch_params(schema))
+
+
+def run_sql_file(conn, sql_file):
+    with open(sql_file, "r") as f:
+        sql = f.read()
+    cur = conn.cursor()
+    cur.execute(sql)
+    conn.commit()
+    cur.close()
+
+
+def create_scratch_schema(conn, schema=SCRATCH_SCHEMA, sql_files=(CREATE_TABLES_SQL, CREATE_IMAGES_SQL)):
+    """(Re)create the scratch schema and load the table definitions into it."""
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}")
+    conn.commit()
+    cur.close()
+    for sql_file in sql_files:
+        run_sql_file(conn, sql_file)
+
+
+def drop_scratch_schema(conn, schema=SCRATCH_SCHEMA):
+    conn.rollback()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.commit()
+    cur.close()
+
+
+def truncate(conn, *tables):
+    cur = conn.cursor()
+    cur.execute(f"TRUNCATE {', '.join(tables)}")
+    conn.commit()
+    cur.close()
+
+
+# ---------- SYNTHETIC DATA ----------
+def synthetic_profiles(n_entities, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_entities + 1)
+    entity_id = [f"E{i:06d}" for i in ids]
+    roles = rng.choice(["student", "staff", "faculty"], size=n_entities, p=[0.8, 0.1, 0.1])
+    return pd.DataFrame({
+        "entity_id": entity_id,
+        "name": [f"Person {i}" for i in ids],
+        "role": roles,
+        "email": [f"person{i}@campus.edu" for i in ids],
+        "department": rng.choice(["CSE", "EE", "ME", "CIVIL", "PHYSICS", "ADMIN"], size=n_entities),
+        "student_id": [f"S{i:06d}" for i in ids],
+        "staff_id": [f"T{i:06d}" if r != "student" else None for i, r in zip(ids, roles)],
+        "card_id": [f"C{i:06d}" for i in ids],
+        "device_hash": [f"DH{i:08x}" for i in ids],
+        "face_id": [f"F{i:06d}" for i in ids],
+    })
+
+
+def _random_timestamps(rng, n, start, days):
+    start = pd.Timestamp(start)
+    offsets = rng.integers(0, days * 24 * 3600, size=n)
+    return (start + pd.to_timedelta(np.sort(offsets), unit="s")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def synthetic_card_swipes(n_rows, profiles, start="2025-01-01", days=30, seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "card_id": rng.choice(profiles["card_id"].values, size=n_rows),
+        "location_id": rng.choice(LOCATIONS, size=n_rows),
+        "timestamp": _random_timestamps(rng, n_rows, start, days),
+    })
+
+
+def synthetic_wifi_logs(n_rows, profiles, start="2025-01-01", days=30, seed=2):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "device_hash": rng.choice(profiles["device_hash"].values, size=n_rows),
+        "ap_id": rng.choice(ACCESS_POINTS, size=n_rows),
+        "timestamp": _random_timestamps(rng, n_rows, start, days),
+    })
+
+
+def synthetic_campus(n_entities, n_events, start="2025-01-01", days=30, seed=3):
+    """Synthetic rows for every source table, keyed by table name.
+
+    n_events rows each of card swipes and wifi logs, a fifth of that for the
+    other event sources.
+    """
+    rng = np.random.default_rng(seed)
+    profiles = synthetic_profiles(n_entities, seed=seed)
+    n = max(1, n_events // 5)
+    booking_start = pd.to_datetime(_random_timestamps(rng, n, start, days))
+    return {
+        "student_or_staff_profiles": profiles,
+        "campus_card_swipes": synthetic_card_swipes(n_events, profiles, start, days, seed=seed + 1),
+        "wifi_associations_logs": synthetic_wifi_logs(n_events, profiles, start, days, seed=seed + 2),
+        "cctv_frames": pd.DataFrame({
+            "frame_id": [f"FR{i:09d}" for i in range(n)],
+            "location_id": rng.choice(LOCATIONS, size=n),
+            "timestamp": _random_timestamps(rng, n, start, days),
+            "face_id": rng.choice(profiles["face_id"].values, size=n),
+        }),
+        "lab_bookings": pd.DataFrame({
+            "booking_id": [f"B{i:09d}" for i in range(n)],
+            "entity_id": rng.choice(profiles["entity_id"].values, size=n),
+            "room_id": rng.choice(ROOMS, size=n),
+            "start_time": booking_start.strftime("%Y-%m-%d %H:%M:%S"),
+            "end_time": (booking_start + pd.Timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S"),
+            "attended": rng.choice(["YES", "NO"], size=n),
+        }),
+        "library_checkouts": pd.DataFrame({
+            "checkout_id": [f"L{i:09d}" for i in range(n)],
+            "entity_id": rng.choice(profiles["entity_id"].values, size=n),
+            "book_id": rng.choice([f"BK{i:05d}" for i in range(2000)], size=n),
+            "timestamp": _random_timestamps(rng, n, start, days),
+        }),
+        "free_text_notes": pd.DataFrame({
+            "note_id": [f"N{i:09d}" for i in range(n)],
+            "entity_id": rng.choice(profiles["entity_id"].values, size=n),
+            "category": rng.choice(["helpdesk", "rsvp"], size=n),
+            "text": rng.choice(["Printer jammed", "Will attend the seminar", "Lost ID card"], size=n),
+            "timestamp": _random_timestamps(rng, n, start, days),
+        }),
+    }
+
+
+def seed_scratch_schema(conn, frames, with_indexes=True):
+    """Bulk load synthetic frames into the scratch schema and optionally build the indexes."""
+    for table, df in frames.items():
+        copy_dataframe(df, table, conn)
+    if with_indexes:
+        run_sql_file(conn, CREATE_INDEXES_SQL)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000.0, q))
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn and return (result, elapsed seconds)."""
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
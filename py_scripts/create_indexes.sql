@@ -22,12 +22,25 @@ CREATE INDEX IF NOT EXISTS idx_lab_bookings_entity_ts ON lab_bookings(entity_id,
 CREATE INDEX IF NOT EXISTS idx_free_text_notes_entity_ts ON free_text_notes(entity_id, timestamp DESC);
 
 -- Composite indexes for better join performance
-CREATE INDEX idx_campus_card_swipes_card_ts ON campus_card_swipes(card_id, timestamp DESC);
-CREATE INDEX idx_wifi_logs_device_ts ON wifi_associations_logs(device_hash, timestamp DESC);
-CREATE INDEX idx_cctv_frames_face_ts ON cctv_frames(face_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_campus_card_swipes_card_ts ON campus_card_swipes(card_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_wifi_logs_device_ts ON wifi_associations_logs(device_hash, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_cctv_frames_face_ts ON cctv_frames(face_id, timestamp DESC);
+
+-- Inactivity alerts: range scan over the last activity per entity
+CREATE INDEX IF NOT EXISTS idx_entity_last_activity_ts ON entity_last_activity(last_activity);
+-- Alert engine: rows written by transactions from a given xid on
+CREATE INDEX IF NOT EXISTS idx_entity_last_activity_xid ON entity_last_activity(xid);
+
+-- Rule-based anomaly alerts: newest first, overall and per entity
+CREATE INDEX IF NOT EXISTS idx_anomaly_alerts_event_time ON anomaly_alerts(event_time DESC);
+CREATE INDEX IF NOT EXISTS idx_anomaly_alerts_entity_ts ON anomaly_alerts(entity_id, event_time DESC);
+
+-- Deviation scores: recent windows for /alerts/anomalous, latest scored event for the next run
+CREATE INDEX IF NOT EXISTS idx_deviation_scores_window ON deviation_scores(time_window DESC);
+CREATE INDEX IF NOT EXISTS idx_deviation_scores_last_seen ON deviation_scores(last_seen);
 
 -- Pattern index for image LIKE queries
-CREATE INDEX idx_face_images_pattern ON face_images(image_id text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_face_images_pattern ON face_images(image_id text_pattern_ops);
 
 -- Update statistics
 ANALYZE campus_card_swipes;
@@ -37,3 +50,6 @@ ANALYZE library_checkouts;
 ANALYZE lab_bookings;
 ANALYZE free_text_notes;
 ANALYZE student_or_staff_profiles;
+ANALYZE entity_last_activity;
+ANALYZE anomaly_alerts;
+ANALYZE deviation_scores;
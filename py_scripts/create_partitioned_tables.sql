@@ -0,0 +1,55 @@
+-- Event tables range-partitioned by their time column (EVENT_PARTITIONING=month|week).
+-- Run before create_tables.sql, which then leaves these tables alone and adds everything else
+-- (pipeline.py does both). Only the parents and a DEFAULT partition for rows outside every
+-- range are declared here; partitions.py creates the monthly/weekly partitions, ahead of the
+-- data, and detaches or archives old ones.
+-- A primary key of a partitioned table has to include the partition column, so ids are unique
+-- per (id, time) here. free_text_notes stays a plain table: its timestamp may be NULL.
+
+-- Table: campus_card_swipes
+CREATE TABLE IF NOT EXISTS campus_card_swipes (
+    card_id VARCHAR NOT NULL,
+    location_id VARCHAR NOT NULL,
+    timestamp TIMESTAMP NOT NULL
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE IF NOT EXISTS campus_card_swipes_default PARTITION OF campus_card_swipes DEFAULT;
+
+-- Table: cctv_frames
+CREATE TABLE IF NOT EXISTS cctv_frames (
+    frame_id VARCHAR NOT NULL,
+    location_id VARCHAR NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    face_id VARCHAR,
+    PRIMARY KEY (frame_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE IF NOT EXISTS cctv_frames_default PARTITION OF cctv_frames DEFAULT;
+
+-- Table: lab_bookings
+CREATE TABLE IF NOT EXISTS lab_bookings (
+    booking_id VARCHAR NOT NULL,
+    entity_id VARCHAR NOT NULL,
+    room_id VARCHAR NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    attended VARCHAR CHECK (attended IN ('YES', 'NO')),
+    PRIMARY KEY (booking_id, start_time)
+) PARTITION BY RANGE (start_time);
+CREATE TABLE IF NOT EXISTS lab_bookings_default PARTITION OF lab_bookings DEFAULT;
+
+-- Table: library_checkouts
+CREATE TABLE IF NOT EXISTS library_checkouts (
+    checkout_id VARCHAR NOT NULL,
+    entity_id VARCHAR NOT NULL,
+    book_id VARCHAR NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (checkout_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE IF NOT EXISTS library_checkouts_default PARTITION OF library_checkouts DEFAULT;
+
+-- Table: wifi_associations_logs
+CREATE TABLE IF NOT EXISTS wifi_associations_logs (
+    device_hash VARCHAR NOT NULL,
+    ap_id VARCHAR NOT NULL,
+    timestamp TIMESTAMP NOT NULL
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE IF NOT EXISTS wifi_associations_logs_default PARTITION OF wifi_associations_logs DEFAULT;
@@ -66,3 +66,239 @@ CREATE TABLE IF NOT EXISTS wifi_associations_logs (
     ap_id VARCHAR NOT NULL,
     timestamp TIMESTAMP NOT NULL
 );
+
+-- Table: ingest_manifest (incremental loads: one row per file loaded into a source table)
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+    source VARCHAR NOT NULL,
+    file_hash CHAR(64) NOT NULL,
+    max_timestamp TIMESTAMP,
+    rows_loaded INTEGER NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (source, file_hash)
+);
+
+-- Table: ingest_ranges (earliest and latest event time per day of the rows each transaction inserted
+-- into an event table, kept by the track_ingest_range trigger below; the anomaly rules and the deviation
+-- scores read the ranges written since their last run, so rows that arrive with times they have already
+-- passed are evaluated too)
+CREATE TABLE IF NOT EXISTS ingest_ranges (
+    source VARCHAR NOT NULL,
+    xid XID8 NOT NULL,
+    day DATE NOT NULL,
+    min_time TIMESTAMP NOT NULL,
+    max_time TIMESTAMP NOT NULL,
+    PRIMARY KEY (xid, source, day)
+);
+
+-- Table: ingest_checkpoints (per reader of ingest_ranges kept in the database, the xid from which
+-- transactions may have inserted rows it has not read; written with the reader's results)
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    consumer VARCHAR PRIMARY KEY,
+    xid XID8 NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Table: anomaly_alerts (hits of the rule engine in anomaly_rules.py; one row per rule, entity,
+-- event time and location, so re-evaluating a batch adds nothing)
+CREATE TABLE IF NOT EXISTS anomaly_alerts (
+    alert_id BIGSERIAL PRIMARY KEY,
+    rule VARCHAR NOT NULL,
+    entity_id VARCHAR NOT NULL,
+    event_time TIMESTAMP NOT NULL,
+    location_id VARCHAR NOT NULL,
+    source VARCHAR NOT NULL,
+    details JSONB,
+    detected_at TIMESTAMP NOT NULL DEFAULT now(),
+    UNIQUE (rule, entity_id, event_time, location_id)
+);
+
+-- Table: deviation_scores (probability of each observed entity x time window x location under the
+-- location predictor, written by deviation_scores.py; low probabilities are /alerts/anomalous)
+CREATE TABLE IF NOT EXISTS deviation_scores (
+    entity_id VARCHAR NOT NULL,
+    time_window TIMESTAMP NOT NULL,
+    location_id VARCHAR NOT NULL,
+    event_count INTEGER NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    probability REAL,
+    method VARCHAR NOT NULL,
+    model_version VARCHAR,
+    scored_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (entity_id, time_window, location_id)
+);
+
+-- Table: entity_last_activity (latest event per profile, NULL if none; kept current by the
+-- triggers below so /alerts/inactive never scans the event history). Every change bumps seq
+-- and records the writing transaction in xid, so the API's alert engine reads only the rows
+-- written by transactions that had not committed when it last looked (seqs are drawn before
+-- commit, so a seq watermark would skip a load that commits after one with higher seqs).
+CREATE SEQUENCE IF NOT EXISTS entity_last_activity_seq;
+CREATE TABLE IF NOT EXISTS entity_last_activity (
+    entity_id VARCHAR PRIMARY KEY,
+    last_activity TIMESTAMP,
+    seq BIGINT NOT NULL DEFAULT nextval('entity_last_activity_seq'),
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+ALTER TABLE entity_last_activity
+    ADD COLUMN IF NOT EXISTS seq BIGINT NOT NULL DEFAULT nextval('entity_last_activity_seq'),
+    ADD COLUMN IF NOT EXISTS xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+
+-- Statement-level trigger on an event table: fold the inserted rows' latest time per entity in.
+-- TG_ARGV: identifier column, time column, profile column the identifier matches.
+-- Rows are upserted in entity_id order so concurrent loads lock them in the same order; rows
+-- whose last activity did not move are left alone. Listeners on 'entity_activity' are told
+-- when something changed (delivered on commit).
+CREATE OR REPLACE FUNCTION track_last_activity() RETURNS trigger AS $$
+DECLARE
+    changed BIGINT;
+BEGIN
+    EXECUTE format(
+        'INSERT INTO entity_last_activity AS a (entity_id, last_activity)
+         SELECT p.entity_id, MAX(n.%2$I)
+         FROM new_rows n
+         JOIN student_or_staff_profiles p ON p.%3$I = n.%1$I
+         WHERE n.%2$I IS NOT NULL
+         GROUP BY p.entity_id
+         ORDER BY p.entity_id
+         ON CONFLICT (entity_id) DO UPDATE
+         SET last_activity = EXCLUDED.last_activity, seq = nextval(''entity_last_activity_seq''),
+             xid = pg_current_xact_id()
+         WHERE a.last_activity IS NULL OR EXCLUDED.last_activity > a.last_activity',
+        TG_ARGV[0], TG_ARGV[1], TG_ARGV[2]);
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    IF changed > 0 THEN
+        PERFORM pg_notify('entity_activity', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level trigger on profiles: new profiles pick up the events already loaded for them
+CREATE OR REPLACE FUNCTION track_profile_last_activity() RETURNS trigger AS $$
+DECLARE
+    changed BIGINT;
+BEGIN
+    INSERT INTO entity_last_activity AS a (entity_id, last_activity)
+    SELECT n.entity_id, GREATEST(
+        (SELECT MAX(timestamp) FROM campus_card_swipes WHERE card_id = n.card_id),
+        (SELECT MAX(timestamp) FROM wifi_associations_logs WHERE device_hash = n.device_hash),
+        (SELECT MAX(timestamp) FROM cctv_frames WHERE face_id = n.face_id),
+        (SELECT MAX(timestamp) FROM library_checkouts WHERE entity_id = n.entity_id),
+        (SELECT MAX(start_time) FROM lab_bookings WHERE entity_id = n.entity_id),
+        (SELECT MAX(timestamp) FROM free_text_notes WHERE entity_id = n.entity_id))
+    FROM new_rows n
+    ORDER BY n.entity_id
+    ON CONFLICT (entity_id) DO UPDATE
+    SET last_activity = EXCLUDED.last_activity, seq = nextval('entity_last_activity_seq'),
+        xid = pg_current_xact_id()
+    WHERE a.last_activity IS NULL OR EXCLUDED.last_activity > a.last_activity;
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    IF changed > 0 THEN
+        PERFORM pg_notify('entity_activity', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level trigger on an event table: record the time range per day of the inserted rows
+-- under the inserting transaction (one row per transaction, table and day). TG_ARGV: time column.
+CREATE OR REPLACE FUNCTION track_ingest_range() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO ingest_ranges AS r (source, xid, day, min_time, max_time)
+         SELECT %1$L, pg_current_xact_id(), n.%2$I::date, MIN(n.%2$I), MAX(n.%2$I)
+         FROM new_rows n
+         WHERE n.%2$I IS NOT NULL
+         GROUP BY n.%2$I::date
+         ON CONFLICT (xid, source, day) DO UPDATE
+         SET min_time = LEAST(r.min_time, EXCLUDED.min_time), max_time = GREATEST(r.max_time, EXCLUDED.max_time)',
+        TG_TABLE_NAME, TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS last_activity_card ON campus_card_swipes;
+CREATE TRIGGER last_activity_card AFTER INSERT ON campus_card_swipes
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('card_id', 'timestamp', 'card_id');
+DROP TRIGGER IF EXISTS last_activity_device ON wifi_associations_logs;
+CREATE TRIGGER last_activity_device AFTER INSERT ON wifi_associations_logs
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('device_hash', 'timestamp', 'device_hash');
+DROP TRIGGER IF EXISTS last_activity_frame ON cctv_frames;
+CREATE TRIGGER last_activity_frame AFTER INSERT ON cctv_frames
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('face_id', 'timestamp', 'face_id');
+DROP TRIGGER IF EXISTS last_activity_library ON library_checkouts;
+CREATE TRIGGER last_activity_library AFTER INSERT ON library_checkouts
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('entity_id', 'timestamp', 'entity_id');
+DROP TRIGGER IF EXISTS last_activity_booking ON lab_bookings;
+CREATE TRIGGER last_activity_booking AFTER INSERT ON lab_bookings
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('entity_id', 'start_time', 'entity_id');
+DROP TRIGGER IF EXISTS last_activity_note ON free_text_notes;
+CREATE TRIGGER last_activity_note AFTER INSERT ON free_text_notes
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_last_activity('entity_id', 'timestamp', 'entity_id');
+DROP TRIGGER IF EXISTS last_activity_profile ON student_or_staff_profiles;
+CREATE TRIGGER last_activity_profile AFTER INSERT ON student_or_staff_profiles
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_profile_last_activity();
+
+DROP TRIGGER IF EXISTS ingest_range_card ON campus_card_swipes;
+CREATE TRIGGER ingest_range_card AFTER INSERT ON campus_card_swipes
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('timestamp');
+DROP TRIGGER IF EXISTS ingest_range_device ON wifi_associations_logs;
+CREATE TRIGGER ingest_range_device AFTER INSERT ON wifi_associations_logs
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('timestamp');
+DROP TRIGGER IF EXISTS ingest_range_frame ON cctv_frames;
+CREATE TRIGGER ingest_range_frame AFTER INSERT ON cctv_frames
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('timestamp');
+DROP TRIGGER IF EXISTS ingest_range_library ON library_checkouts;
+CREATE TRIGGER ingest_range_library AFTER INSERT ON library_checkouts
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('timestamp');
+DROP TRIGGER IF EXISTS ingest_range_booking ON lab_bookings;
+CREATE TRIGGER ingest_range_booking AFTER INSERT ON lab_bookings
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('start_time');
+DROP TRIGGER IF EXISTS ingest_range_note ON free_text_notes;
+CREATE TRIGGER ingest_range_note AFTER INSERT ON free_text_notes
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION track_ingest_range('timestamp');
+
+-- One-off backfill for a database that has history from before entity_last_activity existed
+-- (one aggregate pass over every source; afterwards the triggers keep the table current)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM entity_last_activity) AND EXISTS (SELECT 1 FROM student_or_staff_profiles) THEN
+        INSERT INTO entity_last_activity (entity_id, last_activity)
+        SELECT p.entity_id, ela.last_activity
+        FROM student_or_staff_profiles p
+        LEFT JOIN (
+            SELECT entity_id, MAX(timestamp) AS last_activity
+            FROM (
+                SELECT p.entity_id, w.timestamp
+                FROM wifi_associations_logs w JOIN student_or_staff_profiles p ON w.device_hash = p.device_hash
+                UNION ALL
+                SELECT entity_id, timestamp FROM library_checkouts
+                UNION ALL
+                SELECT entity_id, start_time FROM lab_bookings
+                UNION ALL
+                SELECT entity_id, timestamp FROM free_text_notes
+                UNION ALL
+                SELECT p.entity_id, c.timestamp
+                FROM cctv_frames c JOIN student_or_staff_profiles p ON c.face_id = p.face_id
+                UNION ALL
+                SELECT p.entity_id, s.timestamp
+                FROM campus_card_swipes s JOIN student_or_staff_profiles p ON s.card_id = p.card_id
+            ) all_events
+            GROUP BY entity_id
+        ) ela ON ela.entity_id = p.entity_id;
+    END IF;
+END;
+$$;
@@ -0,0 +1,155 @@
+"""
+Event sources and profiles read straight from Postgres for the prediction pipeline.
+
+The pipeline's CSV loader re-parses every upload (and ingest_and_preprocess
+deletes them once loaded), while the tables db_insert fills are the
+authoritative copy. Each source table is streamed with
+COPY (SELECT ...) TO STDOUT into a temporary file and read back in chunks with
+fixed dtypes: timestamps leave the server as integer microseconds since the
+epoch, so no datetime text is parsed or format-guessed. An optional
+[start, end) range is pushed into every statement.
+
+The frames have the shape CampusLocationPredictor.integrate_events expects
+(temp_id, timestamp, location_id, source), so identity mapping and everything
+after it is shared with the CSV path.
+"""
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+from get_info import DB_MAIN
+from ingest_utils import CHUNK_SIZE
+
+# source -> table, identifier column (temp_id), location column (None: constant), time column
+EVENT_SOURCES = {
+    "note": {"table": "free_text_notes", "id": "entity_id", "location": None, "time": "timestamp"},
+    "device": {"table": "wifi_associations_logs", "id": "device_hash", "location": "ap_id", "time": "timestamp"},
+    "booking": {"table": "lab_bookings", "id": "entity_id", "location": "room_id", "time": "start_time",
+                "extra": {"end_time": "end_time", "attended": "attended"}},
+    "frame": {"table": "cctv_frames", "id": "face_id", "location": "location_id", "time": "timestamp"},
+    "card": {"table": "campus_card_swipes", "id": "card_id", "location": "location_id", "time": "timestamp"},
+    "library": {"table": "library_checkouts", "id": "entity_id", "location": None, "time": "timestamp"},
+}
+
+# Dtype of the extra columns a source can carry besides the unified ones (see read_source)
+EXTRA_DTYPES = {"end_time": "timestamp", "attended": object}
+
+# Location of the sources without a location column, as in the CSV loader
+CONSTANT_LOCATIONS = {"note": "note_location", "library": "library"}
+
+# Identifier columns integrate_events maps through
+PROFILE_COLUMNS = ("entity_id", "card_id", "device_hash", "face_id")
+
+
+def connect():
+    """A plain connection to the main database (the training worker needs just one)."""
+    return psycopg2.connect(**DB_MAIN)
+
+
+def copy_query(cur, sql, params, names, dtypes, chunk_size=CHUNK_SIZE):
+    """Run COPY (sql) TO STDOUT and read the rows back as a DataFrame of the given dtypes."""
+    statement = cur.mogrify(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", params).decode()
+    with tempfile.TemporaryFile() as buf:
+        cur.copy_expert(statement, buf)
+        if buf.tell() == 0:
+            return pd.DataFrame({name: pd.Series(dtype=dtypes[name]) for name in names})
+        buf.seek(0)
+        chunks = list(pd.read_csv(buf, names=names, dtype=dtypes, chunksize=chunk_size))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _epoch_us(column):
+    # date_part (double precision) is exact to the microsecond here and cheaper than extract's numeric
+    return f"(date_part('epoch', {column}) * 1000000)::bigint"
+
+
+def read_source(cur, source, start=None, end=None, chunk_size=CHUNK_SIZE, extra_columns=()):
+    """
+    Events of one source as (temp_id, timestamp, location_id, source), optionally within [start, end).
+    extra_columns (names from EXTRA_DTYPES) are added where the source has them, e.g. a booking's
+    end_time and attended for the anomaly rules.
+    """
+    spec = EVENT_SOURCES[source]
+    columns = [spec["id"], _epoch_us(spec["time"])]
+    names, dtypes = ["temp_id", "ts"], {"temp_id": object, "ts": np.int64, "location_id": object}
+    if spec["location"]:
+        columns.append(spec["location"])
+        names.append("location_id")
+    extra = [name for name in extra_columns if name in spec.get("extra", {})]
+    for name in extra:
+        timestamp = EXTRA_DTYPES[name] == "timestamp"
+        columns.append(_epoch_us(spec["extra"][name]) if timestamp else spec["extra"][name])
+        names.append(name)
+        dtypes[name] = "Int64" if timestamp else EXTRA_DTYPES[name]
+    where = [f"{spec['time']} IS NOT NULL"]
+    if start is not None:
+        where.append(f"{spec['time']} >= %(start)s")
+    if end is not None:
+        where.append(f"{spec['time']} < %(end)s")
+    sql = f"SELECT {', '.join(columns)} FROM {spec['table']} WHERE {' AND '.join(where)}"
+
+    df = copy_query(cur, sql, {"start": start, "end": end}, names, dtypes, chunk_size)
+    df.insert(1, "timestamp", pd.to_datetime(df.pop("ts").to_numpy(), unit="us"))
+    for name in extra:
+        if EXTRA_DTYPES[name] == "timestamp":
+            df[name] = pd.to_datetime(df[name], unit="us")
+    if not spec["location"]:
+        df["location_id"] = CONSTANT_LOCATIONS[source]
+    df["source"] = source
+    return df[["temp_id", "timestamp", "location_id", "source", *extra]]
+
+
+def read_profiles(cur, chunk_size=CHUNK_SIZE):
+    sql = f"SELECT {', '.join(PROFILE_COLUMNS)} FROM student_or_staff_profiles"
+    return copy_query(cur, sql, {}, list(PROFILE_COLUMNS), {c: object for c in PROFILE_COLUMNS}, chunk_size)
+
+
+def read_events(conn=None, start=None, end=None, chunk_size=CHUNK_SIZE, sources=None, extra_columns=()):
+    """
+    Every event source (or just `sources`) and the profiles, optionally within [start, end).
+    Returns (per-source frames, profiles, report {source: {'rows', 'read_s'}}).
+    """
+    own = conn is None
+    conn = conn or connect()
+    try:
+        cur = conn.cursor()
+        dfs, report = [], {}
+        for source in sources or EVENT_SOURCES:
+            t0 = time.perf_counter()
+            df = read_source(cur, source, start, end, chunk_size, extra_columns)
+            print(f"Read {len(df):,} rows from {EVENT_SOURCES[source]['table']}")
+            dfs.append(df)
+            report[source] = {"rows": len(df), "read_s": time.perf_counter() - t0}
+        profiles = read_profiles(cur, chunk_size)
+        cur.close()
+        conn.rollback()  # read-only; end the transaction
+    finally:
+        if own:
+            conn.close()
+    return dfs, profiles, report
+
+
+def snapshot_xmin(cur) -> int:
+    """Oldest transaction still running: every row not visible yet is written by one from this xid on."""
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+    return cur.fetchone()[0]
+
+
+def ingested_ranges(cur, sources, since_xid, until, gap=pd.Timedelta(0)):
+    """
+    Event time ranges of the rows inserted into the sources' tables by transactions from since_xid on
+    (ingest_ranges), cut at until; ranges less than gap apart are merged. Returns sorted (start, end) pairs.
+    """
+    cur.execute(
+        "SELECT min_time, LEAST(max_time, %s) FROM ingest_ranges "
+        "WHERE xid >= %s::text::xid8 AND source = ANY(%s) AND min_time <= %s ORDER BY min_time",
+        (until, since_xid, [EVENT_SOURCES[source]["table"] for source in sources], until))
+    ranges = []
+    for start, end in cur.fetchall():
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if ranges and start <= ranges[-1][1] + gap:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
@@ -1,30 +1,66 @@
+import hashlib
+import io
+import json
 import os
+import threading
+import time
+import urllib.request
+from collections import Counter
 import psycopg2
 from psycopg2 import pool
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from ingest_utils import CHUNK_SIZE, MAX_WORKERS, INCREMENTAL, report_file_stats
+from partitions import prepare_partitions
+from response_cache import INVALIDATE_TOKEN
 
 load_dotenv()
 
 
 DATA_DIR = 'data'
+REJECTS_DIR = 'rejects'
 
-# Connection pool
+# 'copy' streams each file through a staging table, 'row' is the old per-row path
+LOAD_MODE = os.getenv("DB_INSERT_MODE", "copy")
+
+# The API caches responses per entity; after a load it is told which identifiers changed
+API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+IDENTIFIER_COLUMNS = ('entity_id', 'card_id', 'device_hash', 'face_id')
+# Above this many identifiers the API is asked to drop its whole cache instead
+INVALIDATE_ALL_THRESHOLD = 10000
+
+# Run the anomaly rules (anomaly_rules.py) over the newly loaded events after every load
+ANOMALY_DETECTION = os.getenv("ANOMALY_DETECTION", "1") == "1"
+# Score the newly loaded events against the saved location model (deviation_scores.py)
+DEVIATION_SCORING = os.getenv("DEVIATION_SCORING", "1") == "1"
+
+# Connection pool, shared by the loader threads (one connection per worker)
 _db_pool = None
+_pool_lock = threading.Lock()
+
+def _initialize_pool(max_workers=MAX_WORKERS):
+    """Initialize the connection pool on first use, with a connection for each of max_workers loaders.
 
-def _initialize_pool():
-    """Initialize connection pool on first use."""
+    A pool smaller than that (created for fewer workers) is replaced; main sizes it
+    before starting its loaders, while no connection is checked out.
+    """
     global _db_pool
-    if _db_pool is None:
-        _db_pool = pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=5,
-            host=os.getenv("DB_MAIN_HOST"),
-            port=os.getenv("DB_MAIN_PORT"),
-            user=os.getenv("DB_MAIN_USER"),
-            password=os.getenv("DB_MAIN_PASSWORD"),
-            database=os.getenv("DB_MAIN_NAME")
-        )
+    with _pool_lock:
+        if _db_pool is not None and _db_pool.maxconn < max_workers:
+            _db_pool.closeall()
+            _db_pool = None
+        if _db_pool is None:
+            _db_pool = pool.ThreadedConnectionPool(
+                minconn=1,
+                maxconn=max(5, max_workers),
+                host=os.getenv("DB_MAIN_HOST"),
+                port=os.getenv("DB_MAIN_PORT"),
+                user=os.getenv("DB_MAIN_USER"),
+                password=os.getenv("DB_MAIN_PASSWORD"),
+                database=os.getenv("DB_MAIN_NAME")
+            )
 
 # Mapping of file names to table names
 FILE_TABLE_MAP = {
@@ -38,11 +74,22 @@ FILE_TABLE_MAP = {
     'wifi_associations_logs.csv': 'wifi_associations_logs',
 }
 
+# Loaded ahead of the event tables (see main)
+PROFILES_TABLE = 'student_or_staff_profiles'
+
 # Column renaming for specific files
 COLUMN_RENAMES = {
     'lab_bookings.csv': {'attended (YES/NO)': 'attended'},
 }
 
+# Event time column used as the high-water mark for incremental loads, for the tables without
+# a primary key (ON CONFLICT cannot dedupe their reloads). Every other table relies on the
+# file hash and ON CONFLICT DO NOTHING, so late or future-dated rows are never cut.
+WATERMARK_COLUMNS = {
+    'campus_card_swipes': 'timestamp',
+    'wifi_associations_logs': 'timestamp',
+}
+
 def get_connection():
     """Get a connection from the database pool."""
     _initialize_pool()
@@ -54,45 +101,378 @@ def release_connection(conn):
         _db_pool.putconn(conn)
 
 def insert_dataframe(df, table_name, conn):
-    cols = ','.join(df.columns)
-    vals = ','.join(['%s'] * len(df.columns))
-    insert_sql = f'INSERT INTO {table_name} ({cols}) VALUES ({vals}) ON CONFLICT DO NOTHING'
+    return insert_chunks([df], table_name, conn)
+
+def insert_chunks(chunks, table_name, conn, before_commit=None):
+    """Per-row load: one BEGIN/INSERT/COMMIT round trip set per row."""
     cur = conn.cursor()
     success, fail = 0, 0
     first_error = None
-    for row in df.itertuples(index=False, name=None):
-        try:
-            cur.execute('BEGIN;')
-            cur.execute(insert_sql, row)
-            cur.execute('COMMIT;')
-            success += 1
-        except Exception as e:
-            cur.execute('ROLLBACK;')
-            fail += 1
-            if not first_error:
-                first_error = str(e)
+    for df in chunks:
+        cols = ','.join(df.columns)
+        vals = ','.join(['%s'] * len(df.columns))
+        insert_sql = f'INSERT INTO {table_name} ({cols}) VALUES ({vals}) ON CONFLICT DO NOTHING'
+        for row in df.itertuples(index=False, name=None):
+            try:
+                cur.execute('BEGIN;')
+                cur.execute(insert_sql, row)
+                cur.execute('COMMIT;')
+                success += 1
+            except Exception as e:
+                cur.execute('ROLLBACK;')
+                fail += 1
+                if not first_error:
+                    first_error = str(e)
+    if before_commit:
+        before_commit(cur, success)
+        conn.commit()
     cur.close()
     print(f"Table {table_name}: {success} rows inserted, {fail} failed.")
     if first_error:
         print(f"First error for {table_name}: {first_error}")
+    return success, fail
+
+def _copy_rows(cur, staging, cols, df):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert(f'COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)', buf)
+
+def _stage_rows(cur, staging, cols, df, rejects):
+    """COPY df into the staging table, bisecting failed batches down to the bad rows.
+
+    Every batch runs under a savepoint, so a rejected row only costs the COPYs
+    needed to isolate it instead of a transaction per row. Rejected rows are
+    appended to `rejects` as (index, error) pairs.
+    """
+    cur.execute('SAVEPOINT stage_batch;')
+    try:
+        _copy_rows(cur, staging, cols, df)
+        cur.execute('RELEASE SAVEPOINT stage_batch;')
+        return len(df)
+    except psycopg2.Error as e:
+        cur.execute('ROLLBACK TO SAVEPOINT stage_batch;')
+        cur.execute('RELEASE SAVEPOINT stage_batch;')
+        if len(df) == 1:
+            rejects.append((df.index[0], str(e).strip().splitlines()[0]))
+            return 0
+        mid = len(df) // 2
+        return (_stage_rows(cur, staging, cols, df.iloc[:mid], rejects)
+                + _stage_rows(cur, staging, cols, df.iloc[mid:], rejects))
+
+def rejects_path(table_name):
+    return os.path.join(REJECTS_DIR, f'{table_name}.csv')
+
+def write_rejects(df, rejects, table_name, append=False):
+    """Write rejected rows plus their error message to REJECTS_DIR/<table>.csv."""
+    os.makedirs(REJECTS_DIR, exist_ok=True)
+    path = rejects_path(table_name)
+    index, errors = zip(*rejects)
+    rejected = df.loc[list(index)].copy()
+    rejected['error'] = list(errors)
+    rejected.to_csv(path, index=False, mode='a' if append else 'w', header=not append)
+    return path
+
+def copy_dataframe(df, table_name, conn):
+    return copy_chunks([df], table_name, conn)
+
+def copy_chunks(chunks, table_name, conn, before_commit=None):
+    """Bulk load an iterable of DataFrames via COPY into a staging table and one set-based merge.
+
+    Chunks are streamed into the staging table as they arrive, so memory stays
+    bounded by the chunk size, and the whole file is merged and committed at once.
+    Reports the same inserted/failed counts as insert_chunks: rows that the
+    target accepts (including ones skipped by ON CONFLICT) count as inserted,
+    rows violating types or constraints count as failed and go to the rejects file.
+    On a time-partitioned table the partitions the staged rows fall in are created
+    before the merge (partitions.prepare_partitions), in a transaction of their own:
+    the staging table lives for the session, so the staged rows are committed first
+    (only this session sees them) and the merge then starts with the partitions in place.
+    before_commit(cur, rows), if given, runs inside the same transaction as the merge.
+    """
+    staging = f'_stage_{table_name}'
+    if os.path.exists(rejects_path(table_name)):
+        os.remove(rejects_path(table_name))
+    cur = conn.cursor()
+    cols = None
+    success, fail, merged = 0, 0, 0
+    first_error = None
+    try:
+        for df in chunks:
+            if cols is None:
+                cols = ','.join(df.columns)
+                cur.execute(
+                    f'CREATE TEMP TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                )
+            rejects = []
+            success += _stage_rows(cur, staging, cols, df, rejects)
+            if rejects:
+                write_rejects(df, rejects, table_name, append=fail > 0)
+                fail += len(rejects)
+                first_error = first_error or rejects[0][1]
+        if cols is not None:
+            conn.commit()
+            if prepare_partitions(cur, table_name, staging):
+                conn.commit()
+            cur.execute(f'INSERT INTO {table_name} ({cols}) SELECT {cols} FROM {staging} ON CONFLICT DO NOTHING')
+            merged = cur.rowcount
+        if before_commit:
+            before_commit(cur, success)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if cols is not None and not conn.closed:
+            cur.execute(f'DROP TABLE IF EXISTS {staging}')
+            conn.commit()
+        cur.close()
+
+    print(f"Table {table_name}: {success} rows inserted, {fail} failed.")
+    if success != merged:
+        print(f"Table {table_name}: {success - merged} rows already present, {merged} new.")
+    if first_error:
+        print(f"First error for {table_name}: {first_error}")
+        print(f"Rejected rows written to {rejects_path(table_name)}")
+    return success, fail
+
+def read_chunks(file_name, file_path, chunk_size=CHUNK_SIZE):
+    """Stream a processed CSV in chunks with COLUMN_RENAMES applied."""
+    renames = COLUMN_RENAMES.get(file_name)
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        yield chunk.rename(columns=renames) if renames else chunk
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def main():
+def get_watermark(conn, source, digest):
+    """Return (high-water mark, whether this exact file was already loaded) for a source."""
+    cur = conn.cursor()
+    cur.execute(
+        'SELECT MAX(max_timestamp), COALESCE(BOOL_OR(file_hash = %s), FALSE) FROM ingest_manifest WHERE source = %s',
+        (digest, source)
+    )
+    watermark, seen = cur.fetchone()
+    cur.close()
+    conn.commit()
+    return watermark, seen
+
+def rows_at_watermark(conn, table, column, watermark):
+    """Rows already loaded at exactly the watermark, counted by content (see WatermarkFilter)."""
+    if watermark is None:
+        return Counter()
+    cur = conn.cursor()
+    cur.execute(f'SELECT * FROM {table} WHERE {column} = %s', (watermark,))
+    names = [desc[0] for desc in cur.description]
+    rows = Counter(_row_key(dict(zip(names, row)), column) for row in cur.fetchall())
+    cur.close()
+    conn.commit()
+    return rows
+
+def _row_key(row, column):
+    """Content of a row apart from its time column, as strings, in column name order."""
+    return tuple((name, str(row[name])) for name in sorted(row) if name != column)
+
+class WatermarkFilter:
+    """Drops rows below a source's high-water mark while tracking the new maximum.
+
+    Rows at exactly the watermark are kept unless the same content was already
+    loaded at that time (loaded: Counter from rows_at_watermark); each loaded
+    row cancels one identical new row, so a second swipe in the same second
+    that arrives in a later upload is still loaded. Rows without a parseable
+    timestamp are passed through so the load reports them as rejects (or, for
+    nullable columns, loads them) exactly as before.
+    """
+    def __init__(self, column, watermark, loaded=None):
+        self.column = column
+        self.watermark = pd.Timestamp(watermark) if watermark is not None else None
+        self.loaded = Counter(loaded or ())
+        self.max_timestamp = None
+        self.skipped = 0
+
+    def __call__(self, chunks):
+        for chunk in chunks:
+            if self.column not in chunk.columns:
+                yield chunk
+                continue
+            ts = pd.to_datetime(chunk[self.column], errors='coerce')
+            if self.watermark is not None:
+                keep = (ts.isna() | (ts >= self.watermark)).to_numpy()
+                for i in np.flatnonzero((ts == self.watermark).to_numpy()):
+                    key = _row_key(chunk.iloc[i].to_dict(), self.column)
+                    if self.loaded[key] > 0:
+                        self.loaded[key] -= 1
+                        keep[i] = False
+                self.skipped += int((~keep).sum())
+                chunk, ts = chunk[keep], ts[keep]
+            chunk_max = ts.max()
+            if pd.notna(chunk_max) and (self.max_timestamp is None or chunk_max > self.max_timestamp):
+                self.max_timestamp = chunk_max
+            yield chunk
+
+class IdentifierCollector:
+    """Records the identifier values of every row streamed through it, across loader threads."""
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, chunks):
+        for chunk in chunks:
+            with self._lock:
+                for col in IDENTIFIER_COLUMNS:
+                    if col in chunk.columns:
+                        self.values.setdefault(col, set()).update(chunk[col].dropna().astype(str))
+            yield chunk
+
+    def __len__(self):
+        return sum(len(v) for v in self.values.values())
+
+def notify_api(collector):
+    """Tell the API which identifiers got new rows so it drops their cached responses.
+
+    The API may not be running (e.g. a first full load); the cache TTL bounds
+    staleness in that case, so failures are only reported.
+    """
+    if not len(collector):
+        return
+    if len(collector) > INVALIDATE_ALL_THRESHOLD:
+        payload = {'clear_all': True}
+    else:
+        payload = {'identifiers': {col: sorted(values) for col, values in collector.values.items()}}
+    headers = {'Content-Type': 'application/json'}
+    if INVALIDATE_TOKEN:
+        headers['X-Invalidate-Token'] = INVALIDATE_TOKEN
+    request = urllib.request.Request(
+        f'{API_URL}/cache/invalidate', data=json.dumps(payload).encode(), headers=headers, method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            print(f"API cache: {json.load(response)['invalidated']} cached responses invalidated.")
+    except OSError as e:
+        print(f'API cache not invalidated ({API_URL} not reachable: {e}).')
+
+def run_anomaly_rules():
+    """Evaluate the anomaly rules on what was just loaded. A failure is reported, not raised:
+    the rows are committed and the next load picks the rules up where they stopped."""
+    try:
+        import anomaly_rules
+        anomaly_rules.detect_anomalies()
+    except Exception as e:
+        print(f'Anomaly rules not evaluated: {e}')
+
+def run_deviation_scoring():
+    """Score what was just loaded against the latest saved model, if there is one; failures are reported."""
+    try:
+        import deviation_scores
+        deviation_scores.score_new_events()
+    except FileNotFoundError:
+        print('Deviation scores skipped: no saved model yet.')
+    except Exception as e:
+        print(f'Deviation scores not computed: {e}')
+
+def load_file(file_name, table_name, mode=LOAD_MODE, chunk_size=CHUNK_SIZE, incremental=INCREMENTAL,
+              collector=None):
+    """Load one processed CSV into its table on a connection of its own.
+
+    In incremental mode a file whose content hash is already in ingest_manifest
+    is skipped outright, and for the tables in WATERMARK_COLUMNS rows below the
+    source's high-water mark, or already loaded at it, are dropped. The
+    manifest row is written in the same transaction as the merge.
+
+    If a collector is given, the identifiers of every row offered to the table
+    are recorded in it.
+    """
+    load = copy_chunks if mode == 'copy' else insert_chunks
+    file_path = os.path.join(DATA_DIR, file_name)
     conn = None
     try:
         conn = get_connection()
-        for file_name, table_name in FILE_TABLE_MAP.items():
-            file_path = os.path.join(DATA_DIR, file_name)
-            if os.path.exists(file_path):
-                print(f'Inserting {file_name} into {table_name}...')
-                df = pd.read_csv(file_path)
-                # Rename columns if needed
-                if file_name in COLUMN_RENAMES:
-                    df = df.rename(columns=COLUMN_RENAMES[file_name])
-                insert_dataframe(df, table_name, conn)
-        print('All data inserted into ethos database.')
+        start = time.perf_counter()
+        chunks = read_chunks(file_name, file_path, chunk_size)
+        digest, watermark_filter = None, None
+        if incremental:
+            digest = file_hash(file_path)
+            watermark, seen = get_watermark(conn, table_name, digest)
+            if seen:
+                print(f'Skipping {file_name}: already loaded into {table_name}.')
+                return time.perf_counter() - start
+            if table_name in WATERMARK_COLUMNS:
+                column = WATERMARK_COLUMNS[table_name]
+                watermark_filter = WatermarkFilter(column, watermark,
+                                                   rows_at_watermark(conn, table_name, column, watermark))
+                chunks = watermark_filter(chunks)
+
+        def record_manifest(cur, rows):
+            max_ts = watermark_filter.max_timestamp if watermark_filter is not None else None
+            cur.execute(
+                'INSERT INTO ingest_manifest (source, file_hash, max_timestamp, rows_loaded) '
+                'VALUES (%s, %s, %s, %s) ON CONFLICT (source, file_hash) DO NOTHING',
+                (table_name, digest, max_ts.to_pydatetime() if max_ts is not None else None, rows)
+            )
+
+        if collector is not None:
+            chunks = collector(chunks)
+        print(f'Inserting {file_name} into {table_name}...')
+        success, fail = load(chunks, table_name, conn, record_manifest if incremental else None)
+        elapsed = time.perf_counter() - start
+        if watermark_filter is not None and watermark_filter.skipped:
+            print(f'Table {table_name}: {watermark_filter.skipped} rows below or already loaded at the watermark skipped.')
+        report_file_stats('db_insert', file_name, success + fail, elapsed)
+        return elapsed
     finally:
         if conn:
             release_connection(conn)
 
+def main(mode=LOAD_MODE, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS, incremental=INCREMENTAL):
+    """Load every file in FILE_TABLE_MAP, up to max_workers tables at a time.
+
+    The tables are independent, so wall-clock time follows the largest table
+    rather than the sum; largest files are submitted first to keep workers busy.
+    Profiles are loaded before the rest: the entity_last_activity triggers on the
+    event tables map new rows to entities through the committed profiles.
+    """
+    jobs = [(file_name, table_name) for file_name, table_name in FILE_TABLE_MAP.items()
+            if os.path.exists(os.path.join(DATA_DIR, file_name))]
+    jobs.sort(key=lambda job: os.path.getsize(os.path.join(DATA_DIR, job[0])), reverse=True)
+    first = [job for job in jobs if job[1] == PROFILES_TABLE]
+    jobs = [job for job in jobs if job[1] != PROFILES_TABLE]
+
+    _initialize_pool(max_workers)
+    start = time.perf_counter()
+    busy = 0.0
+    failed = []
+    collector = IdentifierCollector()
+    for file_name, table_name in first:
+        try:
+            busy += load_file(file_name, table_name, mode, chunk_size, incremental, collector)
+        except Exception as e:
+            failed.append(table_name)
+            print(f"Loading {table_name} failed: {e}")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(load_file, file_name, table_name, mode, chunk_size, incremental, collector): table_name
+                   for file_name, table_name in jobs}
+        for future in as_completed(futures):
+            try:
+                busy += future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Loading {futures[future]} failed: {e}")
+    print(f'Loaded {len(first) + len(jobs)} tables in {time.perf_counter() - start:.2f}s '
+          f'({busy:.2f}s of table time, {max_workers} workers).')
+    notify_api(collector)
+    if ANOMALY_DETECTION:
+        run_anomaly_rules()
+    if DEVIATION_SCORING:
+        run_deviation_scoring()
+    if failed:
+        raise RuntimeError(f"Failed to load: {', '.join(failed)}")
+    print('All data inserted into ethos database.')
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,181 @@
+"""
+Thread-safe psycopg2 connection pool with blocking acquire.
+
+Drop-in for psycopg2.pool.SimpleConnectionPool (getconn/putconn/closeall):
+
+ - getconn() waits up to `timeout` seconds for a free connection instead of
+   raising as soon as maxconn connections are out, then raises PoolTimeout
+ - connections idle for longer than HEALTH_CHECK_AFTER are pinged before they
+   are handed out; closed or dead ones are replaced with a fresh connection
+ - putconn() rolls back whatever transaction the caller left open
+
+Histogram is also used for the wait and checkout times of get_info_async's pool
+(GET /metrics/pool).
+"""
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seconds getconn() waits for a free connection before giving up
+ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+
+# Connections idle longer than this are checked with SELECT 1 before reuse
+HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", "30"))
+
+MS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class Histogram:
+    """Fixed-bucket histogram; each bucket counts observations <= its bound (last one is +inf)."""
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        labels = [f"le_{b}" for b in self.bounds] + ["le_inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "max": round(self.max, 3),
+        }
+
+
+class BlockingConnectionPool:
+    def __init__(self, minconn, maxconn, timeout=ACQUIRE_TIMEOUT, name="pool", **conn_kwargs):
+        """
+        Args:
+            minconn: kept for SimpleConnectionPool's signature; connections open on demand
+            maxconn: connections open at most; further getconn() calls wait
+            timeout: default seconds getconn() waits before raising PoolTimeout
+            name: label used in error messages
+            conn_kwargs: passed to psycopg2.connect
+        """
+        self.minconn = int(minconn)
+        self.maxconn = int(maxconn)
+        self.timeout = float(timeout)
+        self.name = name
+        self.closed = False
+        self._conn_kwargs = conn_kwargs
+        self._cond = threading.Condition()
+        self._idle = []           # [(conn, returned_at)]
+        self._checked_out = {}    # id(conn) -> checked out at
+        self._opened = 0          # open connections, idle or checked out
+
+    def _connect(self):
+        return psycopg2.connect(**self._conn_kwargs)
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds (default: the pool's)."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._opened < self.maxconn:
+                    conn, idle_since = None, None
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"{self.name}: no connection free after {timeout:.1f}s ({self.maxconn} in use)"
+                    )
+                self._cond.wait(remaining)
+
+        # Connects and health checks happen outside the lock
+        try:
+            if conn is not None and not self._healthy(conn, idle_since):
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checked_out[id(conn)] = time.monotonic()
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection; open transactions are rolled back, broken connections dropped."""
+        with self._cond:
+            checked_out = self._checked_out.pop(id(conn), None)
+        if checked_out is None:
+            raise PoolError("trying to put a connection that was not checked out of this pool")
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+        keep = not (close or conn.closed or self.closed)
+        if not keep and not conn.closed:
+            conn.close()
+        with self._cond:
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            if not conn.closed:
+                conn.close()
+
@@ -0,0 +1,168 @@
+"""
+Deviation scores: how likely each newly observed (entity, window, location) is
+under the served CampusLocationPredictor, persisted for /alerts/anomalous.
+
+score_new_events() reads the time windows of the events after the last scored
+one (on a first run, after the model's latest event) up to the ingest horizon
+(see anomaly_rules.ingest_horizon), and the windows rows ingested since its
+last run landed in below that (ingest_ranges, see anomaly_rules), so a lagging
+source or a late upload is scored too. Windows are always read whole: their
+events are counted per (entity, time window, location) and scored in one
+score_observations call, and the rows are upserted into deviation_scores with
+the full count, so scoring a window again replaces its row instead of adding
+to it. The transaction horizon of the run is kept in ingest_checkpoints, in
+the same transaction as the scores. Observations scoring below
+DEVIATION_THRESHOLD are the anomalies; the threshold is applied when reading,
+so it can be changed per request.
+
+Scoring runs before the model is updated with the same events, so an
+observation is never scored by a model that has already learned it.
+db_insert.py calls it after every load.
+
+    python deviation_scores.py
+"""
+import io
+import os
+import time
+from typing import Dict
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Probability below which an observation is reported by /alerts/anomalous
+DEVIATION_THRESHOLD = float(os.getenv("DEVIATION_THRESHOLD", "0.05"))
+
+SCORES_TABLE = "deviation_scores"
+# Row of this module in ingest_checkpoints
+CHECKPOINT = "deviation_scores"
+SCORE_COLUMNS = ["entity_id", "time_window", "location_id", "event_count", "last_seen", "probability", "method",
+                 "model_version"]
+
+UPSERT_SQL = f"""
+INSERT INTO {SCORES_TABLE} AS s ({', '.join(SCORE_COLUMNS)})
+SELECT {', '.join(SCORE_COLUMNS)} FROM _stage_{SCORES_TABLE}
+ON CONFLICT (entity_id, time_window, location_id) DO UPDATE
+SET event_count = EXCLUDED.event_count,
+    last_seen = EXCLUDED.last_seen,
+    probability = EXCLUDED.probability,
+    method = EXCLUDED.method,
+    model_version = EXCLUDED.model_version,
+    scored_at = now()
+"""
+
+
+def observations(model, events: pd.DataFrame) -> pd.DataFrame:
+    """Events counted per (entity, time window, location), scored by model."""
+    window = events['timestamp'].dt.floor(pd.Timedelta(hours=model.time_window_hours))
+    grouped = events.assign(time_window=window).groupby(['entity_id', 'time_window', 'location_id'], sort=False)
+    counts = grouped['timestamp'].agg(['size', 'max']).reset_index()
+    scores = model.score_observations(counts['entity_id'], counts['time_window'], counts['location_id'])
+    return pd.DataFrame({
+        'entity_id': counts['entity_id'],
+        'time_window': counts['time_window'],
+        'location_id': counts['location_id'],
+        'event_count': counts['size'],
+        'last_seen': counts['max'],
+        'probability': scores['probability'].to_numpy(),
+        'method': scores['method'].to_numpy(),
+        'model_version': model.model_version,
+    })
+
+
+def write_scores(scores: pd.DataFrame, conn, ingested_from=None):
+    """COPY scores into a staging table and upsert them in one statement, with the checkpoint
+    ingested_from (if given) in the same transaction; commits."""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"CREATE TEMP TABLE _stage_{SCORES_TABLE} (LIKE {SCORES_TABLE} INCLUDING DEFAULTS) ON COMMIT DROP")
+        buf = io.StringIO()
+        scores[SCORE_COLUMNS].to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        cur.copy_expert(f"COPY _stage_{SCORES_TABLE} ({', '.join(SCORE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(UPSERT_SQL)
+        if ingested_from is not None:
+            cur.execute("INSERT INTO ingest_checkpoints (consumer, xid) VALUES (%s, %s::text::xid8) "
+                        "ON CONFLICT (consumer) DO UPDATE SET xid = EXCLUDED.xid, updated_at = now()",
+                        (CHECKPOINT, ingested_from))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def windows_to_score(since, late, horizon, window):
+    """
+    Whole time windows from the one containing since up to horizon and around each late (start, end)
+    range, merged where they touch; (start, end) pairs to read as [start, end).
+    """
+    spans = [(start.floor(window), end.floor(window) + window) for start, end in late]
+    if horizon is not None and horizon >= since:
+        spans.append((since.floor(window), horizon + pd.Timedelta(microseconds=1)))
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def score_new_events(conn=None, model=None) -> Dict:
+    """Score the events ingested since the last run with model (default: the latest saved one)."""
+    import db_events
+    import model_store
+    from anomaly_rules import ingest_horizon
+    model = model or model_store.load_model()
+    own = conn is None
+    conn = conn or db_events.connect()
+    start = time.perf_counter()
+    report = {'events': 0, 'observations': 0, 'anomalous': 0}
+    try:
+        cur = conn.cursor()
+        # Taken before anything is read: rows the reads below miss are written from this xid on
+        ingested_from = db_events.snapshot_xmin(cur)
+        cur.execute(f"SELECT MAX(last_seen) FROM {SCORES_TABLE}")
+        scored_through = cur.fetchone()[0]
+        scored_through = pd.Timestamp(scored_through) if scored_through is not None else None
+        cur.execute("SELECT xid::text::bigint FROM ingest_checkpoints WHERE consumer = %s", (CHECKPOINT,))
+        checkpoint = cur.fetchone()
+        late = []
+        if scored_through is not None and checkpoint is not None:
+            late = db_events.ingested_ranges(cur, db_events.EVENT_SOURCES, checkpoint[0], scored_through)
+        _, horizon = ingest_horizon(cur, db_events.EVENT_SOURCES)
+        cur.close()
+        conn.rollback()
+        since = (scored_through + pd.Timedelta(microseconds=1) if scored_through is not None
+                 else model.next_event_time())
+        window = pd.Timedelta(hours=model.time_window_hours)
+        frames = []
+        for first, end in windows_to_score(since, late, horizon, window):
+            events, _ = model.read_events_db(first, end, conn=conn)
+            if len(events):
+                frames.append(events)
+        events = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if len(events):
+            scores = observations(model, events)
+            write_scores(scores, conn, ingested_from)
+            report.update(events=len(events), observations=len(scores),
+                          anomalous=int((scores['probability'] < DEVIATION_THRESHOLD).sum()))
+        elif horizon is not None:
+            write_scores(pd.DataFrame(columns=SCORE_COLUMNS), conn, ingested_from)
+    finally:
+        if own:
+            conn.close()
+    report['seconds'] = time.perf_counter() - start
+    print(f"Deviation scores: {report['events']:,} events -> {report['observations']:,} observations, "
+          f"{report['anomalous']:,} below {DEVIATION_THRESHOLD} (model {model.model_version}) "
+          f"in {report['seconds']:.2f}s")
+    return report
+
+
+if __name__ == "__main__":
+    try:
+        score_new_events()
+    except FileNotFoundError:
+        print("Deviation scores skipped: no saved model yet.")
@@ -1,12 +1,16 @@
 import psycopg2
-from psycopg2 import pool
 import pandas as pd
 import os
+import threading
 import shutil
 import glob
 from datetime import datetime, timedelta
 import numpy as np
 from dotenv import load_dotenv
+import identity_index
+from db_pool import BlockingConnectionPool
+from identity_index import IDENTIFIER_FIELDS
+from deviation_scores import DEVIATION_THRESHOLD
 
 
 # Load environment variables
@@ -34,32 +38,36 @@ OUTPUT_DIR = "output"
 # ---------- CONNECTION POOLS ----------
 _main_pool = None
 _images_pool = None
+_pools_lock = threading.Lock()
 
 def _initialize_pools():
     """Initialize connection pools on first use."""
     global _main_pool, _images_pool
     
-    if _main_pool is None:
-        _main_pool = pool.SimpleConnectionPool(
-            minconn=2,
-            maxconn=20,
-            host=os.getenv("DB_MAIN_HOST"),
-            port=os.getenv("DB_MAIN_PORT"),
-            user=os.getenv("DB_MAIN_USER"),
-            password=os.getenv("DB_MAIN_PASSWORD"),
-            database=os.getenv("DB_MAIN_NAME")
-        )
-    
-    if _images_pool is None:
-        _images_pool = pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=5,
-            host=os.getenv("DB_IMAGES_HOST"),
-            port=os.getenv("DB_IMAGES_PORT"),
-            user=os.getenv("DB_IMAGES_USER"),
-            password=os.getenv("DB_IMAGES_PASSWORD"),
-            database=os.getenv("DB_IMAGES_NAME")
-        )
+    with _pools_lock:
+        if _main_pool is None:
+            _main_pool = BlockingConnectionPool(
+                minconn=2,
+                maxconn=int(os.getenv("DB_MAIN_POOL_MAX", "20")),
+                name="main",
+                host=os.getenv("DB_MAIN_HOST"),
+                port=os.getenv("DB_MAIN_PORT"),
+                user=os.getenv("DB_MAIN_USER"),
+                password=os.getenv("DB_MAIN_PASSWORD"),
+                database=os.getenv("DB_MAIN_NAME")
+            )
+        
+        if _images_pool is None:
+            _images_pool = BlockingConnectionPool(
+                minconn=1,
+                maxconn=int(os.getenv("DB_IMAGES_POOL_MAX", "5")),
+                name="images",
+                host=os.getenv("DB_IMAGES_HOST"),
+                port=os.getenv("DB_IMAGES_PORT"),
+                user=os.getenv("DB_IMAGES_USER"),
+                password=os.getenv("DB_IMAGES_PASSWORD"),
+                database=os.getenv("DB_IMAGES_NAME")
+            )
 
 # Table identifier mapping: table -> (identifier field, timestamp field)
 TABLES = {
@@ -71,6 +79,56 @@ TABLES = {
     "campus_card_swipes": ("card_id", "timestamp"),
 }
 
+# Normalised timeline columns and their SQL types (shared by every source in the UNION ALL)
+TIMELINE_COLUMNS = {
+    "event_id": "VARCHAR",
+    "entity_id": "VARCHAR",
+    "face_id": "VARCHAR",
+    "card_id": "VARCHAR",
+    "device_hash": "VARCHAR",
+    "location_id": "VARCHAR",
+    "room_id": "VARCHAR",
+    "ap_id": "VARCHAR",
+    "book_id": "VARCHAR",
+    "category": "VARCHAR",
+    "text": "TEXT",
+    "attended": "VARCHAR",
+    "start_time": "TIMESTAMP",
+    "end_time": "TIMESTAMP",
+    "timestamp": "TIMESTAMP",
+}
+
+# Per table: normalised column -> table column, in table column order.
+# `match` is the target-profile expression the table's identifier is compared with.
+TIMELINE_SOURCES = {
+    "wifi_associations_logs": {
+        "match": ("device_hash", "t.device_hash"),
+        "columns": {"device_hash": "device_hash", "ap_id": "ap_id", "timestamp": "timestamp"},
+    },
+    "library_checkouts": {
+        "match": ("entity_id", "t.entity_id"),
+        "columns": {"event_id": "checkout_id", "entity_id": "entity_id", "book_id": "book_id", "timestamp": "timestamp"},
+    },
+    "lab_bookings": {
+        "match": ("entity_id", "t.entity_id"),
+        "columns": {"event_id": "booking_id", "entity_id": "entity_id", "room_id": "room_id",
+                    "start_time": "start_time", "end_time": "end_time", "attended": "attended"},
+    },
+    "free_text_notes": {
+        "match": ("entity_id", "t.entity_id"),
+        "columns": {"event_id": "note_id", "entity_id": "entity_id", "category": "category",
+                    "text": "text", "timestamp": "timestamp"},
+    },
+    "cctv_frames": {
+        "match": ("face_id", "'F' || substr(t.entity_id, 2)"),
+        "columns": {"event_id": "frame_id", "location_id": "location_id", "timestamp": "timestamp", "face_id": "face_id"},
+    },
+    "campus_card_swipes": {
+        "match": ("card_id", "t.card_id"),
+        "columns": {"card_id": "card_id", "location_id": "location_id", "timestamp": "timestamp"},
+    },
+}
+
 # ---------- CONNECTIONS ----------
 def connect_main():
     """Get a connection from the main database pool."""
@@ -131,16 +189,12 @@ def get_user_input():
 
 # ---------- RESOLVE ENTITY ----------
 def resolve_entity(cur, identifier):
-    #print("Resolving entity for identifier:", identifier)
+    """Resolve an identifier to its profile through the in-process identity index."""
     key, value = list(identifier.items())[0]
     print(f"Resolving entity by {key} = {value} ...")
-    cur.execute(f"SELECT * FROM student_or_staff_profiles WHERE {key}=%s", (value,))
-    row = cur.fetchone()
-    #print("Resolved entity:", row)
-    if not row:
+    if key not in IDENTIFIER_FIELDS:
         return None
-    cols = [desc[0] for desc in cur.description]
-    return dict(zip(cols, row))
+    return identity_index.resolve(cur.connection, key, value)
 
 # ---------- QUERY TABLE ----------
 def query_table(cur, table, id_field, id_value, time_field=None, start=None, end=None, location=None):
@@ -162,6 +216,86 @@ def query_table(cur, table, id_field, id_value, time_field=None, start=None, end
     cols = [desc[0] for desc in cur.description]
     return pd.DataFrame(rows, columns=cols)
 
+# ---------- ENTITY TIMELINE (single round trip) ----------
+def _timeline_sql(key, with_range, with_location):
+    """Build the statement that resolves the entity and pulls all its events at once.
+
+    The target profile is resolved in a CTE and every source is joined to it
+    through one LATERAL UNION ALL, so a found entity always yields at least one
+    row (with NULL event columns if it has no events) and an unknown one none.
+    """
+    branches = []
+    for table, spec in TIMELINE_SOURCES.items():
+        id_field, target_expr = spec["match"]
+        time_field = spec["columns"].get("timestamp", spec["columns"].get("start_time"))
+        select = [f"'{table}'::VARCHAR AS source"]
+        for col, col_type in TIMELINE_COLUMNS.items():
+            src = spec["columns"].get(col)
+            select.append(f"s.{src} AS {col}" if src else f"NULL::{col_type} AS {col}")
+        where = [f"s.{id_field} = {target_expr}"]
+        if with_range:
+            where.append(f"s.{time_field} BETWEEN %(start)s AND %(end)s")
+        if with_location and "location_id" in spec["columns"]:
+            where.append("s.location_id = %(location)s")
+        branches.append(f"SELECT {', '.join(select)} FROM {table} s WHERE {' AND '.join(where)}")
+    union = "\n        UNION ALL\n        ".join(branches)
+    return f"""
+    WITH target AS (
+        SELECT entity_id, card_id, device_hash
+        FROM student_or_staff_profiles WHERE {key} = %(value)s LIMIT 1
+    )
+    SELECT t.entity_id AS target_entity_id, t.card_id AS target_card_id,
+           t.device_hash AS target_device_hash, e.*
+    FROM target t
+    LEFT JOIN LATERAL (
+        {union}
+    ) e ON TRUE
+    ORDER BY COALESCE(e.timestamp, e.start_time)
+    """
+
+def fetch_entity_timeline(cur, identifier, start=None, end=None, location=None):
+    """Resolve an entity and fetch its events from every source in one statement.
+
+    The identifier is resolved through the identity index, so unknown entities
+    never reach the database and the statement looks the target up by primary key.
+
+    Returns (profile dict, events DataFrame with `source` plus the normalised
+    TIMELINE_COLUMNS, ordered by event time on the server) or (None, None) if
+    the identifier does not resolve.
+    """
+    profile = resolve_entity(cur, identifier)
+    if not profile:
+        return None, None
+    with_range = bool(start and end)
+    cur.execute(
+        _timeline_sql("entity_id", with_range, bool(location)),
+        {"value": profile["entity_id"], "start": start, "end": end, "location": location}
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None, None
+    return profile, timeline_events([desc[0] for desc in cur.description], rows)
+
+def timeline_events(cols, rows):
+    """Events DataFrame from the rows of _timeline_sql (target_* columns dropped)."""
+    n_target = sum(1 for c in cols if c.startswith("target_"))
+    # An entity without events comes back as a single row of NULL event columns
+    event_rows = [r[n_target:] for r in rows] if rows[0][n_target] is not None else []
+    return pd.DataFrame(event_rows, columns=cols[n_target:])
+
+def split_timeline_sources(events):
+    """Split normalised timeline rows back into per-table DataFrames with the tables' own columns."""
+    data_dict = {}
+    sources = events["source"].to_numpy()
+    for table, spec in TIMELINE_SOURCES.items():
+        mask = sources == table
+        if mask.any():
+            columns = spec["columns"]
+            data_dict[table] = pd.DataFrame(
+                {col: events[norm].to_numpy()[mask] for norm, col in columns.items()}
+            )
+    return data_dict
+
 # ---------- SAVE IMAGES ----------
 def save_images(entity_id, entity_dir=None, save_to_disk=True):
     """Fetch images and optionally save to disk.
@@ -194,7 +328,89 @@ def save_images(entity_id, entity_dir=None, save_to_disk=True):
             release_images(conn_img)
 
 # ---------- BUILD TIMELINE ----------
-def build_timeline(entity_dir, entity_id, conn_main, save_to_disk=True, data_dict=None):
+TIMELINE_SCHEMA = [
+    "source", "event_id", "entity_id", "face_id", "card_id",
+    "device_hash", "location_id", "room_id", "ap_id", "book_id",
+    "category", "text", "start_time", "end_time", "timestamp",
+    "name", "summary"
+]
+
+# Per source: normalised columns copied into the timeline record and the
+# profile field its name is looked up by
+TIMELINE_RECORDS = {
+    "lab_bookings": (["event_id", "entity_id", "room_id", "start_time", "end_time"], "entity_id"),
+    "wifi_associations_logs": (["device_hash", "ap_id", "timestamp"], "device_hash"),
+    "library_checkouts": (["event_id", "entity_id", "book_id", "timestamp"], "entity_id"),
+    "free_text_notes": (["event_id", "entity_id", "category", "text", "timestamp"], "entity_id"),
+    "cctv_frames": (["event_id", "face_id", "location_id", "timestamp"], "face_id"),
+    "campus_card_swipes": (["card_id", "location_id", "timestamp"], "card_id"),
+}
+
+def _as_text(series):
+    """Element-wise str(), matching how the summaries render values in an f-string."""
+    return series.astype(object).map(str)
+
+def _summaries(table, c):
+    """Build the summary column for one source from a dict of text columns."""
+    if table == "lab_bookings":
+        return "🧑‍🔬 " + c["name"] + " booked Room " + c["room_id"] + " from " + c["start_time"] + " to " + c["end_time"]
+    if table == "wifi_associations_logs":
+        return c["name"] + " connected to WiFi AP " + c["ap_id"] + " at " + c["timestamp"]
+    if table == "library_checkouts":
+        return c["name"] + " checked out Book " + c["book_id"] + " at " + c["timestamp"]
+    if table == "free_text_notes":
+        return "Note for " + c["name"] + ": " + c["category"] + ' - "' + c["text"] + '"'
+    if table == "cctv_frames":
+        return "🎥 " + c["name"] + " seen in CCTV at " + c["location_id"] + " on " + c["timestamp"]
+    return ("Card " + c["card_id"] + " (used by " + c["name"] + ") swiped at "
+            + c["location_id"] + " on " + c["timestamp"])
+
+def normalize_timeline_sources(table_data):
+    """Inverse of split_timeline_sources: per-table DataFrames -> normalised timeline rows."""
+    frames = []
+    for table, df in table_data.items():
+        if table not in TIMELINE_SOURCES or df.empty:
+            continue
+        columns = TIMELINE_SOURCES[table]["columns"]
+        frame = pd.DataFrame({norm: df[col].values for norm, col in columns.items() if col in df.columns})
+        frame.insert(0, "source", table)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["source", *TIMELINE_COLUMNS])
+    return pd.concat(frames, ignore_index=True).reindex(columns=["source", *TIMELINE_COLUMNS])
+
+def timeline_frame(events, index):
+    """Timeline rows (TIMELINE_SCHEMA + timeline_timestamp) for normalised events, sorted by time.
+
+    Names are taken from the identity index. Returns None if no event belongs to a known source.
+    """
+    sources = events["source"].to_numpy()
+    parts = []
+    for table in pd.unique(sources):
+        if table not in TIMELINE_RECORDS:
+            continue
+        columns, name_field = TIMELINE_RECORDS[table]
+        df = events.loc[sources == table]
+        part = df[["source", *columns]].copy()
+        if table == "lab_bookings":
+            part["timestamp"] = df["start_time"]
+        name = df[name_field].map(index.names(name_field))
+        part["name"] = name.astype(object).where(name.notna(), None)
+        text = {col: _as_text(part[col]) for col in [*columns, "name"]}
+        part["summary"] = _summaries(table, text)
+        parts.append(part)
+
+    if not parts:
+        return None
+    timeline_df = pd.concat(parts, ignore_index=True).reindex(columns=TIMELINE_SCHEMA)
+    timeline_df["timeline_timestamp"] = pd.to_datetime(
+        timeline_df["timestamp"].fillna(timeline_df["start_time"]),
+        errors="coerce"
+    )
+    timeline_df = timeline_df.sort_values("timeline_timestamp", kind="stable")
+    return timeline_df
+
+def build_timeline(entity_dir, entity_id, conn_main, save_to_disk=True, data_dict=None, events=None):
     """Build timeline from entity data.
     
     Args:
@@ -203,232 +419,84 @@ def build_timeline(entity_dir, entity_id, conn_main, save_to_disk=True, data_dic
         conn_main: database connection
         save_to_disk: whether to save timeline to disk
         data_dict: dict mapping table names to dataframes (used when save_to_disk=False)
+        events: normalised timeline rows from fetch_entity_timeline (preferred over data_dict)
     """
-    timeline_records = []
-
-    schema = [
-        "source", "event_id", "entity_id", "face_id", "card_id",
-        "device_hash", "location_id", "room_id", "ap_id", "book_id",
-        "category", "text", "start_time", "end_time", "timestamp",
-        "name", "summary"
-    ]
-
-    cur = conn_main.cursor()
-    try:
-        cur.execute("SELECT entity_id, card_id, device_hash, face_id, name FROM student_or_staff_profiles")
-        all_profiles = cur.fetchall()
-        cols = [desc[0] for desc in cur.description]
-        profiles_df = pd.DataFrame(all_profiles, columns=cols)
-    finally:
-        cur.close()
-
-    def get_names_by_field(field, value):
-        if value is None: return None
-        matches = profiles_df.loc[profiles_df[field] == value, "name"].unique()
-        return ", ".join(matches) if len(matches) > 0 else None
-
-    # Get data from either CSV files or passed data_dict
-    table_data = {}
-    if save_to_disk and entity_dir:
-        csv_files = glob.glob(os.path.join(entity_dir, "*.csv"))
-        for file in csv_files:
-            table = os.path.splitext(os.path.basename(file))[0]
-            table_data[table] = pd.read_csv(file)
-    elif data_dict:
-        table_data = data_dict
-    else:
-        # No data available
+    # Get data from the normalised events, CSV files or passed data_dict
+    if events is None:
+        table_data = {}
+        if save_to_disk and entity_dir:
+            csv_files = glob.glob(os.path.join(entity_dir, "*.csv"))
+            for file in csv_files:
+                table = os.path.splitext(os.path.basename(file))[0]
+                table_data[table] = pd.read_csv(file)
+        elif data_dict:
+            table_data = data_dict
+        events = normalize_timeline_sources(table_data)
+    if events.empty:
         return []
 
-    for table, df in table_data.items():
-        if df.empty:
-            continue
-
-        if table == "lab_bookings":
-            for _, row in df.iterrows():
-                name = get_names_by_field("entity_id", row.get("entity_id"))
-                timeline_records.append({
-                    "source": table,
-                    "event_id": row.get("booking_id"),
-                    "entity_id": row.get("entity_id"),
-                    "room_id": row.get("room_id"),
-                    "start_time": row.get("start_time"),
-                    "end_time": row.get("end_time"),
-                    "timestamp": row.get("start_time"),
-                    "name": name,
-                    "summary": f"🧑‍🔬 {name} booked Room {row.get('room_id')} from {row.get('start_time')} to {row.get('end_time')}"
-                })
-
-        elif table == "wifi_associations_logs":
-            for _, row in df.iterrows():
-                name = get_names_by_field("device_hash", row.get("device_hash"))
-                timeline_records.append({
-                    "source": table,
-                    "device_hash": row.get("device_hash"),
-                    "ap_id": row.get("ap_id"),
-                    "timestamp": row.get("timestamp"),
-                    "name": name,
-                    "summary": f"{name} connected to WiFi AP {row.get('ap_id')} at {row.get('timestamp')}"
-                })
-
-        elif table == "library_checkouts":
-            for _, row in df.iterrows():
-                name = get_names_by_field("entity_id", row.get("entity_id"))
-                timeline_records.append({
-                    "source": table,
-                    "event_id": row.get("checkout_id"),
-                    "entity_id": row.get("entity_id"),
-                    "book_id": row.get("book_id"),
-                    "timestamp": row.get("timestamp"),
-                    "name": name,
-                    "summary": f"{name} checked out Book {row.get('book_id')} at {row.get('timestamp')}"
-                })
-
-        elif table == "free_text_notes":
-            for _, row in df.iterrows():
-                name = get_names_by_field("entity_id", row.get("entity_id"))
-                timeline_records.append({
-                    "source": table,
-                    "event_id": row.get("note_id"),
-                    "entity_id": row.get("entity_id"),
-                    "category": row.get("category"),
-                    "text": row.get("text"),
-                    "timestamp": row.get("timestamp"),
-                    "name": name,
-                    "summary": f"Note for {name}: {row.get('category')} - \"{row.get('text')}\""
-                })
-
-        elif table == "cctv_frames":
-            for _, row in df.iterrows():
-                name = get_names_by_field("face_id", row.get("face_id"))
-                timeline_records.append({
-                    "source": table,
-                    "event_id": row.get("frame_id"),
-                    "face_id": row.get("face_id"),
-                    "location_id": row.get("location_id"),
-                    "timestamp": row.get("timestamp"),
-                    "name": name,
-                    "summary": f"🎥 {name} seen in CCTV at {row.get('location_id')} on {row.get('timestamp')}"
-                })
-
-        elif table == "campus_card_swipes":
-            for _, row in df.iterrows():
-                names = get_names_by_field("card_id", row.get("card_id"))
-                timeline_records.append({
-                    "source": table,
-                    "card_id": row.get("card_id"),
-                    "location_id": row.get("location_id"),
-                    "timestamp": row.get("timestamp"),
-                    "name": names,
-                    "summary": f"Card {row.get('card_id')} (used by {names}) swiped at {row.get('location_id')} on {row.get('timestamp')}"
-                })
-    
-
-    timeline_df = pd.DataFrame(timeline_records, columns=schema)
-    timeline_df["timeline_timestamp"] = pd.to_datetime(
-        timeline_df["timestamp"].fillna(timeline_df["start_time"]),
-        errors="coerce"
-    )
-    timeline_df = timeline_df.sort_values("timeline_timestamp")
+    timeline_df = timeline_frame(events, identity_index.get_index(conn_main))
+    if timeline_df is None:
+        return []
     
     if save_to_disk and entity_dir:
         out_path = os.path.join(entity_dir, f"entity_{entity_id}_timeline.csv")
         timeline_df.to_csv(out_path, index=False)
         print(f"Timeline saved: {out_path}")
     
-    # timeline_df is your DataFrame
-    timeline_df = timeline_df.replace({np.nan: None, np.inf: None, -np.inf: None})
+    return timeline_records(timeline_df)
 
-    # Convert to list of dicts for JSON
-    timeline_list = timeline_df.to_dict(orient="records")
-    return timeline_list
+def timeline_records(timeline_df):
+    """JSON-ready list of dicts for a timeline frame (NaN/inf -> None)."""
+    timeline_df = timeline_df.replace({np.nan: None, np.inf: None, -np.inf: None})
+    return timeline_df.to_dict(orient="records")
 
 
 #---alerts---
 
-def check_inactive_entities():
-    """Check for entities with no activity in the last 12 hours using efficient SQL."""
+# Default inactivity threshold of /alerts/inactive
+INACTIVE_HOURS = float(os.getenv("INACTIVE_HOURS", "12"))
+
+# Entities with no activity since the given time, read from entity_last_activity (kept current by
+# triggers on the event tables, see create_tables.sql): an index range scan instead of a pass
+# over the whole event history
+INACTIVE_ENTITIES_SQL = """
+SELECT
+    p.entity_id,
+    p.card_id,
+    p.role,
+    p.department,
+    p.name,
+    ela.last_activity
+FROM entity_last_activity ela
+JOIN student_or_staff_profiles p ON p.entity_id = ela.entity_id
+WHERE ela.last_activity IS NULL OR ela.last_activity < %(since)s
+ORDER BY ela.last_activity NULLS LAST, ela.entity_id
+"""
+
+def inactive_entity_records(cols, rows):
+    """Rows of INACTIVE_ENTITIES_SQL as dicts with last_activity formatted for JSON."""
+    inactive_entities = []
+    for row in rows:
+        entity_dict = dict(zip(cols, row))
+        if entity_dict['last_activity']:
+            entity_dict['last_activity'] = entity_dict['last_activity'].strftime("%Y-%m-%d %H:%M:%S")
+        inactive_entities.append(entity_dict)
+    return inactive_entities
+
+def check_inactive_entities(hours=INACTIVE_HOURS):
+    """Check for entities with no activity in the last `hours` hours using efficient SQL."""
     conn = None
     try:
         conn = connect_main()
         cur = conn.cursor()
         
-        twelve_hours_ago = datetime.now() - timedelta(hours=12)
+        since = datetime.now() - timedelta(hours=hours)
         
-        # Build a single SQL query using UNION ALL to aggregate all events in one pass
-        # This allows Postgres to use indexes and parallel execution efficiently
-        sql = """
-        WITH all_events AS (
-            -- WiFi associations
-            SELECT p.entity_id, w.timestamp
-            FROM wifi_associations_logs w
-            JOIN student_or_staff_profiles p ON w.device_hash = p.device_hash
-            WHERE p.device_hash IS NOT NULL
-            
-            UNION ALL
-            
-            -- Library checkouts
-            SELECT entity_id, timestamp
-            FROM library_checkouts
-            
-            UNION ALL
-            
-            -- Lab bookings
-            SELECT entity_id, start_time AS timestamp
-            FROM lab_bookings
-            
-            UNION ALL
-            
-            -- Free text notes
-            SELECT entity_id, timestamp
-            FROM free_text_notes
-            
-            UNION ALL
-            
-            -- CCTV frames
-            SELECT p.entity_id, c.timestamp
-            FROM cctv_frames c
-            JOIN student_or_staff_profiles p ON c.face_id = p.face_id
-            WHERE p.face_id IS NOT NULL
-            
-            UNION ALL
-            
-            -- Campus card swipes
-            SELECT p.entity_id, s.timestamp
-            FROM campus_card_swipes s
-            JOIN student_or_staff_profiles p ON s.card_id = p.card_id
-            WHERE p.card_id IS NOT NULL
-        ),
-        entity_last_activity AS (
-            SELECT 
-                entity_id,
-                MAX(timestamp) AS last_activity
-            FROM all_events
-            GROUP BY entity_id
-        )
-        SELECT 
-            p.entity_id,
-            p.card_id,
-            p.role,
-            p.department,
-            p.name,
-            COALESCE(ela.last_activity, NULL) AS last_activity
-        FROM student_or_staff_profiles p
-        LEFT JOIN entity_last_activity ela ON p.entity_id = ela.entity_id
-        WHERE ela.last_activity IS NULL OR ela.last_activity < %s
-        ORDER BY ela.last_activity NULLS LAST
-        """
-        
-        cur.execute(sql, (twelve_hours_ago,))
+        cur.execute(INACTIVE_ENTITIES_SQL, {"since": since})
         rows = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
-        
-        inactive_entities = []
-        for row in rows:
-            entity_dict = dict(zip(cols, row))
-            if entity_dict['last_activity']:
-                entity_dict['last_activity'] = entity_dict['last_activity'].strftime("%Y-%m-%d %H:%M:%S")
-            inactive_entities.append(entity_dict)
+        inactive_entities = inactive_entity_records(cols, rows)
         
         cur.close()
         return inactive_entities
@@ -436,6 +504,55 @@ def check_inactive_entities():
         if conn:
             release_main(conn)
 
+# Default look-back (hours) of /alerts/anomalous
+ANOMALOUS_HOURS = float(os.getenv("ANOMALOUS_HOURS", "24"))
+
+# Observations the location model found unlikely (see deviation_scores.py), least likely first
+ANOMALOUS_OBSERVATIONS_SQL = """
+SELECT
+    d.entity_id,
+    p.name,
+    p.role,
+    p.department,
+    d.time_window,
+    d.location_id,
+    d.event_count,
+    d.last_seen,
+    d.probability,
+    d.method,
+    d.model_version
+FROM deviation_scores d
+LEFT JOIN student_or_staff_profiles p ON p.entity_id = d.entity_id
+WHERE d.time_window >= %(since)s AND d.probability < %(threshold)s
+ORDER BY d.probability, d.time_window DESC, d.entity_id, d.location_id
+LIMIT %(limit)s
+"""
+
+def anomalous_observation_records(cols, rows):
+    """Rows of ANOMALOUS_OBSERVATIONS_SQL as dicts with times formatted for JSON."""
+    records = []
+    for row in rows:
+        record = dict(zip(cols, row))
+        for key in ('time_window', 'last_seen'):
+            record[key] = record[key].strftime("%Y-%m-%d %H:%M:%S")
+        records.append(record)
+    return records
+
+def check_anomalous_observations(hours=ANOMALOUS_HOURS, threshold=DEVIATION_THRESHOLD, limit=500):
+    """Observations of the last `hours` hours with a deviation score below threshold."""
+    conn = None
+    try:
+        conn = connect_main()
+        cur = conn.cursor()
+        since = datetime.now() - timedelta(hours=hours)
+        cur.execute(ANOMALOUS_OBSERVATIONS_SQL, {"since": since, "threshold": threshold, "limit": limit})
+        records = anomalous_observation_records([desc[0] for desc in cur.description], cur.fetchall())
+        cur.close()
+        return records
+    finally:
+        if conn:
+            release_main(conn)
+
 # ---------- MAIN QUERY FUNCTION ----------
 
 def entity_details(user_input):
@@ -470,49 +587,30 @@ def query_entity(user_input, save_to_disk=False):
         conn_main = connect_main()
         cur_main = conn_main.cursor()
 
-        resolved = resolve_entity(cur_main, user_input["identifier"])
+        start_time = normalize_time_input(user_input["start_time"], True) if user_input["start_time"] else None
+        end_time   = normalize_time_input(user_input["end_time"], False) if user_input["end_time"] else None
+
+        resolved, events = fetch_entity_timeline(
+            cur_main, user_input["identifier"], start_time, end_time, user_input["location"]
+        )
         if not resolved:
             print("Entity not found :(")
             return None
         entity_id = resolved["entity_id"]
         print(f"Resolved to entity_id: {entity_id}")
 
-        card_id = resolved.get("card_id")
-        device_hash = resolved.get("device_hash")
-
-        start_time = normalize_time_input(user_input["start_time"], True) if user_input["start_time"] else None
-        end_time   = normalize_time_input(user_input["end_time"], False) if user_input["end_time"] else None
-
         entity_dir = None
         if save_to_disk:
             entity_dir = os.path.join(OUTPUT_DIR, f"entity_{entity_id}")
             os.makedirs(entity_dir, exist_ok=True)
 
-        # Collect data in-memory
-        data_dict = {}
-        for table, (id_field, time_field) in TABLES.items():
-            if id_field == "entity_id":
-                id_value = entity_id
-            elif id_field == "card_id":
-                if not card_id: continue
-                id_value = card_id
-            elif id_field == "device_hash":
-                if not device_hash: continue
-                id_value = device_hash
-            elif id_field == "face_id":
-                id_value = "F" + entity_id[1:]
-            else:
-                continue
-
-            df = query_table(cur_main, table, id_field, id_value, time_field, start_time, end_time, user_input["location"])
-            if not df.empty:
-                data_dict[table] = df
-                if save_to_disk and entity_dir:
-                    df.to_csv(os.path.join(entity_dir, f"{table}.csv"), index=False)
-                    print(f"Saved {len(df)} rows from {table}")
+        if save_to_disk and entity_dir:
+            for table, df in split_timeline_sources(events).items():
+                df.to_csv(os.path.join(entity_dir, f"{table}.csv"), index=False)
+                print(f"Saved {len(df)} rows from {table}")
 
         images = save_images(entity_id, entity_dir, save_to_disk=save_to_disk)
-        timeline_dict = build_timeline(entity_dir, entity_id, conn_main, save_to_disk=save_to_disk, data_dict=data_dict)
+        timeline_dict = build_timeline(entity_dir, entity_id, conn_main, save_to_disk=save_to_disk, events=events)
         #print("Timeline built.", len(timeline_dict), "events found.")
         cur_main.close()
         if save_to_disk:
@@ -0,0 +1,197 @@
+"""
+Async counterparts of get_info's API entry points on asyncpg pools.
+
+The statements, timeline shaping and identity index are shared with get_info;
+only data access differs. The CPU-bound timeline build runs in a worker thread
+so the event loop keeps serving other requests. Face images are not part of the
+API's responses, so the API never connects to the images database.
+"""
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncpg
+from dotenv import load_dotenv
+import identity_index
+from db_pool import Histogram, MS_BUCKETS
+from identity_index import IDENTIFIER_FIELDS
+from get_info import (
+    ANOMALOUS_HOURS, ANOMALOUS_OBSERVATIONS_SQL, DEVIATION_THRESHOLD, INACTIVE_ENTITIES_SQL, INACTIVE_HOURS,
+    _timeline_sql, anomalous_observation_records, inactive_entity_records, normalize_time_input,
+    timeline_events, timeline_frame, timeline_records,
+)
+
+load_dotenv()
+
+# ---------- DATABASE CONFIG ----------
+DB_MAIN = {
+    "database": os.getenv("DB_MAIN_NAME"),
+    "user": os.getenv("DB_MAIN_USER"),
+    "password": os.getenv("DB_MAIN_PASSWORD"),
+    "host": os.getenv("DB_MAIN_HOST"),
+    "port": os.getenv("DB_MAIN_PORT"),
+}
+
+# (min, max) connections; requests beyond max wait for a free connection
+MAIN_POOL_SIZE = (2, int(os.getenv("ASYNC_MAIN_POOL_MAX", "20")))
+
+# ---------- CONNECTION POOLS ----------
+_main_pool = None
+_pools_lock = asyncio.Lock()
+
+async def init_pools():
+    """Create the pool (idempotent); called at API startup and on first use."""
+    global _main_pool
+    async with _pools_lock:
+        if _main_pool is None:
+            _main_pool = await asyncpg.create_pool(
+                min_size=MAIN_POOL_SIZE[0], max_size=MAIN_POOL_SIZE[1], **DB_MAIN
+            )
+
+async def close_pools():
+    global _main_pool
+    async with _pools_lock:
+        if _main_pool is not None:
+            await _main_pool.close()
+        _main_pool = None
+
+# name -> (acquire wait, checkout duration) histograms in ms
+_histograms = {"main": (Histogram(MS_BUCKETS), Histogram(MS_BUCKETS))}
+
+@asynccontextmanager
+async def acquire(name):
+    """Check out a connection of the "main" pool, recording wait and checkout time."""
+    pool = await main_pool()
+    wait_ms, checkout_ms = _histograms[name]
+    start = time.monotonic()
+    async with pool.acquire() as conn:
+        acquired = time.monotonic()
+        wait_ms.observe((acquired - start) * 1000)
+        try:
+            yield conn
+        finally:
+            checkout_ms.observe((time.monotonic() - acquired) * 1000)
+
+def pool_metrics():
+    """Size and timing metrics of the pool, or {} if it is not created yet."""
+    metrics = {}
+    for name, pool in (("main", _main_pool),):
+        if pool is None:
+            continue
+        wait_ms, checkout_ms = _histograms[name]
+        metrics[name] = {
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "open": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "in_use": pool.get_size() - pool.get_idle_size(),
+            "wait_ms": wait_ms.snapshot(),
+            "checkout_ms": checkout_ms.snapshot(),
+        }
+    return metrics
+
+async def main_pool():
+    if _main_pool is None:
+        await init_pools()
+    return _main_pool
+
+_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+
+def to_asyncpg(sql, params):
+    """Rewrite a pyformat statement (%(name)s) to asyncpg's $n placeholders.
+
+    Returns (statement, positional args); params not used by the statement are dropped.
+    """
+    names = []
+    def placeholder(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+    return _NAMED_PARAM.sub(placeholder, sql), [params[name] for name in names]
+
+# ---------- RESOLVE ENTITY ----------
+async def resolve_entity(identifier):
+    key, value = list(identifier.items())[0]
+    print(f"Resolving entity by {key} = {value} ...")
+    if key not in IDENTIFIER_FIELDS:
+        return None
+    return await identity_index.resolve_async(await main_pool(), key, value)
+
+async def entity_ids_for(identifiers):
+    """Map {identifier field: [values]} to the set of entity_ids they belong to.
+
+    entity_id values are kept even when they have no profile (yet).
+    """
+    index = await identity_index.get_index_async(await main_pool())
+    entity_ids = set(identifiers.get("entity_id", []))
+    for field, values in identifiers.items():
+        for value in values:
+            entity_id = index.entity_id(field, value)
+            if entity_id is not None:
+                entity_ids.add(entity_id)
+    return entity_ids
+
+# ---------- QUERIES ----------
+async def fetch_events(entity_id, start=None, end=None, location=None):
+    """Normalised timeline events of a resolved entity (see get_info.fetch_entity_timeline)."""
+    sql, args = to_asyncpg(
+        _timeline_sql("entity_id", bool(start and end), bool(location)),
+        {"value": entity_id, "start": start, "end": end, "location": location}
+    )
+    async with acquire("main") as conn:
+        records = await conn.fetch(sql, *args)
+    if not records:
+        return None
+    return timeline_events(list(records[0].keys()), [tuple(r) for r in records])
+
+def _build_timeline(events, index):
+    if events.empty:
+        return []
+    timeline_df = timeline_frame(events, index)
+    return timeline_records(timeline_df) if timeline_df is not None else []
+
+# ---------- API ENTRY POINTS ----------
+async def entity_details(user_input):
+    resolved = await resolve_entity(user_input["identifier"])
+    if not resolved:
+        print("Entity not found::")
+        return None
+    return resolved
+
+async def query_entity(user_input):
+    """Async get_info.query_entity (in-memory only, no save_to_disk)."""
+    start_time = normalize_time_input(user_input["start_time"], True) if user_input["start_time"] else None
+    end_time   = normalize_time_input(user_input["end_time"], False) if user_input["end_time"] else None
+
+    resolved = await resolve_entity(user_input["identifier"])
+    if not resolved:
+        print("Entity not found :(")
+        return None
+    entity_id = resolved["entity_id"]
+    print(f"Resolved to entity_id: {entity_id}")
+
+    events = await fetch_events(entity_id, start_time, end_time, user_input["location"])
+    if events is None:
+        return None
+    index = await identity_index.get_index_async(await main_pool())
+    return await asyncio.to_thread(_build_timeline, events, index)
+
+async def check_inactive_entities(hours=INACTIVE_HOURS):
+    """Async get_info.check_inactive_entities."""
+    since = datetime.now() - timedelta(hours=hours)
+    sql, args = to_asyncpg(INACTIVE_ENTITIES_SQL, {"since": since})
+    async with acquire("main") as conn:
+        records = await conn.fetch(sql, *args)
+    cols = list(records[0].keys()) if records else []
+    return inactive_entity_records(cols, [tuple(r) for r in records])
+
+async def check_anomalous_observations(hours=ANOMALOUS_HOURS, threshold=DEVIATION_THRESHOLD, limit=500):
+    """Async get_info.check_anomalous_observations."""
+    since = datetime.now() - timedelta(hours=hours)
+    sql, args = to_asyncpg(ANOMALOUS_OBSERVATIONS_SQL, {"since": since, "threshold": threshold, "limit": limit})
+    async with acquire("main") as conn:
+        records = await conn.fetch(sql, *args)
+    cols = list(records[0].keys()) if records else []
+    return anomalous_observation_records(cols, [tuple(r) for r in records])
@@ -0,0 +1,221 @@
+"""
+In-process identity index over student_or_staff_profiles.
+
+Every identifier column (entity_id, card_id, device_hash, face_id, email, ...)
+gets a dict from value to row position, so resolving an identifier to its
+profile, entity_id or display name is a single dict lookup instead of a query
+or a DataFrame scan.
+
+get_index() (get_index_async() for asyncpg pools) keeps one index per process
+for the API. It is loaded on first use and reloaded when the profiles table
+changes, which is detected by comparing a cheap (row count, max xmin)
+watermark at most every IDENTITY_INDEX_REFRESH_SECONDS. A lookup miss re-checks
+sooner, but still at most every IDENTITY_INDEX_MISS_RECHECK_SECONDS, so probing
+unknown identifiers cannot turn every request into a scan of the table.
+The prediction pipeline builds its own IdentityIndex from the profiles CSV.
+"""
+import asyncio
+import os
+import threading
+import time
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Identifier columns a profile can be looked up by
+IDENTIFIER_FIELDS = ("entity_id", "name", "email", "student_id", "staff_id", "card_id", "device_hash", "face_id")
+
+# Seconds between watermark checks
+REFRESH_SECONDS = float(os.getenv("IDENTITY_INDEX_REFRESH_SECONDS", "5"))
+# Seconds between the earlier re-checks a lookup miss triggers (a profile may just have been loaded)
+MISS_RECHECK_SECONDS = float(os.getenv("IDENTITY_INDEX_MISS_RECHECK_SECONDS", "1"))
+
+# Inserts and deletes change the count, updates bump the newest xmin
+WATERMARK_SQL = "SELECT count(*), COALESCE(max(xmin::text::bigint), 0) FROM student_or_staff_profiles"
+
+
+class IdentityIndex:
+    def __init__(self, profiles: pd.DataFrame, watermark=None):
+        """
+        Args:
+            profiles: student_or_staff_profiles rows (any subset of its columns)
+            watermark: (row count, max xmin) the rows were read at, None if not from the database
+        """
+        profiles = profiles.reset_index(drop=True)
+        profiles = profiles.astype(object).where(profiles.notna(), None)
+        self.watermark = watermark
+        self.columns = list(profiles.columns)
+        self._rows = list(profiles.itertuples(index=False, name=None))
+        self._entity_col = self.columns.index("entity_id") if "entity_id" in self.columns else None
+
+        # field -> {value: row position}; on duplicate values the last row wins
+        self._positions = {}
+        for field in IDENTIFIER_FIELDS:
+            if field in profiles.columns:
+                values = profiles[field]
+                valid = values.notna().to_numpy()
+                self._positions[field] = dict(zip(values[valid], valid.nonzero()[0].tolist()))
+
+        # field -> {value: entity_id}, built on first use by entity_ids()
+        self._entity_ids = {}
+
+        # field -> {value: "name, name"} for every name sharing that value
+        self._names = {}
+        if "name" in profiles.columns:
+            named = profiles[profiles["name"].notna()]
+            for field in self._positions:
+                matches = named[named[field].notna()]
+                self._names[field] = (
+                    matches.groupby(field, sort=False)["name"].agg(lambda s: ", ".join(pd.unique(s))).to_dict()
+                )
+
+    def __len__(self):
+        return len(self._rows)
+
+    def lookup(self, field, value):
+        """Profile dict for the row whose `field` equals value, or None."""
+        pos = self._positions.get(field, {}).get(value)
+        if pos is None:
+            return None
+        return dict(zip(self.columns, self._rows[pos]))
+
+    def entity_id(self, field, value):
+        """entity_id of the profile whose `field` equals value, or None."""
+        pos = self._positions.get(field, {}).get(value)
+        if pos is None or self._entity_col is None:
+            return None
+        return self._rows[pos][self._entity_col]
+
+    def entity_ids(self, field):
+        """{value: entity_id} for `field`, for use with Series.map."""
+        if field not in self._entity_ids:
+            positions = self._positions.get(field, {})
+            if self._entity_col is None:
+                self._entity_ids[field] = {}
+            else:
+                self._entity_ids[field] = {v: self._rows[p][self._entity_col] for v, p in positions.items()}
+        return self._entity_ids[field]
+
+    def names(self, field):
+        """{value: comma-joined names} for `field`, for use with Series.map."""
+        return self._names.get(field, {})
+
+
+# ---------- PROCESS-WIDE INDEX ----------
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+# First load of get_index_async, claimed by one request; the others await it
+_first_load = None
+
+
+def profiles_watermark(cur):
+    cur.execute(WATERMARK_SQL)
+    return tuple(cur.fetchone())
+
+
+def load_index(cur):
+    """Read the profiles table into a new IdentityIndex."""
+    # Watermark first: a change made while the rows are read shows up at the next check
+    watermark = profiles_watermark(cur)
+    cur.execute("SELECT * FROM student_or_staff_profiles")
+    cols = [desc[0] for desc in cur.description]
+    return IdentityIndex(pd.DataFrame(cur.fetchall(), columns=cols), watermark)
+
+
+def _install(index, checked_at):
+    global _index, _checked_at
+    if index is not _index:
+        _index = index
+        print(f"Identity index loaded: {len(index)} profiles")
+    _checked_at = checked_at
+
+
+def get_index(conn, max_age=REFRESH_SECONDS):
+    """The process-wide index, reloaded if the profiles changed since the last check.
+
+    The watermark is only queried when the last check is older than max_age seconds.
+    """
+    with _lock:
+        now = time.monotonic()
+        if _index is not None and now - _checked_at < max_age:
+            return _index
+        cur = conn.cursor()
+        try:
+            index = _index
+            if index is None or profiles_watermark(cur) != index.watermark:
+                index = load_index(cur)
+            _install(index, now)
+        finally:
+            cur.close()
+        return _index
+
+
+async def get_index_async(pool, max_age=REFRESH_SECONDS):
+    """get_index() for an asyncpg pool.
+
+    The lock is not held across awaits: the first request past max_age claims
+    the check and the others keep using the current index in the meantime.
+    While there is no index yet, the first request claims the load and the
+    others wait for it instead of each reading the whole table.
+    """
+    global _checked_at, _first_load
+    claimed = None
+    with _lock:
+        now = time.monotonic()
+        index = _index
+        if index is not None and now - _checked_at < max_age:
+            return index
+        if index is not None:
+            _checked_at = now
+        elif _first_load is not None:
+            pending = _first_load
+        else:
+            pending = None
+            _first_load = claimed = asyncio.get_running_loop().create_future()
+    if index is None and claimed is None:
+        return await asyncio.shield(pending)
+    try:
+        async with pool.acquire() as conn:
+            watermark = tuple(await conn.fetchrow(WATERMARK_SQL))
+            if index is None or watermark != index.watermark:
+                records = await conn.fetch("SELECT * FROM student_or_staff_profiles")
+                cols = list(records[0].keys()) if records else []
+                index = IdentityIndex(pd.DataFrame([tuple(r) for r in records], columns=cols), watermark)
+    except BaseException as e:
+        if claimed is not None:
+            with _lock:
+                _first_load = None
+            claimed.set_exception(e)
+            claimed.exception()  # retrieved here; waiters get it raised
+        raise
+    with _lock:
+        _install(index, now)
+        if claimed is not None:
+            _first_load = None
+            claimed.set_result(_index)
+        return _index
+
+
+def invalidate():
+    """Drop the process-wide index; the next get_index() reloads it."""
+    global _index
+    with _lock:
+        _index = None
+
+
+def resolve(conn, field, value):
+    """Profile dict for field=value; a miss re-checks the watermark if the last check is MISS_RECHECK_SECONDS old."""
+    profile = get_index(conn).lookup(field, value)
+    if profile is None:
+        profile = get_index(conn, max_age=MISS_RECHECK_SECONDS).lookup(field, value)
+    return profile
+
+
+async def resolve_async(pool, field, value):
+    """resolve() for an asyncpg pool."""
+    profile = (await get_index_async(pool)).lookup(field, value)
+    if profile is None:
+        profile = (await get_index_async(pool, max_age=MISS_RECHECK_SECONDS)).lookup(field, value)
+    return profile
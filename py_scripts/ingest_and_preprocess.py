@@ -1,9 +1,11 @@
 import os
 import shutil
+import time
 import pandas as pd
 from datetime import datetime
 from glob import glob
 from dotenv import load_dotenv
+from ingest_utils import CHUNK_SIZE, report_file_stats
 
 load_dotenv()
 
@@ -37,14 +39,24 @@ def preprocess_file(file_path, file_name):
     df = preprocess_datetime(df, dt_cols)
     return df
 
-def main():
+def iter_preprocessed_chunks(file_path, file_name, chunk_size=CHUNK_SIZE):
+    """Stream a CSV in chunks of chunk_size rows with timestamps normalised."""
+    dt_cols = DATETIME_COLUMNS.get(file_name, [])
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        yield preprocess_datetime(chunk, dt_cols)
+
+def main(chunk_size=CHUNK_SIZE):
     for file_name in os.listdir(DATA_UPLOAD_DIR):
         file_path = os.path.join(DATA_UPLOAD_DIR, file_name)
         if os.path.isfile(file_path) and file_name.endswith('.csv'):
             print(f'Processing {file_name}...')
-            df = preprocess_file(file_path, file_name)
+            start = time.perf_counter()
+            rows = 0
             processed_path = os.path.join(DATA_PROCESSED_DIR, file_name)
-            df.to_csv(processed_path, index=False)
+            for i, chunk in enumerate(iter_preprocessed_chunks(file_path, file_name, chunk_size)):
+                chunk.to_csv(processed_path, index=False, mode='w' if i == 0 else 'a', header=(i == 0))
+                rows += len(chunk)
+            report_file_stats('preprocess', file_name, rows, time.perf_counter() - start)
             os.remove(file_path)
     print('Preprocessing complete. Processed files saved to data/.')
 
@@ -0,0 +1,36 @@
+import os
+import sys
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+load_dotenv()
+
+# Rows per chunk when streaming CSVs; pipeline.py passes --chunk-size through this variable
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "100000"))
+
+# Tables loaded concurrently by db_insert; pipeline.py passes --max-workers through this variable
+MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "4"))
+
+# Only load files/rows not seen before (see ingest_manifest); pipeline.py --incremental sets this
+INCREMENTAL = os.getenv("INGEST_INCREMENTAL", "0") == "1"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def report_file_stats(stage, file_name, rows, elapsed):
+    """Print rows/sec and peak RSS for one file of a pipeline stage."""
+    rate = rows / elapsed if elapsed > 0 else float("inf")
+    peak = peak_rss_mb()
+    peak_str = f"{peak:.0f} MB" if peak is not None else "n/a"
+    print(f"[{stage}] {file_name}: {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec), peak RSS {peak_str}")
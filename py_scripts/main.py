@@ -1,31 +1,111 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from get_info import query_entity, entity_details, check_inactive_entities, clear_output_folder
-from prediction_pipeline import CampusLocationPredictor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from get_info_async import (
+    query_entity, entity_details, check_inactive_entities, check_anomalous_observations, entity_ids_for,
+)
+import get_info
+import get_info_async
+import asyncio
+from prediction_pipeline import CampusLocationPredictor, DRIFT_THRESHOLD
+import model_store
+from training_jobs import TrainingJobs
+from response_cache import ResponseCache, INVALIDATE_TOKEN
+from alert_engine import AlertEngine
 import pandas as pd
 import uvicorn
 import numpy as np
 from fastapi.encoders import jsonable_encoder
 import threading
 import base64
+import hmac
+from datetime import datetime
+from typing import Literal
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve the last saved model, then open the pools before the first request; close them on shutdown
+    await asyncio.to_thread(load_latest_model)
+    await get_info_async.init_pools()
+    await alert_engine.start()
+    yield
+    await alert_engine.stop()
+    training.shutdown()
+    await get_info_async.close_pools()
 
-# Initialize global predictor with thread safety
+app = FastAPI(lifespan=lifespan)
+
+# Initialize global predictor with thread safety; the lock only guards swapping in a new model
 predictor = None
 predictor_lock = threading.Lock()
 
+def swap_in_trained_model(job):
+    """Called by training_jobs when a worker saved its model: load it, swap it in, publish it."""
+    global predictor
+    model = model_store.load_model(job.version)
+    with predictor_lock:
+        predictor = model
+    model_store.publish_version(job.version)
+    print(f"Now serving model version {job.version}")
+
+# /train jobs, each trained in a worker process
+training = TrainingJobs(model_store.MODEL_DIR, on_done=swap_in_trained_model)
+
+def load_latest_model():
+    """Load the latest saved model version, if any (at startup, so restarts keep the model)."""
+    global predictor
+    started = datetime.now()
+    try:
+        model = model_store.load_model()
+    except FileNotFoundError:
+        print("No saved model yet; call /train")
+        return
+    except Exception as e:
+        print(f"Could not load saved model: {e}")
+        return
+    with predictor_lock:
+        predictor = model
+    print(f"Loaded model version {model.model_version} in {(datetime.now() - started).total_seconds():.2f}s")
+
+# Inactivity transitions pushed to /alerts/stream clients (fed by the ingest triggers' notifications)
+alert_engine = AlertEngine(get_info_async.DB_MAIN)
+
+# Seconds between keep-alive comments on an idle /alerts/stream
+ALERT_HEARTBEAT_SECONDS = 15
+
+# /run-query and /details responses, dropped per entity when ingest loads new data for it
+response_cache = ResponseCache()
+
 class TrainRequest(BaseModel):
     data_dir: str = "data"
     time_window_hours: int = 2
     n_clusters: int | None = None
     decay_half_life_hours: float = 2.0
     nearby_window_radius: int = 2
+    # Scalable clustering (see CampusLocationPredictor.build_feature_matrix_and_cluster)
+    features: Literal["dense", "onehot"] = "dense"
+    svd_components: int | None = Field(None, ge=1)
+    clusterer: Literal["kmeans", "minibatch"] = "kmeans"
+    batch_size: int = Field(4096, ge=1)
+    # Train from the CSVs in data_dir or straight from the Postgres tables, optionally within [start_time, end_time)
+    source: Literal["csv", "db"] = "csv"
+    start_time: str | None = None
+    end_time: str | None = None
+
+class UpdateRequest(BaseModel):
+    source: Literal["csv", "db"] = "csv"
+    data_dir: str | None = None    # csv: directory with the newly ingested event CSVs
+    recluster: bool = False        # re-cluster all entities regardless of drift
+    drift_threshold: float = Field(DRIFT_THRESHOLD, ge=0)
 
 class PredictRequest(BaseModel):
     entity_id: str
     timestamp: str
 
+class PredictBatchRequest(BaseModel):
+    predictions: list[PredictRequest]
+
 class QueryInput(BaseModel):
     identifier_type: str
     identifier_value: str
@@ -33,6 +113,10 @@ class QueryInput(BaseModel):
     end_time: str | None = None
     location: str | None = None
 
+class InvalidateRequest(BaseModel):
+    identifiers: dict[str, list[str]] = {}
+    clear_all: bool = False
+
 def to_serializable(obj):
     """Convert numpy/pandas types to JSON-serializable Python types."""
     # Check for None first
@@ -66,8 +150,32 @@ def to_serializable(obj):
     else:
         return obj
 
+def cache_key(endpoint, input: QueryInput):
+    return (endpoint, *input.model_dump().values())
+
+def cached_response(key):
+    """The cached JSON body for key as a response, or None on a miss."""
+    body = response_cache.get(key)
+    return Response(content=body, media_type="application/json") if body is not None else None
+
+def cache_response(key, response, tags, generation):
+    """Serialise a response once and cache the JSON body, so hits skip encoding entirely.
+
+    generation is response_cache.generation() from before the database was read: if an
+    invalidation arrived since, the body may predate the ingest and is not cached.
+    """
+    body = JSONResponse(jsonable_encoder(response)).body
+    response_cache.set(key, body, tags=tags, generation=generation)
+    return Response(content=body, media_type="application/json")
+
 @app.post("/run-query")
-def run_query(input: QueryInput):
+async def run_query(input: QueryInput):
+    key = cache_key("run-query", input)
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
+
     # Query entity without writing files (API returns data in-memory)
     user_input = {
         "identifier": {input.identifier_type: input.identifier_value},
@@ -76,48 +184,131 @@ def run_query(input: QueryInput):
         "location": input.location
     }
     #print("Received query:", user_input)
-    result = query_entity(user_input, save_to_disk=False)
+    result = await query_entity(user_input)
     #print("Query result obtained.", result)
     if result is None:
         print("Oops :(")
         raise HTTPException(status_code=404, detail="Entity not found::()")
     
-    # Clean the result to ensure JSON serialization
-    print("Cleaning result for serialization...")
-    clean_result = to_serializable(result)
-    print("Result", result)
-    return {"status": "success", "data": result}
+    response = {"status": "success", "data": result}
+    return cache_response(key, response, await entity_ids_for({input.identifier_type: [input.identifier_value]}),
+                          generation)
 
 @app.post("/details")
-def details(input: QueryInput):
+async def details(input: QueryInput):
+    key = cache_key("details", input)
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
+
     user_input = {
         "identifier": {input.identifier_type: input.identifier_value},
     }
     print("Received details request:", user_input)
-    result = entity_details(user_input)
+    result = await entity_details(user_input)
     print("Details result", result)
-    return {"status": "success", "details": result}
+    response = {"status": "success", "details": result}
+    if result is None:
+        return response
+    return cache_response(key, response, [result["entity_id"]], generation)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"status": "success", "cache": response_cache.stats()}
+
+
+@app.get("/metrics/pool")
+def pool_metrics():
+    """The API's asyncpg pool sizes plus wait-time, in-use and checkout-duration histograms."""
+    return {"status": "success", "async": get_info_async.pool_metrics()}
+
+
+LOCAL_CLIENTS = {"127.0.0.1", "::1", "localhost"}
+
+@app.post("/cache/invalidate")
+async def cache_invalidate(req: InvalidateRequest, request: Request,
+                           x_invalidate_token: str | None = Header(default=None)):
+    """Drop cached responses for the entities behind the given identifiers (called by db_insert.py).
+
+    With CACHE_INVALIDATE_TOKEN set the caller must send it as X-Invalidate-Token;
+    without it only clients on this host may call.
+    """
+    if INVALIDATE_TOKEN:
+        if not hmac.compare_digest(x_invalidate_token or "", INVALIDATE_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid invalidation token")
+    elif request.client is None or request.client.host not in LOCAL_CLIENTS:
+        raise HTTPException(status_code=403, detail="Cache invalidation is only accepted from localhost")
+    if req.clear_all:
+        dropped = response_cache.clear()
+    else:
+        dropped = response_cache.invalidate(await entity_ids_for(req.identifiers))
+    return {"status": "success", "invalidated": dropped}
+
+
+def current_model():
+    with predictor_lock:
+        model = predictor
+    if model is None:
+        raise HTTPException(status_code=400, detail="Model not trained yet. Call /train first.")
+    return model
 
 
 @app.post("/train")
 def train_model(req: TrainRequest):
-    global predictor
+    """
+    Queue a training job and return its id; poll GET /train/{job_id} for progress.
+    Predictions keep using the current model until the new one is swapped in.
+    A job with the same parameters that is still queued or running is returned instead of a new one.
+    """
+    try:
+        CampusLocationPredictor(**req.model_dump())  # reject bad parameters (e.g. unparseable times) before queueing
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job, created = training.submit(req.model_dump())
+    return {"status": "accepted" if created else "duplicate", "job_id": job["job_id"], "job": job}
+
+
+@app.post("/train/update")
+def update_model(req: UpdateRequest):
+    """
+    Queue an incremental update of the latest model with the events in req.data_dir,
+    or with source "db" the database events newer than the model's latest event
+    (no full retrain unless requested or drift exceeds req.drift_threshold); the
+    updated model is swapped in like a trained one. Poll GET /train/{job_id}.
+    """
+    current_model()
+    if req.source == "csv" and not req.data_dir:
+        raise HTTPException(status_code=422, detail="data_dir is required for source 'csv'")
+    job, created = training.submit(req.model_dump(), kind="update")
+    return {"status": "accepted" if created else "duplicate", "job_id": job["job_id"], "job": job}
+
+
+@app.get("/train/status")
+def train_status():
     with predictor_lock:
-        predictor = CampusLocationPredictor(
-            data_dir=req.data_dir,
-            time_window_hours=req.time_window_hours,
-            n_clusters=req.n_clusters,
-            decay_half_life_hours=req.decay_half_life_hours,
-            nearby_window_radius=req.nearby_window_radius
-        )
-        try:
-            predictor.load_and_integrate_data()
-            predictor.temporal_aggregation()
-            predictor.build_feature_matrix_and_cluster()
-            predictor.build_cluster_prob_table()
-            return {"status": "success", "message": "Model trained successfully!"}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        model = predictor
+    return {
+        "model_version": getattr(model, "model_version", None),
+        "jobs": training.list(),
+    }
+
+
+@app.get("/train/{job_id}")
+def train_job(job_id: str):
+    job = training.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
+@app.delete("/train/{job_id}")
+def cancel_train_job(job_id: str):
+    job = training.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
 
 
 @app.post("/predict")
@@ -125,33 +316,106 @@ def predict_location(req: PredictRequest):
     """
     Predicts the most probable location for a given entity and timestamp.
     """
-    global predictor
-    with predictor_lock:
-        if predictor is None:
-            raise HTTPException(status_code=400, detail="Model not trained yet. Call /train first.")
+    model = current_model()
+    try:
+        result = model.predict_location(req.entity_id, req.timestamp)
+        clean_result = to_serializable(result)
+
+        return {
+            "entity_id": req.entity_id,
+            "timestamp": req.timestamp,
+            **clean_result
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
-        try:
-            result = predictor.predict_location(req.entity_id, req.timestamp)
-            clean_result = to_serializable(result)
 
-            return {
-                "entity_id": req.entity_id,
-                "timestamp": req.timestamp,
-                **clean_result
-            }
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+@app.post("/predict/batch")
+def predict_locations(req: PredictBatchRequest):
+    """
+    /predict for many (entity_id, timestamp) pairs in one call; results are in request order.
+    """
+    model = current_model()
+    try:
+        preds = model.predict_batch(
+            [p.entity_id for p in req.predictions],
+            [p.timestamp for p in req.predictions],
+            with_details=True
+        )
+        results = [
+            {"entity_id": p.entity_id, "timestamp": p.timestamp, **to_serializable(row)}
+            for p, row in zip(req.predictions, preds.drop(columns=["entity_id", "timestamp"]).to_dict("records"))
+        ]
+        return {"status": "success", "count": len(results), "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
 @app.get("/alerts/inactive")
-def get_inactive_alerts():
+async def get_inactive_alerts(hours: float = Query(get_info.INACTIVE_HOURS, gt=0)):
+    """
+    Entities with no activity in the last `hours` hours (never-seen entities included).
+    Served from the alert engine's state for its threshold, from the database otherwise.
+    """
     try:
-        inactive = check_inactive_entities()
+        if alert_engine.ready and hours == alert_engine.hours:
+            inactive = alert_engine.snapshot()
+        else:
+            inactive = await check_inactive_entities(hours)
         return {"status": "success", "alerts": inactive, "count": len(inactive)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch alerts: {str(e)}")
 
 
+@app.get("/alerts/anomalous")
+async def get_anomalous_alerts(
+    hours: float = Query(get_info.ANOMALOUS_HOURS, gt=0),
+    threshold: float = Query(get_info.DEVIATION_THRESHOLD, gt=0, le=1),
+    limit: int = Query(500, ge=1, le=10000),
+):
+    """
+    Observed (entity, time window, location) of the last `hours` hours that the location model
+    scored below `threshold`, least likely first (scored after each ingest, see deviation_scores.py).
+    """
+    try:
+        anomalous = await check_anomalous_observations(hours, threshold, limit)
+        return {"status": "success", "alerts": anomalous, "count": len(anomalous), "threshold": threshold}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch alerts: {str(e)}")
+
+
+@app.get("/alerts/stream")
+async def stream_alerts():
+    """
+    Server-Sent Events: a "snapshot" of the inactive entities, then an "inactive" or
+    "active" event per transition as ingest commits new activity or deadlines pass.
+    A client that falls too far behind is disconnected and gets a fresh snapshot on reconnect.
+    """
+    queue = alert_engine.subscribe()
+
+    async def events():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), ALERT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            alert_engine.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/alerts/stats")
+def alert_stats():
+    return {"status": "success", "engine": alert_engine.stats()}
+
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,211 @@
+"""
+Versioned on-disk artifacts for trained CampusLocationPredictor models.
+
+Each trained model is written to its own version directory under MODEL_DIR:
+
+    models/
+      LATEST                      name of the current version
+      20261018T130501123456-3f2a9c/
+        meta.json                 training parameters, sizes, created_at
+        prob.npy ...              lookup arrays (labels as int codes), memory-mapped on load
+        model.joblib              encoders, SVD, KMeans, cluster map, priors, label vocabularies
+        tables.joblib             aggregated data, probability tables, recent events
+
+A version is written to a temporary directory and renamed into place, then
+LATEST is replaced with os.replace, so readers only ever see complete
+versions. Loading memory-maps the arrays and skips the training steps, and
+tables.joblib, which predictions do not need, is only read when a table is
+first used (e.g. by an incremental update), so the API can start serving the
+latest model right away.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+import joblib
+import numpy as np
+from dotenv import load_dotenv
+from prediction_pipeline import CampusLocationPredictor
+
+load_dotenv()
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+
+# Versions kept on disk; older ones are removed after each save
+KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "3"))
+
+FORMAT_VERSION = 1
+
+# Numeric arrays of the compiled lookup, stored as .npy and memory-mapped on load
+ARRAY_KEYS = ("grid_to_obs", "actual_keys", "actual_location", "actual_sources", "prob", "has_prob")
+# Everything else in the lookup (label vocabularies, dicts, scalars) goes into model.joblib
+OBJECT_KEYS = ("step", "n_grid", "window0", "entity_codes", "actual_location_labels", "actual_source_labels",
+               "locations", "cluster_codes", "cluster_top", "global_top")
+TABLES = ("aggregated_data", "recent_events", "recent_since",
+          "feature_matrix", "feature_index", "feature_windows",
+          "cluster_counts", "cluster_prob_table", "prob_codes")
+# Fitted models and the priors score_observations reads, in model.joblib
+# (svd_model is None unless trained with svd_components)
+MODELS = ("location_encoder", "entity_encoder", "svd_model", "kmeans_model", "entity_clusters",
+          "cluster_prior", "global_location_prior")
+
+
+def new_version():
+    """Version names sort in creation order."""
+    return datetime.now().strftime("%Y%m%dT%H%M%S%f") + "-" + uuid.uuid4().hex[:6]
+
+
+def latest_version(model_dir=MODEL_DIR):
+    """Name of the current version, or None if no model was saved yet."""
+    try:
+        return (Path(model_dir) / "LATEST").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(model_dir=MODEL_DIR):
+    p = Path(model_dir)
+    if not p.is_dir():
+        return []
+    return sorted(d.name for d in p.iterdir() if d.is_dir() and not d.name.startswith("."))
+
+
+def read_meta(version, model_dir=MODEL_DIR):
+    return json.loads((Path(model_dir) / version / "meta.json").read_text())
+
+
+def save_model(predictor: CampusLocationPredictor, model_dir=MODEL_DIR, publish=True):
+    """
+    Write a trained predictor as a new version and (if publish) point LATEST at it.
+    Returns the version name.
+    """
+    if predictor._lookup is None:
+        predictor._compile_lookup()
+    lookup = predictor._lookup
+    root = Path(model_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    version = new_version()
+    tmp = root / f".tmp-{version}"
+    tmp.mkdir()
+    try:
+        for key in ARRAY_KEYS:
+            np.save(tmp / f"{key}.npy", np.ascontiguousarray(lookup[key]))
+        joblib.dump({
+            **{name: getattr(predictor, name) for name in MODELS},
+            "lookup": {key: lookup[key] for key in OBJECT_KEYS},
+        }, tmp / "model.joblib")
+        joblib.dump({name: getattr(predictor, name) for name in TABLES}, tmp / "tables.joblib")
+        meta = {
+            "format": FORMAT_VERSION,
+            "version": version,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "params": {
+                "data_dir": str(predictor.data_dir),
+                "time_window_hours": predictor.time_window_hours,
+                "n_clusters": predictor.n_clusters,
+                "decay_half_life_hours": predictor.decay_half_life_hours,
+                "nearby_window_radius": predictor.nearby_window_radius,
+                "features": predictor.features,
+                "svd_components": predictor.svd_components,
+                "clusterer": predictor.clusterer,
+                "batch_size": predictor.batch_size,
+                "source": predictor.source,
+                "start_time": predictor.start_time.isoformat() if predictor.start_time is not None else None,
+                "end_time": predictor.end_time.isoformat() if predictor.end_time is not None else None,
+            },
+            "entities": len(predictor.entity_clusters),
+            # drift bookkeeping of update_from_events
+            "clustered_rows": predictor.clustered_rows,
+            "rows_since_cluster": predictor.rows_since_cluster,
+            "clusters": int(lookup["prob"].shape[0]),
+            "windows": int(lookup["prob"].shape[1]),
+            "locations": int(lookup["prob"].shape[2]),
+        }
+        (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+        os.replace(tmp, root / version)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    predictor.model_version = version
+    if publish:
+        publish_version(version, model_dir)
+    print(f"Saved model version {version} to {(root / version).resolve()}")
+    return version
+
+
+def publish_version(version, model_dir=MODEL_DIR):
+    """Atomically point LATEST at version and drop versions beyond KEEP_VERSIONS."""
+    root = Path(model_dir)
+    if not (root / version / "meta.json").exists():
+        raise FileNotFoundError(f"No model version {version} in {root}")
+    tmp = root / f".LATEST-{uuid.uuid4().hex[:6]}"
+    tmp.write_text(version)
+    os.replace(tmp, root / "LATEST")
+    prune_versions(model_dir, keep=KEEP_VERSIONS)
+
+
+def prune_versions(model_dir=MODEL_DIR, keep=KEEP_VERSIONS):
+    current = latest_version(model_dir)
+    old = [v for v in list_versions(model_dir) if v != current]
+    for version in old[:max(len(old) - max(keep - 1, 0), 0)]:
+        shutil.rmtree(Path(model_dir) / version, ignore_errors=True)
+
+
+class PendingTables:
+    """tables.joblib of a loaded version, read into the predictor the first time one of its tables is used."""
+
+    names = frozenset(TABLES)
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        self.lock = threading.Lock()
+
+    def load(self, predictor):
+        with self.lock:
+            if predictor.__dict__.get("_pending_tables") is not self:
+                return  # another thread read them
+            tables = {**self.defaults, **joblib.load(self.path)}
+            predictor.__dict__.update(tables)
+            del predictor.__dict__["_pending_tables"]
+
+
+def load_model(version=None, model_dir=MODEL_DIR, mmap=True, tables=False):
+    """
+    Load a saved version (default: LATEST) into a ready-to-predict CampusLocationPredictor.
+    With mmap the lookup arrays are memory-mapped read-only instead of read. tables.joblib
+    is read right away with tables (the update worker, which changes them), else on first use.
+    """
+    version = version or latest_version(model_dir)
+    if version is None:
+        raise FileNotFoundError(f"No saved model in {Path(model_dir).resolve()}")
+    path = Path(model_dir) / version
+    meta = json.loads((path / "meta.json").read_text())
+    if meta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Model version {version} has unsupported format {meta.get('format')}")
+
+    predictor = CampusLocationPredictor(**meta["params"])
+    model = joblib.load(path / "model.joblib")
+    for name in MODELS:
+        if name in model:  # versions saved before svd_model existed
+            setattr(predictor, name, model[name])
+    defaults = {name: predictor.__dict__.pop(name) for name in TABLES if name in predictor.__dict__}
+    pending = PendingTables(path / "tables.joblib", defaults)
+    predictor._pending_tables = pending
+    if tables:
+        pending.load(predictor)
+    if "clustered_rows" in meta:
+        predictor.clustered_rows = meta["clustered_rows"]
+    else:
+        predictor.clustered_rows = len(predictor.aggregated_data)
+    predictor.rows_since_cluster = meta.get("rows_since_cluster", 0)
+    lookup = dict(model["lookup"])
+    for key in ARRAY_KEYS:
+        lookup[key] = np.load(path / f"{key}.npy", mmap_mode="r" if mmap else None)
+    predictor._lookup = lookup
+    predictor.model_version = version
+    return predictor
@@ -0,0 +1,308 @@
+"""
+Time partitions of the event tables (schema mode EVENT_PARTITIONING=month|week).
+
+create_partitioned_tables.sql declares the large event tables range-partitioned
+by their time column, with a DEFAULT partition for rows outside every range, so
+a time-bounded query only scans the months/weeks it asks for and retention is a
+DETACH instead of a DELETE. This module manages the partitions:
+
+ - prepare_partitions() creates the partitions a staged load needs before it is
+   merged (db_insert.copy_chunks, in a short transaction of its own so the
+   merge does not hold their locks), so new rows land in their own partition
+   and not in the default one
+ - maintain_partitions() is the maintenance job: it moves rows that did end up
+   in a default partition into partitions of their own, creates PARTITIONS_AHEAD
+   periods after the current one, and detaches the partitions older than
+   PARTITION_RETENTION periods, moving them to PARTITION_ARCHIVE_SCHEMA (or
+   dropping them if that is empty)
+ - index_partitions() builds the indexes of create_indexes.sql one partition at
+   a time (CREATE INDEX CONCURRENTLY, attached to an index ON ONLY the parent),
+   so indexing a long history never locks a whole table; run_create_indexes.py
+   calls it. Partitions created later get the parent's indexes on ATTACH.
+
+Partitions are named <table>_p<YYYYMMDD of their first day>. A table's period is
+read back from its partitions, so a schema keeps the period it was created with.
+No partition is created for a period retention already expired: late rows of
+such a period stay in the default partition until maintain_partitions moves
+them to that period's archived table (or deletes them).
+Tables that are not partitioned are left alone by everything here.
+
+    python partitions.py
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PERIODS = ("month", "week")
+# Partition period of a new schema; empty keeps the event tables unpartitioned
+EVENT_PARTITIONING = os.getenv("EVENT_PARTITIONING", "").strip().lower()
+if EVENT_PARTITIONING not in ("",) + PERIODS:
+    raise ValueError(f"EVENT_PARTITIONING must be one of {PERIODS} or empty, not {EVENT_PARTITIONING!r}")
+# Periods after the current one that always exist, so inserts never wait on DDL
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "3"))
+# Periods kept before the current one; older partitions are detached (0 keeps everything)
+PARTITION_RETENTION = int(os.getenv("PARTITION_RETENTION", "0"))
+# Schema detached partitions are moved to; empty drops them
+PARTITION_ARCHIVE_SCHEMA = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
+
+# partitioned table -> partition column (create_partitioned_tables.sql)
+PARTITION_KEYS = {
+    "campus_card_swipes": "timestamp",
+    "cctv_frames": "timestamp",
+    "lab_bookings": "start_time",
+    "library_checkouts": "timestamp",
+    "wifi_associations_logs": "timestamp",
+}
+
+BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+INDEX = re.compile(r"CREATE INDEX IF NOT EXISTS (\w+) ON (\w+)\s*\((.+)\);")
+
+Partition = Tuple[str, Optional[pd.Timestamp], Optional[pd.Timestamp]]
+
+
+def period_start(ts, period: str) -> pd.Timestamp:
+    """First instant of the month or (Monday-based, like date_trunc) week containing ts."""
+    day = pd.Timestamp(ts).normalize()
+    return day - pd.Timedelta(days=day.dayofweek) if period == "week" else day.replace(day=1)
+
+
+def shift_period(start: pd.Timestamp, period: str, n: int) -> pd.Timestamp:
+    return start + (pd.Timedelta(weeks=n) if period == "week" else pd.DateOffset(months=n))
+
+
+def retention_cutoff(period: str, retention: int = PARTITION_RETENTION, now=None) -> Optional[pd.Timestamp]:
+    """Start of the oldest period retention keeps (None if it keeps everything)."""
+    if retention <= 0:
+        return None
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    return shift_period(period_start(now, period), period, -retention)
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def list_partitions(cur, table: str) -> List[Partition]:
+    """(name, lower, upper) of table's partitions by lower bound; the default partition (no bounds) last."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    ranged, default = [], []
+    for name, bound in cur.fetchall():
+        match = BOUND.search(bound)
+        if match:
+            ranged.append((name, pd.Timestamp(match.group(1)), pd.Timestamp(match.group(2))))
+        else:
+            default.append((name, None, None))
+    return sorted(ranged, key=lambda p: p[1]) + default
+
+
+def table_period(partitions: List[Partition]) -> str:
+    """Period of the existing partitions, else EVENT_PARTITIONING (month if unset)."""
+    for _, lower, upper in partitions:
+        if lower is not None:
+            return "week" if upper - lower <= pd.Timedelta(days=7) else "month"
+    return EVENT_PARTITIONING or "month"
+
+
+def periods_in(cur, relation: str, key: str, period: str) -> List[pd.Timestamp]:
+    """Start of every period that has rows in relation."""
+    cur.execute(f"SELECT DISTINCT date_trunc(%s, {key}) FROM {relation} WHERE {key} IS NOT NULL", (period,))
+    return [pd.Timestamp(row[0]) for row in cur.fetchall()]
+
+
+def create_partition(cur, table: str, lower: pd.Timestamp, upper: pd.Timestamp, default: Optional[str]) -> str:
+    """
+    Partition [lower, upper) of table. It is filled with the default partition's rows in that
+    range and attached after, since a partition cannot be created over rows the default holds.
+    """
+    key = PARTITION_KEYS[table]
+    name = f"{table}_p{lower:%Y%m%d}"
+    bounds = (lower.to_pydatetime(), upper.to_pydatetime())
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    if default:
+        cur.execute(f"WITH moved AS (DELETE FROM {default} WHERE {key} >= %s AND {key} < %s RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved", bounds)
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return name
+
+
+def ensure_partitions(cur, table: str, times: Iterable, cutoff: Optional[pd.Timestamp] = None) -> List[str]:
+    """
+    Create the missing partitions of table for the periods containing times; returns their names.
+    A period overlapping an existing partition is left to it (or to the default partition), as is
+    one ending by cutoff (see retention_cutoff).
+    """
+    partitions = list_partitions(cur, table)
+    period = table_period(partitions)
+    ranges = [(lower, upper) for _, lower, upper in partitions if lower is not None]
+    default = next((name for name, lower, _ in partitions if lower is None), None)
+    created = []
+    for lower in sorted({period_start(t, period) for t in times}):
+        upper = shift_period(lower, period, 1)
+        if cutoff is not None and upper <= cutoff:
+            continue
+        if not any(lo < upper and lower < hi for lo, hi in ranges):
+            created.append(create_partition(cur, table, lower, upper, default))
+            ranges.append((lower, upper))
+    return created
+
+
+def prepare_partitions(cur, table: str, staging: str) -> List[str]:
+    """
+    Partitions for the rows staged for table, except for periods retention expired.
+    The caller commits them before it merges, so the merge does not hold the locks
+    creating them takes (on the default partition among others).
+    """
+    if table not in PARTITION_KEYS or not is_partitioned(cur, table):
+        return []
+    period = table_period(list_partitions(cur, table))
+    return ensure_partitions(cur, table, periods_in(cur, staging, PARTITION_KEYS[table], period),
+                             retention_cutoff(period, PARTITION_RETENTION))
+
+
+def archive_partition(cur, name: str, archive_schema: str):
+    """Move detached partition name to archive_schema, appending its rows to a table of that name already there."""
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}")
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{archive_schema}.{name}",))
+    if cur.fetchone()[0]:
+        cur.execute(f"INSERT INTO {archive_schema}.{name} SELECT * FROM {name}")
+        cur.execute(f"DROP TABLE {name}")
+    else:
+        cur.execute(f"ALTER TABLE {name} SET SCHEMA {archive_schema}")
+
+
+def expire_default_rows(cur, table: str, default: str, period: str, cutoff: pd.Timestamp,
+                        archive_schema: str) -> int:
+    """
+    Move the rows of the default partition older than cutoff to their period's table in
+    archive_schema, created if it is not there, or delete them without one; returns the row count.
+    """
+    key = PARTITION_KEYS[table]
+    if not archive_schema:
+        cur.execute(f"DELETE FROM {default} WHERE {key} < %s", (cutoff.to_pydatetime(),))
+        return cur.rowcount
+    expired = 0
+    for lower in sorted(periods_in(cur, f"ONLY {default}", key, period)):
+        if lower >= cutoff:
+            continue
+        name = f"{archive_schema}.{table}_p{lower:%Y%m%d}"
+        bounds = (lower.to_pydatetime(), shift_period(lower, period, 1).to_pydatetime())
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}")
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cur.execute(f"WITH moved AS (DELETE FROM {default} WHERE {key} >= %s AND {key} < %s RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved", bounds)
+        expired += cur.rowcount
+    return expired
+
+
+def maintain_partitions(conn=None, ahead: int = PARTITIONS_AHEAD, retention: int = PARTITION_RETENTION,
+                        archive_schema: str = PARTITION_ARCHIVE_SCHEMA, now=None) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Empty the default partitions, create the periods ahead and detach expired ones; one
+    transaction per table. Rows of expired periods in a default partition are archived with
+    their period (or deleted), and a partition whose archived table exists is appended to it.
+    """
+    import db_events
+    own = conn is None
+    conn = conn or db_events.connect()
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    report = {}
+    try:
+        for table, key in PARTITION_KEYS.items():
+            cur = conn.cursor()
+            try:
+                if not is_partitioned(cur, table):
+                    conn.rollback()
+                    continue
+                partitions = list_partitions(cur, table)
+                period = table_period(partitions)
+                current = period_start(now, period)
+                cutoff = retention_cutoff(period, retention, now)
+                times = [shift_period(current, period, n) for n in range(ahead + 1)]
+                defaults = [name for name, lower, _ in partitions if lower is None]
+                for name in defaults:
+                    times += periods_in(cur, f"ONLY {name}", key, period)
+                created = ensure_partitions(cur, table, times, cutoff)
+
+                detached, expired = [], 0
+                if cutoff is not None:
+                    for name in defaults:
+                        expired += expire_default_rows(cur, table, name, period, cutoff, archive_schema)
+                    for name, lower, upper in partitions:
+                        if lower is None or upper > cutoff:
+                            continue
+                        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                        if archive_schema:
+                            archive_partition(cur, name, archive_schema)
+                        else:
+                            cur.execute(f"DROP TABLE {name}")
+                        detached.append(name)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+            report[table] = {"created": created, "detached": detached, "expired_rows": expired}
+            if created or detached or expired:
+                where = f"archived to {archive_schema}" if archive_schema else "dropped"
+                print(f"Partitions of {table} ({period}): {len(created)} created, {len(detached)} detached "
+                      f"and {where}, {expired} expired rows of the default partition {where}.")
+    finally:
+        if own:
+            conn.close()
+    return report
+
+
+def index_partitions(conn, sql_content: str) -> int:
+    """
+    Build the indexes sql_content (create_indexes.sql) declares on partitioned tables
+    partition by partition: an index ON ONLY the parent, then CREATE INDEX CONCURRENTLY
+    on each partition that lacks it, attached to the parent's. The parent index becomes
+    valid once every partition has it, and the CREATE INDEX in sql_content then finds it
+    in place. Returns the number of partition indexes built.
+    """
+    cur = conn.cursor()
+    targets = [spec for spec in INDEX.findall(sql_content) if is_partitioned(cur, spec[1])]
+    conn.commit()
+    autocommit, conn.autocommit = conn.autocommit, True
+    built = 0
+    try:
+        for index, table, columns in targets:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON ONLY {table} ({columns})")
+            cur.execute("""
+                SELECT c.relname
+                FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+                JOIN pg_class c ON c.oid = x.indrelid
+                WHERE i.inhparent = to_regclass(%s)
+            """, (index,))
+            indexed = {row[0] for row in cur.fetchall()}
+            for name, _, _ in list_partitions(cur, table):
+                if name in indexed:
+                    continue
+                child = f"{index}_{name[len(table) + 1:]}"
+                # an interrupted concurrent build leaves an invalid index behind
+                cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (child,))
+                row = cur.fetchone()
+                if row and not row[0]:
+                    cur.execute(f"DROP INDEX CONCURRENTLY {child}")
+                cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {name} ({columns})")
+                cur.execute(f"ALTER INDEX {index} ATTACH PARTITION {child}")
+                built += 1
+    finally:
+        conn.autocommit = autocommit
+        cur.close()
+    return built
+
+
+if __name__ == "__main__":
+    maintain_partitions()
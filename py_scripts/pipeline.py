@@ -1,7 +1,12 @@
+import argparse
 import subprocess
 import sys
 import os
+import time
 from dotenv import load_dotenv
+from ingest_utils import CHUNK_SIZE, MAX_WORKERS, INCREMENTAL
+from partitions import EVENT_PARTITIONING
+from db_insert import ANOMALY_DETECTION, DEVIATION_SCORING
 
 load_dotenv()
 
@@ -10,14 +15,25 @@ DB_PASS = os.getenv("DB_MAIN_PASSWORD")
 DB_HOST = os.getenv("DB_MAIN_HOST")
 DB_PORT = os.getenv("DB_MAIN_PORT")
 
-def run_python(script):
+def run_python(script, env=None):
     print(f"\nRunning {script} ...")
-    result = subprocess.run([sys.executable, script])
+    result = subprocess.run([sys.executable, script], env=env)
     if result.returncode != 0:
         print(f"Error running {script}")
         sys.exit(1)
     print(f"Finished {script}")
 
+def run_python_parallel(scripts, env=None):
+    """Run independent scripts concurrently and wait for all of them before returning."""
+    print(f"\nRunning {', '.join(scripts)} in parallel ...")
+    start = time.perf_counter()
+    procs = {script: subprocess.Popen([sys.executable, script], env=env) for script in scripts}
+    failed = [script for script, proc in procs.items() if proc.wait() != 0]
+    if failed:
+        print(f"Error running {', '.join(failed)}")
+        sys.exit(1)
+    print(f"Finished {', '.join(scripts)} in {time.perf_counter() - start:.2f}s")
+
 def run_psql(database, sql_file):
     print(f"\nExecuting {sql_file} on {database} ...")
     try:
@@ -40,10 +56,22 @@ def run_psql(database, sql_file):
         print("psql command not found in PATH. Please install PostgreSQL client tools or add to PATH.")
         sys.exit(1)
 
-def main():
+def main(chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS, incremental=INCREMENTAL):
+    # Child scripts stream their CSVs in chunks of this many rows and load up to max_workers tables at once
+    ingest_env = {
+        **os.environ,
+        "INGEST_CHUNK_SIZE": str(chunk_size),
+        "INGEST_MAX_WORKERS": str(max_workers),
+        "INGEST_INCREMENTAL": "1" if incremental else "0",
+    }
     run_python("profile_preprocess.py")
-    run_python("ingest_and_preprocess.py")
+    run_python("ingest_and_preprocess.py", env=ingest_env)
+    if EVENT_PARTITIONING:
+        # Partitioned event tables first; create_tables.sql then skips them
+        run_psql("postgres", "create_partitioned_tables.sql")
     run_psql("postgres", "create_tables.sql")
+    if EVENT_PARTITIONING:
+        run_python("partitions.py")
     print("\nEnsuring ethos_images database exists ...")
     subprocess.run(
         [
@@ -53,11 +81,26 @@ def main():
         env={**os.environ, "PGPASSWORD": DB_PASS}
     )
     run_psql("postgres", "create_images_table.sql")
-    run_python("db_insert.py")
-    run_python("ingest_face_images.py")
+    # Table loads and face images are independent; indexes are built once every loader has finished.
+    # The anomaly rules and deviation scores read the new events by time range, so they run once the
+    # indexes exist
+    load_env = {**ingest_env, "ANOMALY_DETECTION": "0", "DEVIATION_SCORING": "0"}
+    run_python_parallel(["db_insert.py", "ingest_face_images.py"], env=load_env)
     run_python("run_create_indexes.py")
+    if ANOMALY_DETECTION:
+        run_python("anomaly_rules.py")
+    if DEVIATION_SCORING:
+        run_python("deviation_scores.py")
 
     print("\n Pipeline completed successfully!")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the full ingest pipeline.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="rows per chunk when streaming CSVs (default: %(default)s)")
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS,
+                        help="tables loaded concurrently by db_insert.py (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true", default=INCREMENTAL,
+                        help="skip files already loaded and rows at or below each source's high-water mark")
+    args = parser.parse_args()
+    main(chunk_size=args.chunk_size, max_workers=args.max_workers, incremental=args.incremental)
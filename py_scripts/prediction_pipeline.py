@@ -8,19 +8,45 @@ Features added compared to previous version:
  - Confidence scores are true probabilities (0..1)
  - Keeps 'source' for transparency (not used in clustering)
  - Configurable parameters for window size, decay, and clustering
-Dependencies: pandas, numpy, scikit-learn
+ - Scalable clustering: sparse one-hot features, optional SVD, MiniBatchKMeans
+Dependencies: pandas, numpy, scipy, scikit-learn
 """
 import os
+import time
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import timedelta
-from typing import Dict, Tuple, Optional, List
+from typing import Dict, Tuple, Optional, List, Union
+from scipy import sparse
 from sklearn.preprocessing import LabelEncoder
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from ingest_utils import CHUNK_SIZE
+from identity_index import IdentityIndex
 import warnings
 warnings.filterwarnings("ignore")
 
+DATA_SOURCES = ("csv", "db")
+FEATURE_MODES = ("dense", "onehot")
+CLUSTERERS = ("kmeans", "minibatch")
+
+# Share of aggregated rows added or changed since the last clustering above which
+# update_from_events re-clusters all entities
+DRIFT_THRESHOLD = 0.2
+
+# Hours of raw events kept with the model so update_from_events can re-aggregate
+# the windows new events fall into exactly
+RECENT_EVENTS_HOURS = 24
+
+
+def _unique_counts(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted unique values of an int array and their counts (sort based; np.unique without
+    return_counts takes a hash path that is an order of magnitude slower here)."""
+    keys = np.sort(keys)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+    return keys[starts], np.diff(np.r_[starts, len(keys)])
+
 
 class CampusLocationPredictor:
     def __init__(
@@ -30,6 +56,14 @@ class CampusLocationPredictor:
         n_clusters: Optional[int] = None,
         decay_half_life_hours: float = 2.0,
         nearby_window_radius: int = 2,
+        chunk_size: int = CHUNK_SIZE,
+        features: str = "dense",
+        svd_components: Optional[int] = None,
+        clusterer: str = "kmeans",
+        batch_size: int = 4096,
+        source: str = "csv",
+        start_time: Optional[str] = None,
+        end_time: Optional[str] = None,
     ):
         """
         Args:
@@ -38,170 +72,253 @@ class CampusLocationPredictor:
             n_clusters: if None auto-select (based on entity count)
             decay_half_life_hours: half-life for exponential time-decay weighting (hours)
             nearby_window_radius: how many windows to search on each side (integer)
+            chunk_size: rows per chunk when streaming the CSVs
+            features: "dense" (entity x window matrix of location codes, -1 = absent) or
+                      "onehot" (sparse entity x (window, location) indicator matrix)
+            svd_components: if set, reduce the features to this many TruncatedSVD components
+            clusterer: "kmeans" (full batch, n_init=10) or "minibatch" (MiniBatchKMeans)
+            batch_size: MiniBatchKMeans batch size
+            source: "csv" (files in data_dir) or "db" (the Postgres tables, see db_events)
+            start_time, end_time: optional [start, end) range of events to train on
         """
+        if source not in DATA_SOURCES:
+            raise ValueError(f"source must be one of {DATA_SOURCES}, got {source!r}")
+        if features not in FEATURE_MODES:
+            raise ValueError(f"features must be one of {FEATURE_MODES}, got {features!r}")
+        if clusterer not in CLUSTERERS:
+            raise ValueError(f"clusterer must be one of {CLUSTERERS}, got {clusterer!r}")
         self.data_dir = Path(data_dir)
         self.time_window_hours = int(time_window_hours)
         self.n_clusters = n_clusters
         self.decay_half_life_hours = float(decay_half_life_hours)
         self.nearby_window_radius = int(nearby_window_radius)
+        self.chunk_size = int(chunk_size)
+        self.features = features
+        self.svd_components = int(svd_components) if svd_components else None
+        self.clusterer = clusterer
+        self.batch_size = int(batch_size)
+        self.source = source
+        self.start_time = pd.Timestamp(start_time) if start_time else None
+        self.end_time = pd.Timestamp(end_time) if end_time else None
+        if self.start_time is not None and self.end_time is not None and self.start_time >= self.end_time:
+            raise ValueError(f"start_time {self.start_time} is not before end_time {self.end_time}")
 
         # Data containers
         self.merged_data: pd.DataFrame = pd.DataFrame()
         self.aggregated_data: pd.DataFrame = pd.DataFrame()
-        self.feature_matrix: pd.DataFrame = pd.DataFrame()
+        # Events of the windows starting at recent_since or later (see _keep_recent_events)
+        self.recent_events: pd.DataFrame = pd.DataFrame()
+        self.recent_since: Optional[pd.Timestamp] = None
+        self.feature_matrix: Union[pd.DataFrame, sparse.csr_matrix] = pd.DataFrame()
+        # Rows (entity ids) and time windows of feature_matrix
+        self.feature_index: pd.Index = pd.Index([])
+        self.feature_windows: pd.Index = pd.DatetimeIndex([])
         self.location_encoder = LabelEncoder()
         self.entity_encoder = LabelEncoder()
+        self.svd_model = None
         self.kmeans_model = None
         self.entity_clusters: Dict[str, int] = {}
+        # Aggregated rows when entities were last clustered, and rows added/changed since
+        self.clustered_rows = 0
+        self.rows_since_cluster = 0
+        # Rows per (cluster, time_window, location_id); the probability tables are normalized from it
+        self.cluster_counts: pd.DataFrame = pd.DataFrame()
         self.cluster_prob_table: pd.DataFrame = pd.DataFrame()
         self.global_location_prior: pd.Series = pd.Series()
+        # Integer-coded cluster_prob_table (see _encode_prob_table)
+        self.prob_codes: Optional[Dict[str, np.ndarray]] = None
+        # Per-source rows and read/map seconds of the last load_and_integrate_data
+        self.load_report: pd.DataFrame = pd.DataFrame()
+        # Lookup structures compiled from the tables above (see _compile_lookup)
+        self._lookup: Optional[Dict] = None
+        # Saved version this model was written to / loaded from (see model_store)
+        self.model_version: Optional[str] = None
+
+    def __getattr__(self, name):
+        # Tables a loaded model has not read yet (model_store.load_model) are read on first use
+        pending = self.__dict__.get('_pending_tables')
+        if pending is None or name not in pending.names:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        pending.load(self)
+        return getattr(self, name)
 
     # -----------------------------
     # Loading & integration
     # -----------------------------
     def load_and_integrate_data(self):
-      """Load multiple CSVs and integrate them into unified schema."""
-      print("=== STEP 1: Load & Integrate Data ===")
+        """Load multiple CSVs (or the database tables) and integrate them into unified schema."""
+        print("=== STEP 1: Load & Integrate Data ===")
+        if self.source == "db":
+            self.merged_data, self.load_report = self.read_events_db(self.start_time, self.end_time)
+        else:
+            merged, self.load_report = self.read_events(self.data_dir)
+            in_range = pd.Series(True, index=merged.index)
+            if self.start_time is not None:
+                in_range &= merged['timestamp'] >= self.start_time
+            if self.end_time is not None:
+                in_range &= merged['timestamp'] < self.end_time
+            self.merged_data = merged if in_range.all() else merged[in_range]
+        return self.merged_data
 
-      def try_read(filename):
-          path = os.path.join(self.data_dir, filename)
+    def read_events_db(self, start=None, end=None, conn=None, sources=None,
+                       extra_columns=()) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        read_events from the Postgres tables instead of CSVs, optionally within [start, end),
+        limited to `sources` and keeping `extra_columns` (see db_events.read_source).
+        """
+        import db_events
+        dfs, profiles, report = db_events.read_events(conn, start, end, chunk_size=self.chunk_size,
+                                                      sources=sources, extra_columns=extra_columns)
+        return self.integrate_events(dfs, profiles if len(profiles) else None, report, extra_columns)
+
+    def next_event_time(self) -> pd.Timestamp:
+        """Start of the range of events the model has not seen (just after its latest event)."""
+        if self.recent_events.empty:
+            raise RuntimeError("Model has no record of its latest event; retrain it to update from the database.")
+        return self.recent_events['timestamp'].max() + pd.Timedelta(microseconds=1)
+
+    def read_events(self, data_dir, profiles_dir=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+      """
+      Read the event CSVs of data_dir and map them to entity_ids (unified schema).
+      Profiles are read from data_dir, else from profiles_dir (e.g. the training data
+      for a directory of newly ingested events). Returns (events, load report).
+      """
+      # Only these columns are ever used; everything else is dropped while streaming
+      event_columns = {'entity_id', 'device_hash', 'face_id', 'card_id', 'location_id',
+                       'ap_id', 'room_id', 'timestamp', 'start_time'}
+
+      def try_read(filename, columns=None, directory=data_dir):
+          path = os.path.join(directory, filename)
           if os.path.exists(path):
               print(f"Reading {filename}")
-              return pd.read_csv(path)
+              usecols = (lambda c: c in columns) if columns else None
+              chunks = []
+              for chunk in pd.read_csv(path, usecols=usecols, chunksize=self.chunk_size):
+                  # Parse timestamps per chunk so the raw strings never pile up in memory
+                  for col in ('timestamp', 'start_time'):
+                      if col in chunk.columns:
+                          chunk[col] = pd.to_datetime(chunk[col], errors='coerce')
+                  chunks.append(chunk)
+              return pd.concat(chunks, ignore_index=True)
           return None
 
+      def read_source(*filenames):
+          """First existing file of filenames, and the seconds spent finding and reading it."""
+          start = time.perf_counter()
+          df = None
+          for filename in filenames:
+              df = try_read(filename, event_columns)
+              if df is not None:
+                  break
+          return df, time.perf_counter() - start
+
       dfs = []
+      # source -> per-stage rows and seconds, printed as the load report
+      report = {}
 
       # ---- NOTES ----
-      df = try_read("free_text_notes (helpdesk or RSVPs).csv")
-      if df is None:
-          df = try_read("notes.csv")
+      df, read_s = read_source("free_text_notes (helpdesk or RSVPs).csv", "notes.csv")
       if df is not None and 'timestamp' in df.columns and 'entity_id' in df.columns:
           df = df[['entity_id', 'timestamp']].copy()
           df['location_id'] = 'note_location'
           df['source'] = 'note'
           df['temp_id'] = df['entity_id']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']])
+          report['note'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- WIFI/DEVICES ----
-      df = try_read("wifi_associations_logs.csv")
-      if df is None:
-          df = try_read("devices.csv")
-      if df is None:
-          df = try_read("device_logs.csv")
+      df, read_s = read_source("wifi_associations_logs.csv", "devices.csv", "device_logs.csv")
       if df is not None and 'timestamp' in df.columns and 'device_hash' in df.columns:
           df = df.rename(columns={'ap_id': 'location_id'})
           df['source'] = 'device'
           df['temp_id'] = df['device_hash']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']])
+          report['device'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- BOOKINGS ----
-      df = try_read("lab_bookings.csv")
-      if df is None:
-          df = try_read("bookings.csv")
+      df, read_s = read_source("lab_bookings.csv", "bookings.csv")
       if df is not None and 'entity_id' in df.columns:
           df = df.rename(columns={'room_id': 'location_id', 'start_time': 'timestamp'})
           df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
           df['source'] = 'booking'
           df['temp_id'] = df['entity_id']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']].dropna(subset=['timestamp']))
+          report['booking'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- FRAMES ----
-      df = try_read("cctv_frames.csv")
-      if df is None:
-          df = try_read("frames.csv")
+      df, read_s = read_source("cctv_frames.csv", "frames.csv")
       if df is not None and 'timestamp' in df.columns and 'face_id' in df.columns:
           df['source'] = 'frame'
           df['temp_id'] = df['face_id']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']])
+          report['frame'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- CARDS ----
-      df = try_read("campus card_swipes.csv")
-      if df is None:
-          df = try_read("cards.csv")
-      if df is None:
-          df = try_read("card_swipes.csv")
+      df, read_s = read_source("campus card_swipes.csv", "cards.csv", "card_swipes.csv")
       if df is not None and 'timestamp' in df.columns and 'card_id' in df.columns:
           df['source'] = 'card'
           df['temp_id'] = df['card_id']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']])
+          report['card'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- LIBRARY ----
-      df = try_read("library_checkouts.csv")
-      if df is None:
-          df = try_read("library_checkout.csv")
-      if df is None:
-          df = try_read("checkout.csv")
+      df, read_s = read_source("library_checkouts.csv", "library_checkout.csv", "checkout.csv")
       if df is not None and 'timestamp' in df.columns and 'entity_id' in df.columns:
           df['location_id'] = 'library'
           df['source'] = 'library'
           df['temp_id'] = df['entity_id']
           dfs.append(df[['temp_id', 'timestamp', 'location_id', 'source']])
+          report['library'] = {'rows': len(df), 'read_s': read_s}
 
       # ---- Merge ----
       if not dfs:
           raise ValueError("No data files found in directory!")
 
+      # Load profiles to map identifiers to entity_id
+      profiles_file = None
+      for directory in dict.fromkeys(d for d in (data_dir, profiles_dir) if d is not None):
+          for filename in ("student or staff profiles.csv", "profiles.csv"):
+              if profiles_file is None:
+                  profiles_file = try_read(filename, directory=directory)
+      return self.integrate_events(dfs, profiles_file, report)
+
+    def integrate_events(self, dfs, profiles_file, report, extra_columns=()) -> Tuple[pd.DataFrame, pd.DataFrame]:
+      """
+      Concatenate per-source event frames (temp_id, timestamp, location_id, source) and map
+      temp_id to entity_id through the profiles (None: keep the ids of sources that carry
+      an entity_id). report holds rows/read_s per source; extra_columns are kept (missing
+      where a source has none). Returns (events, load report).
+      """
       merged = pd.concat(dfs, ignore_index=True)
+      for column in extra_columns:
+          if column not in merged.columns:
+              merged[column] = None
       merged['timestamp'] = pd.to_datetime(merged['timestamp'], errors='coerce')
       merged = merged.dropna(subset=['timestamp'])
       print(f"Concatenated {len(merged)} total records from {len(dfs)} sources")
 
-      # Load profiles to map identifiers to entity_id
-      profiles_file = try_read("student or staff profiles.csv")
-      if profiles_file is None:
-          profiles_file = try_read("profiles.csv")
-      
       # Initialize entity_id column
       merged['entity_id'] = None
       
       if profiles_file is not None:
           print("Loading profiles for ID mapping...")
-          # Create mapping dictionaries - handle all possible ID types
-          card_to_entity = {}
-          device_to_entity = {}
-          face_to_entity = {}
-          entity_to_entity = {}
-          
-          if 'card_id' in profiles_file.columns:
-              card_to_entity = dict(zip(profiles_file['card_id'].dropna(), 
-                                       profiles_file.loc[profiles_file['card_id'].notna(), 'entity_id']))
-          if 'device_hash' in profiles_file.columns:
-              device_to_entity = dict(zip(profiles_file['device_hash'].dropna(), 
-                                         profiles_file.loc[profiles_file['device_hash'].notna(), 'entity_id']))
-          if 'face_id' in profiles_file.columns:
-              face_to_entity = dict(zip(profiles_file['face_id'].dropna(), 
-                                       profiles_file.loc[profiles_file['face_id'].notna(), 'entity_id']))
-          if 'entity_id' in profiles_file.columns:
-              entity_to_entity = dict(zip(profiles_file['entity_id'].dropna(), 
-                                         profiles_file['entity_id'].dropna()))
-          
-          # Create unified mapping based on source type
-          def map_to_entity(row):
-              temp_id = row['temp_id']
-              source = row['source']
-              
-              if pd.isna(temp_id):
-                  return None
-              
-              # Try direct entity_id first
-              if temp_id in entity_to_entity:
-                  return entity_to_entity[temp_id]
-              
-              # Map based on source
-              if source == 'card' and temp_id in card_to_entity:
-                  return card_to_entity[temp_id]
-              elif source == 'device' and temp_id in device_to_entity:
-                  return device_to_entity[temp_id]
-              elif source == 'frame' and temp_id in face_to_entity:
-                  return face_to_entity[temp_id]
+          index = IdentityIndex(profiles_file)
+          source_fields = {'card': 'card_id', 'device': 'device_hash', 'frame': 'face_id'}
+          direct_ids = index.entity_ids('entity_id')
+
+          # Per source: a temp_id that is a known entity_id maps to itself, otherwise it is
+          # looked up by the source's identifier column; booking, library and note rows
+          # already carry an entity_id and keep it
+          for source, rows in merged.groupby('source', sort=False).groups.items():
+              start = time.perf_counter()
+              temp = merged.loc[rows, 'temp_id']
+              entity = temp.map(direct_ids)
+              if source in source_fields:
+                  entity = entity.fillna(temp.map(index.entity_ids(source_fields[source])))
               elif source in ['booking', 'library', 'note']:
-                  # These already have entity_id
-                  return temp_id
-              
-              return None
-          
-          merged['entity_id'] = merged.apply(map_to_entity, axis=1)
+                  entity = entity.fillna(temp)
+              merged.loc[rows, 'entity_id'] = entity.where(temp.notna() & entity.notna(), None)
+              report[source]['map_s'] = time.perf_counter() - start
       else:
           print("Warning: No profiles file found. Using temp_id as entity_id where source is 'booking', 'library', or 'note'")
           # Fallback: use temp_id for sources that already have entity_id
@@ -209,18 +326,27 @@ class CampusLocationPredictor:
           merged.loc[mask, 'entity_id'] = merged.loc[mask, 'temp_id']
       
       # Drop records without entity_id
+      start = time.perf_counter()
       before_count = len(merged)
       merged = merged.dropna(subset=['entity_id'])
       after_count = len(merged)
+      drop_s = time.perf_counter() - start
       print(f"Mapped {after_count}/{before_count} records to entity_id ({100*after_count/before_count:.1f}%)")
-      
+      kept = merged['source'].value_counts()
+      for source, stats in report.items():
+          stats['mapped'] = int(kept.get(source, 0))
+
       # Keep only necessary columns
-      merged = merged[['entity_id', 'timestamp', 'location_id', 'source']]
+      merged = merged[['entity_id', 'timestamp', 'location_id', 'source', *extra_columns]]
       merged['location_id'] = merged['location_id'].astype(str)
       
-      self.merged_data = merged
-      print(f"Loaded {len(self.merged_data):,} records from {len(dfs)} data sources.")
-      return merged
+      print(f"Loaded {len(merged):,} records from {len(dfs)} data sources.")
+      load_report = pd.DataFrame.from_dict(report, orient='index').reindex(
+          columns=['rows', 'read_s', 'map_s', 'mapped']
+      ).fillna({'map_s': 0.0})
+      print(f"Load report (seconds; dropping unmapped rows took {drop_s:.3f}s):")
+      print(load_report.to_string(float_format=lambda v: f"{v:.3f}"))
+      return merged, load_report
 
     # -----------------------------
     # Temporal aggregation
@@ -230,18 +356,58 @@ class CampusLocationPredictor:
         Group events into fixed time windows and select the dominant location per entity-window.
         """
         print("\n=== STEP 2: Temporal Aggregation ===")
-        df = self.merged_data.copy()
+        aggregated = self.aggregate_events(self.merged_data)
+        self.aggregated_data = aggregated
+        self._keep_recent_events(self.merged_data)
+        print(f"Aggregated rows (entity x window): {len(aggregated)} | windows: {aggregated['time_window'].nunique()}")
+        return aggregated
+
+    def aggregate_events(self, events: pd.DataFrame) -> pd.DataFrame:
+        """aggregated_data rows (entity_id, time_window, location_id, sources, event_count) of events."""
+        df = events.copy()
         df['time_window'] = df['timestamp'].dt.floor(f"{self.time_window_hours}H")
 
-        # For each entity/time_window choose the mode location (if tie pick first)
-        aggregated = df.groupby(['entity_id', 'time_window']).agg(
-            location_id=('location_id', lambda x: x.mode().iloc[0] if len(x.mode()) > 0 else x.iloc[0]),
-            sources=('source', lambda s: ",".join(sorted(set(s)))),
-            event_count=('timestamp', 'count'),
-        ).reset_index()
+        # Groups in (entity_id, time_window) order; locations and sources as sorted codes
+        groups = df.groupby(['entity_id', 'time_window'], sort=True)
+        group = groups.ngroup().to_numpy(np.int64)
+        aggregated = groups['timestamp'].count().rename('event_count').reset_index()
+        loc_codes, locations = pd.factorize(df['location_id'], sort=True)
+        src_codes, sources = pd.factorize(df['source'], sort=True)
 
-        self.aggregated_data = aggregated
-        print(f"Aggregated rows (entity x window): {len(aggregated)} | windows: {aggregated['time_window'].nunique()}")
+        # For each entity/time_window choose the mode location (if tie pick first, i.e. the
+        # smallest location, as Series.mode sorts): count (group, location) pairs and take
+        # the first pair of each group whose count is the group's maximum
+        location_id = np.full(len(aggregated), np.nan, dtype=object)
+        valid = loc_codes >= 0
+        if valid.any():
+            pairs, counts = _unique_counts(group[valid] * len(locations) + loc_codes[valid])
+            pair_group = pairs // len(locations)
+            starts = np.flatnonzero(np.r_[True, pair_group[1:] != pair_group[:-1]])
+            group_max = np.repeat(np.maximum.reduceat(counts, starts), np.diff(np.r_[starts, len(pairs)]))
+            modal = np.flatnonzero(counts == group_max)
+            modal = modal[np.r_[True, pair_group[modal][1:] != pair_group[modal][:-1]]]
+            location_id[pair_group[modal]] = np.asarray(locations, dtype=object)[pairs[modal] % len(locations)]
+        if not valid.all():
+            # groups without any location keep their first value, as before
+            first = df['location_id'].groupby(group).first()
+            missing = np.flatnonzero(pd.isna(location_id))
+            location_id[missing] = first.reindex(missing).to_numpy()
+        aggregated.insert(2, 'location_id', location_id)
+
+        # Sorted, comma-joined set of sources per group: OR one bit per source code and
+        # label each distinct bit mask once
+        pairs, _ = _unique_counts(group * len(sources) + src_codes)
+        pair_group = pairs // max(len(sources), 1)
+        source_names = np.asarray(sources, dtype=object)
+        if 0 < len(sources) <= 62:
+            starts = np.flatnonzero(np.r_[True, pair_group[1:] != pair_group[:-1]])
+            masks = np.bitwise_or.reduceat(np.left_shift(1, pairs % len(sources)), starts)
+            labels = {m: ",".join(source_names[[b for b in range(len(sources)) if m >> b & 1]])
+                      for m in pd.unique(masks).tolist()}
+            source_sets = pd.Series(masks).map(labels).to_numpy()
+        else:
+            source_sets = pd.Series(source_names[pairs % max(len(sources), 1)]).groupby(pair_group).agg(",".join).to_numpy()
+        aggregated.insert(3, 'sources', source_sets)
         return aggregated
 
     # -----------------------------
@@ -249,27 +415,48 @@ class CampusLocationPredictor:
     # -----------------------------
     def build_feature_matrix_and_cluster(self):
         """
-        Create a feature matrix (entity x time_window) that holds location ids (encoded),
-        then run clustering on entities to obtain entity_clusters.
+        Create a feature matrix of entities over time windows, then run clustering on
+        entities to obtain entity_clusters.
+
+        features="dense" holds the encoded location per (entity, time_window), -1 where
+        absent: entities x windows float64, which grows to gigabytes over a semester
+        for tens of thousands of entities. features="onehot" is a sparse CSR matrix with
+        a 1 per (entity, time_window, location) observed, so memory follows the number
+        of aggregated rows instead. Optionally the features are reduced with
+        TruncatedSVD, and clusterer="minibatch" fits MiniBatchKMeans on mini-batches
+        instead of full-batch KMeans with 10 restarts.
         """
         print("\n=== STEP 3: Build Features & Cluster Entities ===")
-        df = self.aggregated_data.copy()
+        if self.features == "onehot":
+            X = self._onehot_features()
+        else:
+            df = self.aggregated_data.copy()
+
+            # Encode locations (for pivoting)
+            df['location_encoded'] = self.location_encoder.fit_transform(df['location_id'].astype(str))
 
-        # Encode locations (for pivoting)
-        df['location_encoded'] = self.location_encoder.fit_transform(df['location_id'].astype(str))
+            # pivot: rows=entity_id, cols=time_window, values=location_encoded
+            pivot = df.pivot_table(index='entity_id', columns='time_window', values='location_encoded', aggfunc='first')
+            # Keep columns sorted
+            pivot = pivot.reindex(sorted(pivot.columns), axis=1)
+            # Fill missing with -1 to indicate absence
+            pivot = pivot.fillna(-1)
 
-        # pivot: rows=entity_id, cols=time_window, values=location_encoded
-        pivot = df.pivot_table(index='entity_id', columns='time_window', values='location_encoded', aggfunc='first')
-        # Keep columns sorted
-        pivot = pivot.reindex(sorted(pivot.columns), axis=1)
-        # Fill missing with -1 to indicate absence
-        pivot = pivot.fillna(-1)
+            self.feature_matrix = pivot  # DataFrame (index entity_id)
+            self.feature_index = pivot.index
+            self.feature_windows = pd.DatetimeIndex(pivot.columns)
+            print(f"Feature matrix shape: {pivot.shape} (entities x windows)")
+            X = pivot.values
 
-        self.feature_matrix = pivot  # DataFrame (index entity_id)
-        print(f"Feature matrix shape: {pivot.shape} (entities x windows)")
+        if self.svd_components:
+            n_components = max(1, min(self.svd_components, X.shape[1] - 1))
+            print(f"Reducing {X.shape[1]} features to {n_components} SVD components")
+            self.svd_model = TruncatedSVD(n_components=n_components, random_state=42)
+            X = self.svd_model.fit_transform(X)
+        else:
+            self.svd_model = None
 
         # clustering
-        X = pivot.values
         n_entities = X.shape[0]
         if self.n_clusters is None:
             # heuristics: #clusters = min( max(3, n_entities//12), 20)
@@ -278,14 +465,20 @@ class CampusLocationPredictor:
         else:
             n_clusters = self.n_clusters
 
-        print(f"Clustering into {n_clusters} clusters (KMeans)")
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+        if self.clusterer == "minibatch":
+            print(f"Clustering into {n_clusters} clusters (MiniBatchKMeans, batch size {self.batch_size})")
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=self.batch_size)
+        else:
+            print(f"Clustering into {n_clusters} clusters (KMeans)")
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
         labels = kmeans.fit_predict(X)
         self.kmeans_model = kmeans
 
         # entity -> cluster map
-        entity_ids = list(pivot.index)
+        entity_ids = list(self.feature_index)
         self.entity_clusters = dict(zip(entity_ids, labels))
+        self.clustered_rows = len(self.aggregated_data)
+        self.rows_since_cluster = 0
         print("Cluster distribution:")
         unique, counts = np.unique(labels, return_counts=True)
         for u, c in zip(unique, counts):
@@ -293,6 +486,34 @@ class CampusLocationPredictor:
 
         return self.entity_clusters
 
+    def _onehot_features(self) -> sparse.csr_matrix:
+        """Sparse entity x (time_window, location) indicator matrix of aggregated_data."""
+        df = self.aggregated_data
+        # Same codes as location_encoder.fit_transform, without its sort of every row
+        locations, classes = pd.factorize(df['location_id'].astype(str), sort=True)
+        self.location_encoder.fit(classes)
+        n_locations = len(classes)
+        # Sorted like the dense pivot's index and columns
+        entity_codes, self.feature_index = pd.factorize(df['entity_id'], sort=True)
+        window_codes, windows = pd.factorize(df['time_window'], sort=True)
+        self.feature_windows = pd.DatetimeIndex(windows)
+        # CSR straight from the rows grouped by entity (temporal_aggregation output already is)
+        columns = window_codes.astype(np.int64) * n_locations + locations
+        if len(entity_codes) and (np.diff(entity_codes) < 0).any():
+            order = np.argsort(entity_codes, kind='stable')
+            entity_codes, columns = entity_codes[order], columns[order]
+        indptr = np.r_[0, np.cumsum(np.bincount(entity_codes, minlength=len(self.feature_index)))]
+        index_dtype = np.int32 if len(windows) * n_locations < 2**31 else np.int64
+        X = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.float32), columns.astype(index_dtype), indptr.astype(index_dtype)),
+            shape=(len(self.feature_index), len(windows) * n_locations),
+        )
+        self.feature_matrix = X
+        mb = (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2**20
+        print(f"Feature matrix shape: {X.shape} (entities x windows*locations), "
+              f"{X.nnz:,} non-zeros, {mb:.1f} MB sparse")
+        return X
+
     # -----------------------------
     # Build probabilistic cluster x time -> location table
     # -----------------------------
@@ -305,64 +526,318 @@ class CampusLocationPredictor:
         if not self.entity_clusters:
             raise RuntimeError("Entities not clustered yet. Call build_feature_matrix_and_cluster() first.")
 
-        agg = self.aggregated_data.copy()
+        agg = self.aggregated_data[['entity_id', 'time_window', 'location_id']].copy()
         # map cluster
         agg['cluster'] = agg['entity_id'].map(self.entity_clusters)
 
         # counts per (cluster, time_window, location)
-        count_tbl = agg.groupby(['cluster', 'time_window', 'location_id']).size().reset_index(name='count')
-
-        # normalize per (cluster, time_window)
-        prob_tbl = count_tbl.groupby(['cluster', 'time_window']).apply(
-            lambda g: g.assign(prob=g['count'] / g['count'].sum())
-        ).reset_index(drop=True)
+        self.cluster_counts = agg.groupby(['cluster', 'time_window', 'location_id']).size().reset_index(name='count')
+        self._normalize_counts()
+        print("Built cluster x time x location probability table")
+        self._finish_prob_tables()
 
-        self.cluster_prob_table = prob_tbl[['cluster', 'time_window', 'location_id', 'prob']]
+    def _normalize_counts(self):
+        """cluster_prob_table (per cluster and time_window) and cluster_prior from cluster_counts."""
+        counts = self.cluster_counts
+        prob = counts['count'] / counts.groupby(['cluster', 'time_window'])['count'].transform('sum')
+        self.cluster_prob_table = counts[['cluster', 'time_window', 'location_id']].assign(prob=prob)
 
         # cluster-level prior (ignoring time)
-        cluster_prior = agg.groupby(['cluster', 'location_id']).size().reset_index(name='count')
-        cluster_prior = cluster_prior.groupby('cluster').apply(lambda g: g.assign(prob=g['count'] / g['count'].sum())).reset_index(drop=True)
+        cluster_prior = counts.groupby(['cluster', 'location_id'])['count'].sum().reset_index()
+        cluster_prior['prob'] = cluster_prior['count'] / cluster_prior.groupby('cluster')['count'].transform('sum')
         self.cluster_prior = cluster_prior[['cluster', 'location_id', 'prob']]
 
+    def _finish_prob_tables(self):
+        """Global prior, coded prob table and lookup once cluster_prob_table/cluster_prior are set."""
         # global prior
-        global_counts = agg['location_id'].value_counts(normalize=True)
+        global_counts = self.aggregated_data['location_id'].value_counts(normalize=True)
         self.global_location_prior = global_counts  # Series indexed by location_id
 
-        print("Built cluster x time x location probability table")
         print(f" - Rows in prob table: {len(self.cluster_prob_table)}")
         print(f" - Cluster priors: {len(self.cluster_prior)}")
         print(f" - Global locations: {len(self.global_location_prior)}")
+        self._encode_prob_table()
+        self._compile_lookup()
+
+    def _encode_prob_table(self):
+        """
+        Integer-coded copy of cluster_prob_table that prediction indexes into directly:
+        cluster, window and location are int32 codes into the sorted label arrays
+        'clusters', 'windows' (observed windows) and 'locations'; prob is float32.
+        Clusters include every clustered entity's cluster, even without rows.
+        """
+        prob_tbl = self.cluster_prob_table
+        clusters = np.array(sorted(set(self.entity_clusters.values()) | set(prob_tbl['cluster'].unique())))
+        cluster_idx = np.searchsorted(clusters, prob_tbl['cluster'].to_numpy()) if len(clusters) else np.empty(0, dtype=np.int64)
+        window_idx, windows = pd.factorize(prob_tbl['time_window'].values.astype('datetime64[ns]'), sort=True)
+        location_idx, locations = pd.factorize(prob_tbl['location_id'].to_numpy(object), sort=True)
+        self.prob_codes = {
+            'clusters': clusters,
+            'windows': np.asarray(windows, dtype='datetime64[ns]'),
+            'locations': np.asarray(locations, dtype=object),
+            'cluster': cluster_idx.astype(np.int32),
+            'window': window_idx.astype(np.int32),
+            'location': location_idx.astype(np.int32),
+            'prob': prob_tbl['prob'].to_numpy(np.float32),
+        }
+        mb = sum(self.prob_codes[k].nbytes for k in ('cluster', 'window', 'location', 'prob')) / 2**20
+        print(f" - Coded prob table: {len(prob_tbl)} rows, {mb:.1f} MB")
+
+    # -----------------------------
+    # Incremental updates
+    # -----------------------------
+    def update_from_events(self, events: pd.DataFrame, recluster: bool = False,
+                           drift_threshold: float = DRIFT_THRESHOLD) -> Dict:
+        """
+        Fold newly ingested events (read_events schema: entity_id, timestamp, location_id,
+        source) into the trained model instead of retraining from every CSV:
+          - their entity-windows are aggregated into aggregated_data; a window that already
+            had a row is re-aggregated together with its earlier events from recent_events,
+            or for windows older than those with the row's event_count counted as votes for
+            its modal location (sources and event_count stay exact either way)
+          - entities not clustered yet are assigned to an existing cluster with
+            kmeans_model.predict on their features in the training feature space
+          - cluster_counts loses the replaced rows and gains the new ones; the probability
+            tables, priors and lookup are rebuilt from the counts
+        All entities are re-clustered (build_feature_matrix_and_cluster) instead when
+        recluster is set or when drift, the share of aggregated rows added or changed
+        since the last clustering, exceeds drift_threshold.
+        Returns update statistics.
+        """
+        print("\n=== Incremental Update ===")
+        if not self.entity_clusters or self.kmeans_model is None:
+            raise RuntimeError("No trained model to update. Train it first or load a saved version.")
+        start = time.perf_counter()
+        events = events[['entity_id', 'timestamp', 'location_id', 'source']].dropna(subset=['entity_id', 'timestamp'])
+        stats = {'events': len(events), 'rows_added': 0, 'rows_changed': 0, 'new_entities': 0}
+        if events.empty:
+            print("No new events")
+            if not recluster:
+                return {**stats, 'drift': self.rows_since_cluster / max(self.clustered_rows, 1), 'reclustered': False,
+                        'seconds': time.perf_counter() - start}
+            delta = old = self.aggregated_data.iloc[:0]
+        else:
+            delta = self.aggregate_events(events)
+            agg = self.aggregated_data
+            keys = ['entity_id', 'time_window']
+            # rows of aggregated_data for the same (entity, window) keys
+            candidates = np.flatnonzero((agg['time_window'] >= delta['time_window'].min()).to_numpy())
+            replaced = agg.iloc[candidates][keys].assign(row=candidates).merge(delta[keys], on=keys)['row'].to_numpy()
+            old = agg.iloc[replaced]
+            if len(old):
+                delta = self.aggregate_events(pd.concat([self._earlier_events(old), events], ignore_index=True))
+            self._keep_recent_events(pd.concat([self.recent_events, events], ignore_index=True))
+            stats.update(rows_added=len(delta) - len(old), rows_changed=len(old))
+
+            new_rows = delta[~delta['entity_id'].isin(self.entity_clusters)]
+            if len(new_rows):
+                assigned = self._assign_clusters(new_rows)
+                self.entity_clusters.update(assigned)
+                stats['new_entities'] = len(assigned)
+
+            self.aggregated_data = pd.concat([agg.drop(index=agg.index[replaced]), delta], ignore_index=True)
+
+        self.rows_since_cluster += len(delta)
+        drift = self.rows_since_cluster / max(self.clustered_rows, 1)
+        print(f"{len(events):,} events -> {stats['rows_added']:,} new and {stats['rows_changed']:,} changed "
+              f"entity-windows, {stats['new_entities']:,} new entities, drift {drift:.1%}")
+
+        reclustered = recluster or drift > drift_threshold
+        if reclustered or self.cluster_counts.empty:
+            if reclustered:
+                print(f"Re-clustering all entities ({'requested' if recluster else f'drift above {drift_threshold:.0%}'})")
+                self.build_feature_matrix_and_cluster()
+            self.build_cluster_prob_table()
+        else:
+            change = pd.concat([delta[['entity_id', 'time_window', 'location_id']].assign(count=1),
+                                old[['entity_id', 'time_window', 'location_id']].assign(count=-1)])
+            change['cluster'] = change['entity_id'].map(self.entity_clusters)
+            levels = ['cluster', 'time_window', 'location_id']
+            counts = pd.concat([self.cluster_counts, change[levels + ['count']]]).groupby(levels)['count'].sum()
+            self.cluster_counts = counts[counts > 0].reset_index()
+            self._normalize_counts()
+            print("Updated cluster x time x location probability table")
+            self._finish_prob_tables()
+
+        stats.update(drift=drift, reclustered=reclustered, seconds=time.perf_counter() - start)
+        print(f"Update took {stats['seconds']:.2f}s")
+        return stats
+
+    def update_from_csv(self, data_dir, **kwargs) -> Dict:
+        """update_from_events with the event CSVs of data_dir (profiles from the training data_dir if absent)."""
+        events, _ = self.read_events(data_dir, profiles_dir=self.data_dir)
+        return self.update_from_events(events, **kwargs)
+
+    def update_from_db(self, conn=None, **kwargs) -> Dict:
+        """update_from_events with the database events newer than the model's latest event."""
+        events, _ = self.read_events_db(start=self.next_event_time(), conn=conn)
+        return self.update_from_events(events, **kwargs)
+
+    def _keep_recent_events(self, events: pd.DataFrame):
+        """Keep the events of the windows within RECENT_EVENTS_HOURS of the latest event."""
+        if events.empty:
+            return
+        since = (events['timestamp'].max() - pd.Timedelta(hours=RECENT_EVENTS_HOURS)).floor(f"{self.time_window_hours}H")
+        self.recent_events = events.loc[events['timestamp'] >= since, ['entity_id', 'timestamp', 'location_id', 'source']].reset_index(drop=True)
+        self.recent_since = since
+
+    def _earlier_events(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Events behind aggregated rows: from recent_events where kept, else _vote_events."""
+        covered = (rows['time_window'] >= self.recent_since).to_numpy() if self.recent_since is not None else np.zeros(len(rows), dtype=bool)
+        recent = self.recent_events
+        if covered.any():
+            windows = recent['timestamp'].dt.floor(f"{self.time_window_hours}H")
+            recent = recent[pd.MultiIndex.from_arrays([recent['entity_id'], windows]).isin(
+                pd.MultiIndex.from_frame(rows.loc[covered, ['entity_id', 'time_window']]))]
+        else:
+            recent = recent.iloc[:0]
+        return pd.concat([recent, self._vote_events(rows[~covered])], ignore_index=True)
+
+    @staticmethod
+    def _vote_events(rows: pd.DataFrame) -> pd.DataFrame:
+        """event_count events per aggregated row at its modal location, each of its sources at least once."""
+        counts = rows['event_count'].to_numpy(np.int64)
+        n = np.repeat(np.arange(len(rows)), counts)
+        k = np.arange(len(n)) - np.repeat(np.cumsum(counts) - counts, counts)
+        source_lists = rows['sources'].str.split(',')
+        n_sources = source_lists.str.len().to_numpy(np.int64)
+        flat = np.asarray(source_lists.explode().to_numpy(), dtype=object)
+        first_source = np.cumsum(n_sources) - n_sources
+        return pd.DataFrame({
+            'entity_id': rows['entity_id'].to_numpy(object)[n],
+            'timestamp': rows['time_window'].to_numpy()[n],
+            'location_id': rows['location_id'].to_numpy(object)[n],
+            'source': flat[first_source[n] + k % n_sources[n]],
+        })
+
+    def _assign_clusters(self, rows: pd.DataFrame) -> Dict[str, int]:
+        """
+        Clusters for the entities of aggregated rows via kmeans_model.predict, with features
+        built like build_feature_matrix_and_cluster's over the training windows and
+        locations (rows outside them carry no signal, like absent windows in training).
+        """
+        entity_codes, entities = pd.factorize(rows['entity_id'], sort=True)
+        windows = self.feature_windows.get_indexer(rows['time_window'])
+        classes = self.location_encoder.classes_
+        locations = pd.Index(classes).get_indexer(rows['location_id'].astype(str))
+        known = (windows >= 0) & (locations >= 0)
+        if self.features == "onehot":
+            X = sparse.csr_matrix(
+                (np.ones(known.sum(), dtype=np.float32),
+                 (entity_codes[known], windows[known].astype(np.int64) * len(classes) + locations[known])),
+                shape=(len(entities), len(self.feature_windows) * len(classes)),
+            )
+        else:
+            X = np.full((len(entities), len(self.feature_windows)), -1.0)
+            X[entity_codes[known], windows[known]] = locations[known]
+        if self.svd_model is not None:
+            X = self.svd_model.transform(X)
+        return dict(zip(entities, self.kmeans_model.predict(X)))
+
+    # -----------------------------
+    # Compiled lookup structures
+    # -----------------------------
+    def _compile_lookup(self):
+        """
+        Compile the trained tables into array lookups used by predict_location:
+          - windows live on a regular grid (window_hours apart); grid_to_obs maps a grid
+            position to its row in `prob` or -1 for windows never observed
+          - actual data: sorted int64 keys entity_code * n_grid + grid position, with the
+            location and sources of each key as int32 codes into small label arrays
+          - prob: dense float32 (cluster x observed window x location) p(location | cluster, window)
+            scattered from prob_codes, locations in sorted order so argmax breaks ties like
+            the old sort did
+          - top cluster prior per cluster and the global prior
+        """
+        step = pd.Timedelta(hours=self.time_window_hours).value
+        agg = self.aggregated_data
+        if self.prob_codes is None:
+            self._encode_prob_table()
+        codes = self.prob_codes
+        obs_windows = codes['windows']
+        if not len(obs_windows):
+            obs_windows = np.sort(pd.unique(agg['time_window'].values.astype('datetime64[ns]')))
+        agg_windows = agg['time_window'].values.astype('datetime64[ns]').astype(np.int64)
+
+        # window grid spanning every observed and aggregated window
+        lookup = {'step': step, 'n_grid': 0, 'window0': 0, 'grid_to_obs': np.empty(0, dtype=np.int32)}
+        all_windows = np.concatenate([obs_windows.astype(np.int64), agg_windows])
+        if len(all_windows):
+            window0 = int(all_windows.min())
+            n_grid = int((all_windows.max() - window0) // step) + 1
+            grid_to_obs = np.full(n_grid, -1, dtype=np.int32)
+            grid_to_obs[(obs_windows.astype(np.int64) - window0) // step] = np.arange(len(obs_windows), dtype=np.int32)
+            lookup.update(n_grid=n_grid, window0=window0, grid_to_obs=grid_to_obs)
+
+        # actual (entity, window) -> location/sources; the stable sort keeps the first row per key first
+        entity_codes = {e: i for i, e in enumerate(pd.unique(agg['entity_id']))}
+        keys = agg['entity_id'].map(entity_codes).to_numpy(np.int64) * lookup['n_grid'] + (agg_windows - lookup['window0']) // step
+        order = np.argsort(keys, kind='stable')
+        location_codes, location_labels = pd.factorize(agg['location_id'], use_na_sentinel=False)
+        source_codes, source_labels = pd.factorize(agg['sources'], use_na_sentinel=False)
+        lookup.update(
+            entity_codes=entity_codes,
+            actual_keys=keys[order],
+            actual_location=location_codes.astype(np.int32)[order],
+            actual_location_labels=np.asarray(location_labels, dtype=object),
+            actual_sources=source_codes.astype(np.int32)[order],
+            actual_source_labels=np.asarray(source_labels, dtype=object),
+        )
+
+        # dense p(location | cluster, window)
+        locations = codes['locations']
+        cluster_codes = {c: i for i, c in enumerate(codes['clusters'])}
+        prob = np.zeros((len(cluster_codes), len(obs_windows), len(locations)), dtype=np.float32)
+        prob[codes['cluster'], codes['window'], codes['location']] = codes['prob']
+        lookup.update(locations=locations, cluster_codes=cluster_codes, prob=prob, has_prob=prob.any(axis=2))
+
+        # priors, picked exactly as the per-call fallbacks pick them
+        cluster_top = {}
+        for c, cp in self.cluster_prior.groupby('cluster', sort=False):
+            top = cp.sort_values('prob', ascending=False).iloc[0]
+            cluster_top[c] = (top['location_id'], float(top['prob']))
+        lookup['cluster_top'] = cluster_top
+        if len(self.global_location_prior) > 0:
+            lookup['global_top'] = (self.global_location_prior.index[0], float(self.global_location_prior.iloc[0]))
+        else:
+            lookup['global_top'] = None
+        self._lookup = lookup
 
     # -----------------------------
     # Utility: nearby windows & decay
     # -----------------------------
+    def _nearby_positions(self, grid_pos: int) -> np.ndarray:
+        """
+        Grid positions within radius self.nearby_window_radius of grid_pos that were
+        observed in the data (so we do not invent windows).
+        """
+        lookup = self._lookup
+        positions = grid_pos + np.arange(-self.nearby_window_radius, self.nearby_window_radius + 1)
+        positions = positions[(positions >= 0) & (positions < lookup['n_grid'])]
+        return positions[lookup['grid_to_obs'][positions] >= 0]
+
     def _nearby_windows(self, target: pd.Timestamp) -> List[pd.Timestamp]:
         """
         Returns list of nearby time_window timestamps within radius self.nearby_window_radius
         centered at target, restricted to windows observed in data (so we do not invent windows).
         """
-        observed = sorted(self.cluster_prob_table['time_window'].unique()) if not self.cluster_prob_table.empty else sorted(self.aggregated_data['time_window'].unique())
-        if len(observed) == 0:
-            return []
-        # generate candidate windows by shifting target by multiples of time_window_hours
-        windows = []
-        for r in range(-self.nearby_window_radius, self.nearby_window_radius + 1):
-            w = target + pd.Timedelta(hours=r * self.time_window_hours)
-            # include if w is close to an observed window (exact match on floor representation)
-            # we only include if w exists in observed windows (avoid predicting outside observed schedule)
-            if w in observed:
-                windows.append(w)
-        return windows
-
-    def _decay_weight(self, hours_diff: float) -> float:
-        """
-        Exponential decay weight based on hours difference.
+        if self._lookup is None:
+            self._compile_lookup()
+        lookup = self._lookup
+        grid_pos = (pd.Timestamp(target).value - lookup['window0']) // lookup['step']
+        return [pd.Timestamp(lookup['window0'] + int(p) * lookup['step']) for p in self._nearby_positions(grid_pos)]
+
+    def _decay_weight(self, hours_diff):
+        """
+        Exponential decay weight based on hours difference (scalar or array).
         We express decay via half-life: w = 0.5 ** (hours_diff / half_life)
         """
-        h = abs(float(hours_diff))
+        h = np.abs(np.asarray(hours_diff, dtype=np.float64))
         if self.decay_half_life_hours <= 0:
-            return 1.0 if h == 0 else 0.0
-        return 0.5 ** (h / self.decay_half_life_hours)
+            w = np.where(h == 0, 1.0, 0.0)
+        else:
+            w = 0.5 ** (h / self.decay_half_life_hours)
+        return float(w) if w.ndim == 0 else w
 
     # -----------------------------
     # Prediction API
@@ -377,90 +852,316 @@ class CampusLocationPredictor:
           - method (str): 'actual_data', 'probabilistic_generalization', 'cluster_prior', 'global_prior', 'entity_not_found', 'no_data'
           - details: optional extra info
         """
-        ts = pd.to_datetime(timestamp)
-        time_window = ts.floor(f"{self.time_window_hours}H")
+        if self._lookup is None:
+            self._compile_lookup()
+        lookup = self._lookup
+        # Timestamp() parses ISO strings far faster than to_datetime(); flooring on the
+        # int64 value is what Timestamp.floor does for naive timestamps
+        ts = pd.Timestamp(timestamp)
+        grid_pos = ((ts.value // lookup['step']) * lookup['step'] - lookup['window0']) // lookup['step']
+        n_grid = lookup['n_grid']
 
         # 1) If entity has actual data in that window -> return actual w/ confidence 1.0
-        existing = self.aggregated_data[
-            (self.aggregated_data['entity_id'] == entity_id) & (self.aggregated_data['time_window'] == time_window)
-        ]
-        if len(existing) > 0:
-            actual_loc = existing.iloc[0]['location_id']
-            return {'predicted_location': actual_loc, 'confidence': 1.0, 'cluster': self.entity_clusters.get(entity_id, -1), 'method': 'actual_data', 'details': {'source': existing.iloc[0]['sources']}}
+        code = lookup['entity_codes'].get(entity_id)
+        if code is not None and 0 <= grid_pos < n_grid:
+            key = code * n_grid + grid_pos
+            i = np.searchsorted(lookup['actual_keys'], key)
+            if i < len(lookup['actual_keys']) and lookup['actual_keys'][i] == key:
+                location = lookup['actual_location_labels'][lookup['actual_location'][i]]
+                source = lookup['actual_source_labels'][lookup['actual_sources'][i]]
+                return {'predicted_location': location, 'confidence': 1.0, 'cluster': self.entity_clusters.get(entity_id, -1), 'method': 'actual_data', 'details': {'source': source}}
 
         # 2) If entity not in cluster map -> handle
         cluster_id = self.entity_clusters.get(entity_id)
         if cluster_id is None:
             return {'predicted_location': None, 'confidence': 0.0, 'cluster': -1, 'method': 'entity_not_found', 'details': {}}
 
-        # 3) Look up exact (cluster, time_window) distribution
-        probs = self.cluster_prob_table[
-            (self.cluster_prob_table['cluster'] == cluster_id) &
-            (self.cluster_prob_table['time_window'] == time_window)
-        ].copy()
-
-        # 4) If no exact data, aggregate nearby windows with decay
-        if probs.empty:
-            nearby = self._nearby_windows(time_window)
-            if len(nearby) == 0:
-                probs = pd.DataFrame()  # remain empty
-            else:
-                parts = []
-                for w in nearby:
-                    sub = self.cluster_prob_table[
-                        (self.cluster_prob_table['cluster'] == cluster_id) &
-                        (self.cluster_prob_table['time_window'] == w)
-                    ].copy()
-                    if sub.empty:
-                        continue
-                    hours_diff = (w - time_window).total_seconds() / 3600.0
-                    weight = self._decay_weight(hours_diff)
-                    sub['weighted_prob'] = sub['prob'] * weight
-                    parts.append(sub[['location_id', 'weighted_prob']])
-                if len(parts) > 0:
-                    all_parts = pd.concat(parts, ignore_index=True)
-                    agg = all_parts.groupby('location_id')['weighted_prob'].sum().reset_index(name='score')
-                    total = agg['score'].sum()
-                    if total > 0:
-                        agg['prob'] = agg['score'] / total
-                    else:
-                        agg['prob'] = 0.0
-                    probs = agg[['location_id', 'prob']].copy()
-                else:
-                    probs = pd.DataFrame()
+        # 3-8) distribution of the entity's cluster in that window
+        return self._window_prediction(cluster_id, grid_pos)
+
+    def _window_prediction(self, cluster_id, grid_pos: int) -> Dict:
+        """
+        Steps 3-8 of predict_location, which depend only on the cluster and the window's
+        grid position: exact window, nearby windows with decay, cluster prior, global prior.
+        """
+        lookup = self._lookup
+        n_grid = lookup['n_grid']
+
+        # 3) Exact (cluster, time_window) distribution, else 4) nearby windows with decay
+        probs = None
+        c = lookup['cluster_codes'].get(cluster_id)
+        nearby = self._nearby_positions(grid_pos)
+        if c is not None:
+            w = lookup['grid_to_obs'][grid_pos] if 0 <= grid_pos < n_grid else -1
+            if w >= 0 and lookup['has_prob'][c, w]:
+                probs = lookup['prob'][c, w].astype(np.float64)
+                present = probs > 0
+            elif len(nearby) > 0:
+                nearby_rows = lookup['grid_to_obs'][nearby]
+                with_data = lookup['has_prob'][c, nearby_rows]
+                if with_data.any():
+                    # one (windows x locations) slice weighted by decay in a single dot product
+                    block = lookup['prob'][c, nearby_rows[with_data]]
+                    hours_diff = (nearby[with_data] - grid_pos) * self.time_window_hours
+                    scores = self._decay_weight(hours_diff) @ block
+                    total = scores.sum()
+                    probs = scores / total if total > 0 else np.zeros_like(scores)
+                    # only locations seen in these windows are candidates, even at score 0
+                    present = (block > 0).any(axis=0)
 
         # 5) If we obtained probability estimates, pick top
-        if (not probs.empty) and ('prob' in probs.columns):
+        if probs is not None:
+            candidates = present.nonzero()[0]
+            values = probs[candidates]
             # Normalize just in case
-            probs = probs.groupby('location_id', as_index=False)['prob'].sum()
-            if probs['prob'].sum() > 0:
-                probs['prob'] = probs['prob'] / probs['prob'].sum()
-            probs = probs.sort_values('prob', ascending=False).reset_index(drop=True)
-            top = probs.iloc[0]
+            if values.sum() > 0:
+                values = values / values.sum()
+            # Same ordering as sort_values('prob', ascending=False) so ties resolve identically
+            top = candidates[::-1][values[::-1].argsort(kind='quicksort')][::-1][0]
             return {
-                'predicted_location': top['location_id'],
-                'confidence': float(top['prob']),
+                'predicted_location': lookup['locations'][top],
+                'confidence': float(values[candidates == top][0]),
                 'cluster': cluster_id,
                 'method': 'probabilistic_generalization',
-                'details': {'considered_windows': self._nearby_windows(time_window)}
+                'details': {'considered_windows': [pd.Timestamp(lookup['window0'] + int(p) * lookup['step']) for p in nearby]}
             }
 
         # 6) fallback to cluster-level prior (no time)
-        cp = self.cluster_prior[self.cluster_prior['cluster'] == cluster_id].copy()
-        if len(cp) > 0:
-            cp = cp.sort_values('prob', ascending=False).reset_index(drop=True)
-            top = cp.iloc[0]
-            return {'predicted_location': top['location_id'], 'confidence': float(top['prob']), 'cluster': cluster_id, 'method': 'cluster_prior', 'details': {}}
+        if cluster_id in lookup['cluster_top']:
+            top_loc, top_prob = lookup['cluster_top'][cluster_id]
+            return {'predicted_location': top_loc, 'confidence': top_prob, 'cluster': cluster_id, 'method': 'cluster_prior', 'details': {}}
 
         # 7) fallback to global prior
-        if len(self.global_location_prior) > 0:
-            top_loc = self.global_location_prior.index[0]
-            top_prob = float(self.global_location_prior.iloc[0])
+        if lookup['global_top'] is not None:
+            top_loc, top_prob = lookup['global_top']
             return {'predicted_location': top_loc, 'confidence': top_prob * 0.5, 'cluster': cluster_id, 'method': 'global_prior', 'details': {}}
 
         # 8) give up
         return {'predicted_location': None, 'confidence': 0.0, 'cluster': cluster_id, 'method': 'no_data', 'details': {}}
 
+    def predict_batch(self, entity_ids, timestamps, with_details: bool = False) -> pd.DataFrame:
+        """
+        predict_location for many (entity_id, timestamp) pairs; row i of the result equals
+        predict_location(entity_ids[i], timestamps[i]).
+        The actual-data lookup and entity checks run over whole arrays and the rest of the
+        cascade is evaluated once per distinct (cluster, time window) pair.
+        Returns a DataFrame with entity_id, timestamp, predicted_location, confidence,
+        cluster, method (and details if with_details).
+        """
+        if self._lookup is None:
+            self._compile_lookup()
+        lookup = self._lookup
+        step, n_grid = lookup['step'], lookup['n_grid']
+        entities = pd.Series(np.asarray(entity_ids, dtype=object))
+        ts = pd.Series(timestamps)
+        if not pd.api.types.is_datetime64_any_dtype(ts):
+            ts = pd.Series([pd.Timestamp(t) for t in ts], dtype='datetime64[ns]')
+        ts = ts.astype('datetime64[ns]')
+        grid_pos = (ts.to_numpy().view(np.int64) // step) * step
+        grid_pos = (grid_pos - lookup['window0']) // step
+        n = len(entities)
+
+        predicted = np.full(n, None, dtype=object)
+        confidence = np.zeros(n, dtype=np.float64)
+        cluster = np.full(n, -1, dtype=object)
+        method = np.full(n, 'entity_not_found', dtype=object)
+        details = np.empty(n, dtype=object)
+        if with_details:
+            details[:] = [{} for _ in range(n)]
+
+        # cluster of each row's entity as stored in entity_clusters (-1 when unknown)
+        cluster_ids = list(self.entity_clusters.values())
+        entity_pos = pd.Index(list(self.entity_clusters)).get_indexer(entities)
+        known = entity_pos >= 0
+        row_cluster = np.array(cluster_ids + [-1], dtype=object)[entity_pos]
+        row_cluster_code = np.array([lookup['cluster_codes'][c] for c in cluster_ids] + [-1], dtype=np.int64)[entity_pos]
+        cluster[:] = row_cluster
+
+        # 1) actual data in that window
+        keys = lookup['actual_keys']
+        codes = entities.map(lookup['entity_codes'])
+        actual = codes.notna().to_numpy() & (grid_pos >= 0) & (grid_pos < n_grid)
+        if len(keys) and actual.any():
+            key = codes.fillna(0).to_numpy(np.int64) * n_grid + grid_pos
+            i = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            actual &= keys[i] == key
+            i = i[actual]
+            predicted[actual] = lookup['actual_location_labels'][lookup['actual_location'][i]]
+            confidence[actual] = 1.0
+            method[actual] = 'actual_data'
+            if with_details:
+                details[actual] = [{'source': s} for s in lookup['actual_source_labels'][lookup['actual_sources'][i]]]
+        else:
+            actual[:] = False
+
+        # 2) unknown entities keep the entity_not_found defaults; 3-8) once per (cluster, window)
+        rest = (known & ~actual).nonzero()[0]
+        if len(rest):
+            _, first, inverse = np.unique(
+                np.stack([row_cluster_code[rest], grid_pos[rest]]), axis=1, return_index=True, return_inverse=True
+            )
+            results = [self._window_prediction(row_cluster[rest[j]], int(grid_pos[rest[j]])) for j in first]
+            inverse = inverse.ravel()
+            predicted[rest] = np.array([r['predicted_location'] for r in results], dtype=object)[inverse]
+            confidence[rest] = np.array([r['confidence'] for r in results], dtype=np.float64)[inverse]
+            method[rest] = np.array([r['method'] for r in results], dtype=object)[inverse]
+            if with_details:
+                pair_details = np.empty(len(results), dtype=object)
+                pair_details[:] = [r['details'] for r in results]
+                details[rest] = pair_details[inverse]
+
+        out = pd.DataFrame({
+            'entity_id': entities,
+            'timestamp': ts,
+            'predicted_location': predicted,
+            'confidence': confidence,
+            'cluster': pd.Series(cluster).infer_objects(),
+            'method': method,
+        })
+        if with_details:
+            out['details'] = details
+        return out
+
+    def score_observations(self, entity_ids, timestamps, location_ids) -> pd.DataFrame:
+        """
+        Probability of observed (entity, timestamp, location) rows under the model:
+        p(location | entity's cluster, time window), found like predict_location finds a
+        distribution (exact window, else nearby windows with decay, else cluster prior,
+        else global prior) and read at the observed location instead of the top one.
+        A location the model never saw scores 0.
+
+        Windows after the last one the model knows are looked up at the same time of day
+        on its last day (method 'previous_day_window'), so a fresh day of events is scored
+        against the routine the model learned rather than only the time-agnostic prior.
+        Everything runs over whole arrays, one pass per nearby-window offset.
+        Returns entity_id, time_window, location_id, cluster, probability (NaN for
+        unknown entities), method.
+        """
+        if self._lookup is None:
+            self._compile_lookup()
+        lookup = self._lookup
+        step, n_grid = lookup['step'], lookup['n_grid']
+        entities = np.asarray(entity_ids, dtype=object)
+        ts = pd.Series(timestamps)
+        if not pd.api.types.is_datetime64_any_dtype(ts):
+            ts = pd.Series([pd.Timestamp(t) for t in ts], dtype='datetime64[ns]')
+        window = (ts.astype('datetime64[ns]').to_numpy().view(np.int64) // step) * step
+        grid_pos = (window - lookup['window0']) // step
+        location_ids = pd.Series(location_ids, dtype=object).astype(str)
+        loc = pd.Index(lookup['locations']).get_indexer(location_ids)
+        n = len(entities)
+
+        probability = np.full(n, np.nan)
+        method = np.full(n, 'entity_not_found', dtype=object)
+        cluster_ids = list(self.entity_clusters.values())
+        entity_pos = pd.Index(list(self.entity_clusters)).get_indexer(entities)
+        cluster = np.array(cluster_ids + [-1], dtype=object)[entity_pos]
+        codes = lookup['cluster_codes']
+        c = np.array([codes.get(k, -1) for k in cluster_ids] + [-1], dtype=np.int64)[entity_pos]
+        pending = entity_pos >= 0
+
+        # windows past the grid: same time of day on the model's last day
+        per_day = pd.Timedelta(days=1).value // step if pd.Timedelta(days=1).value % step == 0 else 0
+        shifted = pending & (grid_pos >= n_grid) & (per_day > 0)
+        if shifted.any():
+            days_back = -((n_grid - 1 - grid_pos[shifted]) // per_day)
+            grid_pos = grid_pos.copy()
+            grid_pos[shifted] -= days_back * per_day
+
+        prob, has_prob, grid_to_obs = lookup['prob'], lookup['has_prob'], lookup['grid_to_obs']
+        seen = loc >= 0
+        safe_loc = np.where(seen, loc, 0)
+
+        def observed(positions, rows):
+            """Row in prob of each grid position (-1 outside the grid or unobserved), for rows with data."""
+            inside = rows & (c >= 0) & (positions >= 0) & (positions < n_grid)
+            obs = np.full(n, -1, dtype=np.int64)
+            obs[inside] = grid_to_obs[positions[inside]]
+            ok = obs >= 0
+            ok[ok] = has_prob[c[ok], obs[ok]]
+            return obs, ok
+
+        # 3) exact (cluster, window)
+        obs, exact = observed(grid_pos, pending)
+        probability[exact] = np.where(seen[exact], prob[c[exact], obs[exact], safe_loc[exact]], 0.0)
+        pending &= ~exact
+
+        # 4) nearby windows, decay weighted: sum_w weight * p(loc | w) / sum_w weight * sum(p(. | w))
+        if pending.any():
+            num, den = np.zeros(n), np.zeros(n)
+            any_window = np.zeros(n, dtype=bool)
+            for offset in range(-self.nearby_window_radius, self.nearby_window_radius + 1):
+                obs, ok = observed(grid_pos + offset, pending)
+                if not ok.any():
+                    continue
+                weight = self._decay_weight(offset * self.time_window_hours)
+                rows = ok.nonzero()[0]
+                block = prob[c[rows], obs[rows]].astype(np.float64)
+                num[rows] += weight * np.where(seen[rows], block[np.arange(len(rows)), safe_loc[rows]], 0.0)
+                den[rows] += weight * block.sum(axis=1)
+                any_window |= ok
+            probability[any_window] = np.divide(num[any_window], den[any_window], out=np.zeros(any_window.sum()),
+                                                where=den[any_window] > 0)
+            nearby = any_window
+            pending &= ~nearby
+        else:
+            nearby = np.zeros(n, dtype=bool)
+        method[exact | nearby] = 'probabilistic_generalization'
+        method[(exact | nearby) & shifted] = 'previous_day_window'
+
+        # 6) cluster prior (no time)
+        prior = self.cluster_prior
+        in_prior = pending & pd.Series(cluster, dtype=object).isin(set(prior['cluster'])).to_numpy()
+        if in_prior.any():
+            prior_prob = pd.Series(prior['prob'].to_numpy(), index=pd.MultiIndex.from_arrays(
+                [prior['cluster'].to_numpy(object), prior['location_id'].to_numpy(object)]))
+            keys = pd.MultiIndex.from_arrays([cluster[in_prior], location_ids.to_numpy(object)[in_prior]])
+            probability[in_prior] = prior_prob.reindex(keys).fillna(0.0).to_numpy()
+            method[in_prior] = 'cluster_prior'
+            pending &= ~in_prior
+
+        # 7) global prior, 8) no data
+        if pending.any():
+            if len(self.global_location_prior) > 0:
+                probability[pending] = self.global_location_prior.reindex(location_ids[pending]).fillna(0.0).to_numpy()
+                method[pending] = 'global_prior'
+            else:
+                method[pending] = 'no_data'
+
+        return pd.DataFrame({
+            'entity_id': entities,
+            'time_window': pd.to_datetime(window),
+            'location_id': location_ids.to_numpy(object),
+            'cluster': pd.Series(cluster).infer_objects(),
+            'probability': probability,
+            'method': method,
+        })
+
+    def benchmark_predictions(self, n: int = 100_000, seed: int = 0) -> float:
+        """
+        Time predict_location on n random (entity, timestamp) queries drawn over the trained
+        entities and data range (plus unknown entities); prints and returns predictions/sec.
+        """
+        rng = np.random.default_rng(seed)
+        entities = np.array(list(self.entity_clusters) + ['__unknown__'], dtype=object)
+        start = self.aggregated_data['time_window'].min()
+        span = (self.aggregated_data['time_window'].max() - start).total_seconds() + self.time_window_hours * 3600
+        queries = [
+            (entities[e], (start + pd.Timedelta(seconds=int(s))).isoformat())
+            for e, s in zip(rng.integers(0, len(entities), size=n), rng.integers(0, int(span), size=n))
+        ]
+        self.predict_location(*queries[0])  # compile outside the timed loop
+        methods = {}
+        t0 = time.perf_counter()
+        for entity_id, timestamp in queries:
+            method = self.predict_location(entity_id, timestamp)['method']
+            methods[method] = methods.get(method, 0) + 1
+        elapsed = time.perf_counter() - t0
+        rate = n / elapsed
+        print(f"predict_location: {n} predictions in {elapsed:.2f}s = {rate:,.0f}/s ({elapsed / n * 1e6:.1f} us each)")
+        print(f" - methods: {methods}")
+        return rate
+
     # -----------------------------
     # Bulk predictions generation
     # -----------------------------
@@ -476,24 +1177,21 @@ class CampusLocationPredictor:
         else:
             windows = all_windows
 
-        entities = list(self.entity_clusters.keys())
-        existing_pairs = set(zip(self.aggregated_data['entity_id'], self.aggregated_data['time_window']))
+        entities = np.array(list(self.entity_clusters.keys()), dtype=object)
+        windows = np.array(windows, dtype='datetime64[ns]')
 
+        # entity x window grid in entity-major order, predicted in batches of ~1M pairs;
+        # pairs with actual data are exactly the ones predict_batch answers with actual_data
         preds = []
-        for ent in entities:
-            for w in windows:
-                if (ent, w) in existing_pairs:
-                    continue
-                r = self.predict_location(ent, w.isoformat())
-                preds.append({
-                    'entity_id': ent,
-                    'time_window': w,
-                    'predicted_location': r['predicted_location'],
-                    'confidence': r['confidence'],
-                    'cluster': r['cluster'],
-                    'method': r['method']
-                })
-        df = pd.DataFrame(preds)
+        per_batch = max(1, 1_000_000 // max(len(windows), 1))
+        for start in range(0, len(entities), per_batch):
+            batch = entities[start:start + per_batch]
+            p = self.predict_batch(np.repeat(batch, len(windows)), np.tile(windows, len(batch)))
+            preds.append(p[p['method'] != 'actual_data'])
+        df = pd.concat(preds, ignore_index=True) if preds else pd.DataFrame(
+            columns=['entity_id', 'timestamp', 'predicted_location', 'confidence', 'cluster', 'method']
+        )
+        df = df.rename(columns={'timestamp': 'time_window'})
         print(f"Generated {len(df)} predictions")
         return df
 
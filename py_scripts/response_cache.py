@@ -0,0 +1,129 @@
+"""
+Bounded in-memory cache for API responses.
+
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full. Each entry carries tags (the entity_ids it was built from)
+so the ingest pipeline can drop exactly the responses for entities it loaded
+new data for.
+
+Every invalidation bumps a generation counter. A caller takes generation()
+before reading the database and passes it to set(), which drops the write if
+an invalidation happened in between, so a response built from pre-ingest rows
+is never cached after the ingest's invalidation.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+# Shared secret db_insert.py sends to the API's /cache/invalidate; unset, only local clients may call it
+INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN", "")
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl_seconds: float = CACHE_TTL_SECONDS):
+        """
+        Args:
+            max_entries: entries kept before the least recently used one is evicted (0 disables caching)
+            ttl_seconds: seconds an entry is served before it is recomputed
+        """
+        self.max_entries = int(max_entries)
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries = OrderedDict()   # key -> (expires_at, tags, value)
+        self._tags = {}                 # tag -> set of keys
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_writes = 0
+
+    def generation(self):
+        """Counter bumped by every invalidate()/clear(); pass it to set() for a value read after this call."""
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, tags=(), generation=None):
+        """Cache value under key, unless an invalidation happened since generation (if given)."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self.stale_writes += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, tuple(tags), value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        """Drop every entry tagged with any of tags; returns the number of entries dropped."""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self._generation += 1
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+            self._generation += 1
+            self.invalidations += dropped
+            return dropped
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_writes": self.stale_writes,
+            }
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
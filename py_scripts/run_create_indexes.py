@@ -2,6 +2,7 @@ import psycopg2
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from partitions import index_partitions
 
 load_dotenv()
 
@@ -35,6 +36,10 @@ def main():
     try:
         # Connect and create indexes
         conn = psycopg2.connect(**DB_CONFIG)
+        # Partitioned event tables are indexed one partition at a time first
+        built = index_partitions(conn, sql_content)
+        if built:
+            print(f"{built} partition indexes built.")
         cursor = conn.cursor()
         
         cursor.execute(sql_content)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules under test are flat scripts in py_scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,71 @@
+"""AlertEngine reads against the entity_last_activity triggers of a scratch schema (needs the Postgres of .env)."""
+import asyncio
+from datetime import datetime, timedelta
+import asyncpg
+import psycopg2
+import pytest
+import bench_utils
+import get_info_async
+from alert_engine import AlertEngine
+
+SCHEMA = "test_alert_engine"
+NOW = datetime(2025, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def connections():
+    """Two connections to a fresh scratch schema with profiles E1 (card C1) and E2 (card C2)."""
+    try:
+        first = bench_utils.scratch_connection(SCHEMA)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    second = bench_utils.scratch_connection(SCHEMA)
+    try:
+        bench_utils.create_scratch_schema(first, SCHEMA)
+        cur = first.cursor()
+        cur.execute("INSERT INTO student_or_staff_profiles (entity_id, name, card_id) "
+                    "VALUES ('E1', 'One', 'C1'), ('E2', 'Two', 'C2')")
+        first.commit()
+        yield first, second
+    finally:
+        second.rollback()
+        second.close()
+        bench_utils.drop_scratch_schema(first, SCHEMA)
+        first.close()
+
+
+def swipe(conn, card_id, at):
+    conn.cursor().execute("INSERT INTO campus_card_swipes (card_id, location_id, timestamp) VALUES (%s, 'L', %s)",
+                          (card_id, at))
+
+
+def test_load_committing_after_a_higher_seq_is_read(connections):
+    first, second = connections
+
+    async def run():
+        engine = AlertEngine(get_info_async.DB_MAIN, hours=1, clock=lambda: NOW)
+        conn = await asyncpg.connect(**{**get_info_async.DB_MAIN, "server_settings": {"search_path": SCHEMA}})
+        try:
+            await engine.refresh(conn)
+            assert engine.inactive == {"E1", "E2"}
+
+            # first takes the lower seq but commits after second
+            swipe(first, "C1", NOW - timedelta(minutes=5))
+            swipe(second, "C2", NOW - timedelta(minutes=10))
+            second.commit()
+            await engine.refresh(conn)
+            assert engine.inactive == {"E1"}
+
+            first.commit()
+            await engine.refresh(conn)
+            assert engine.inactive == set()
+            assert engine.profiles["E1"]["last_activity"] == NOW - timedelta(minutes=5)
+
+            # rows read twice are applied once
+            transitions = engine.transitions
+            await engine.refresh(conn)
+            assert engine.transitions == transitions == 2
+        finally:
+            await conn.close()
+
+    asyncio.run(run())
@@ -0,0 +1,55 @@
+"""build_cluster_prob_table against the groupby-apply version it replaced (bench_prob_table.legacy_prob_tables)."""
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from bench_prob_table import legacy_prob_tables
+from prediction_pipeline import CampusLocationPredictor
+
+# the reference is kept verbatim, deprecated groupby-apply included
+pytestmark = pytest.mark.filterwarnings("ignore::FutureWarning")
+
+
+@pytest.fixture
+def predictor():
+    """A few hundred aggregated rows: 40 entities in 4 clusters over 12 windows and 7 locations."""
+    rng = np.random.default_rng(0)
+    n = 400
+    entities = [f"E{i:03d}" for i in range(40)]
+    model = CampusLocationPredictor()
+    model.aggregated_data = pd.DataFrame({
+        'entity_id': rng.choice(entities, n),
+        'time_window': pd.Timestamp("2024-01-01") + pd.to_timedelta(2 * rng.integers(0, 12, n), unit="h"),
+        'location_id': rng.choice([f"LOC{i}" for i in range(7)], n),
+        'sources': "swipe",
+        'event_count': rng.integers(1, 5, n),
+    }).drop_duplicates(['entity_id', 'time_window']).reset_index(drop=True)
+    model.entity_clusters = {e: np.int32(i % 4) for i, e in enumerate(entities)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.build_cluster_prob_table()
+    return model
+
+
+def test_tables_match_groupby_apply(predictor):
+    legacy_table, legacy_prior = legacy_prob_tables(predictor)
+    assert len(legacy_table) > 100
+    pd.testing.assert_frame_equal(predictor.cluster_prob_table, legacy_table, check_exact=True)
+    pd.testing.assert_frame_equal(predictor.cluster_prior, legacy_prior, check_exact=True)
+
+
+def test_prob_codes_decode_to_float32_table(predictor):
+    legacy_table, _ = legacy_prob_tables(predictor)
+    codes = predictor.prob_codes
+    np.testing.assert_array_equal(codes['clusters'][codes['cluster']], legacy_table['cluster'].to_numpy())
+    np.testing.assert_array_equal(codes['windows'][codes['window']],
+                                  legacy_table['time_window'].values.astype('datetime64[ns]'))
+    np.testing.assert_array_equal(codes['locations'][codes['location']], legacy_table['location_id'].to_numpy(object))
+    assert codes['prob'].dtype == np.float32
+    np.testing.assert_array_equal(codes['prob'], legacy_table['prob'].to_numpy(np.float32))
+
+
+def test_lookup_holds_the_coded_probs(predictor):
+    codes, lookup = predictor.prob_codes, predictor._lookup
+    np.testing.assert_array_equal(lookup['prob'][codes['cluster'], codes['window'], codes['location']], codes['prob'])
+    assert np.count_nonzero(lookup['prob']) == len(codes['prob'])
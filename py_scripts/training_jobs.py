@@ -0,0 +1,284 @@
+"""
+Background training jobs for the location predictor.
+
+Each job trains a CampusLocationPredictor in its own worker process (so the
+API's request threads never contend with it for the GIL) and saves it as an
+unpublished model version. A "train" job trains from scratch; an "update" job
+loads the latest version and folds newly ingested events into it, from a
+directory of CSVs or the database rows after its latest event. The worker
+reports every stage over a pipe; the API reads the reports into per-stage
+progress and timings.
+
+ - at most MAX_WORKERS jobs run at once, the rest wait in FIFO order
+ - a job for a parameter set that is already queued or running is not
+   started again; submit() returns the existing job instead
+ - cancel() drops a queued job or terminates a running worker
+ - when a worker has saved its model, on_done(job) is called in the API
+   process (main.py loads, swaps in and publishes the new version)
+"""
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Training processes running at once; further jobs are queued
+MAX_WORKERS = int(os.getenv("TRAINING_MAX_WORKERS", "1"))
+
+# Finished jobs kept for GET /train/{id}
+KEEP_FINISHED = 100
+
+# Stages reported by the worker per job kind, in order
+STAGES = {
+    "train": (
+        "load_and_integrate_data",
+        "temporal_aggregation",
+        "build_feature_matrix_and_cluster",
+        "build_cluster_prob_table",
+        "save_model",
+    ),
+    "update": (
+        "load_model",
+        "read_events",
+        "update_from_events",
+        "save_model",
+    ),
+}
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+# ---------- WORKER PROCESS ----------
+def _train_worker(kind, params, model_dir, conn):
+    """Runs in the worker process: train or update, save unpublished, report over conn."""
+    try:
+        import model_store
+        from prediction_pipeline import CampusLocationPredictor
+
+        if kind == "update":
+            params = dict(params)
+            delta_dir, source = params.pop("data_dir", None), params.pop("source", "csv")
+            state = {}
+
+            def read_events():
+                model = state["model"]
+                if source == "db":
+                    state["events"] = model.read_events_db(start=model.next_event_time())[0]
+                else:
+                    state["events"] = model.read_events(delta_dir, profiles_dir=model.data_dir)[0]
+
+            steps = {
+                "load_model": lambda: state.update(model=model_store.load_model(model_dir=model_dir, mmap=False, tables=True)),
+                "read_events": read_events,
+                "update_from_events": lambda: state["model"].update_from_events(state.pop("events"), **params),
+                "save_model": lambda: model_store.save_model(state["model"], model_dir=model_dir, publish=False),
+            }
+        else:
+            model = CampusLocationPredictor(**params)
+            steps = {
+                "load_and_integrate_data": model.load_and_integrate_data,
+                "temporal_aggregation": model.temporal_aggregation,
+                "build_feature_matrix_and_cluster": model.build_feature_matrix_and_cluster,
+                "build_cluster_prob_table": model.build_cluster_prob_table,
+                "save_model": lambda: model_store.save_model(model, model_dir=model_dir, publish=False),
+            }
+        result = None
+        for stage in STAGES[kind]:
+            conn.send(("start", stage, time.time()))
+            result = steps[stage]()
+            if stage == "update_from_events":
+                conn.send(("info", result, time.time()))
+            conn.send(("finish", stage, time.time()))
+        conn.send(("done", result, time.time()))
+    except Exception as e:
+        traceback.print_exc()
+        conn.send(("failed", f"{type(e).__name__}: {e}", time.time()))
+    finally:
+        conn.close()
+
+
+# ---------- JOB QUEUE ----------
+class TrainingJob:
+    def __init__(self, params, kind="train"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = dict(params)
+        self.key = (kind,) + tuple(sorted(self.params.items()))
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = None
+        self.error = None
+        self.info = None  # update statistics of an "update" job
+        self.stages = OrderedDict((s, {"status": "pending", "started_at": None, "seconds": None}) for s in STAGES[kind])
+        self.process = None
+
+    def snapshot(self):
+        def iso(ts):
+            return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+        done = sum(1 for s in self.stages.values() if s["status"] == "done")
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "progress": done / len(self.stages),
+            "current_stage": next((name for name, s in self.stages.items() if s["status"] == "running"), None),
+            "stages": [
+                {"name": name, "status": s["status"], "started_at": iso(s["started_at"]),
+                 "seconds": round(s["seconds"], 3) if s["seconds"] is not None
+                 else (round(end - s["started_at"], 3) if s["started_at"] else None)}
+                for name, s in self.stages.items()
+            ],
+            "created_at": iso(self.created_at),
+            "started_at": iso(self.started_at),
+            "finished_at": iso(self.finished_at),
+            "seconds": round(end - self.started_at, 3) if self.started_at else None,
+            "version": self.version,
+            "info": self.info,
+            "error": self.error,
+        }
+
+
+class TrainingJobs:
+    def __init__(self, model_dir, on_done=None, max_workers=MAX_WORKERS):
+        """
+        Args:
+            model_dir: where workers save their model versions
+            on_done: called with the job (in a monitor thread) once its model is saved;
+                     an exception marks the job failed
+            max_workers: training processes running at once
+        """
+        self.model_dir = model_dir
+        self.on_done = on_done
+        self.max_workers = max(1, int(max_workers))
+        self._jobs = OrderedDict()   # id -> TrainingJob, in submission order
+        self._queue = []             # queued jobs, FIFO
+        self._lock = threading.Lock()
+        # spawn: a fresh interpreter, not a fork of the threaded API process
+        self._mp = multiprocessing.get_context("spawn")
+
+    def submit(self, params, kind="train"):
+        """Queue a job; returns (job snapshot, created) where created is False for a duplicate."""
+        job = TrainingJob(params, kind)
+        with self._lock:
+            for other in self._jobs.values():
+                if other.key == job.key and other.status not in FINISHED:
+                    return other.snapshot(), False
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._prune()
+            self._start_queued()
+            return job.snapshot(), True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job else None
+
+    def list(self):
+        with self._lock:
+            return [job.snapshot() for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns its snapshot, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                self._queue.remove(job)
+                self._finish(job, "cancelled")
+            elif job.status == "running" and job.version is None:
+                # The monitor thread sees the process exit and starts the next job;
+                # once the model is saved and being handed over it is too late to cancel
+                job.status = "cancelled"
+                job.process.terminate()
+            return job.snapshot()
+
+    def shutdown(self):
+        """Cancel everything (API shutdown)."""
+        with self._lock:
+            jobs = [job.id for job in self._jobs.values() if job.status not in FINISHED]
+        for job_id in jobs:
+            self.cancel(job_id)
+
+    # Called with self._lock held
+    def _start_queued(self):
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        while self._queue and running < self.max_workers:
+            job = self._queue.pop(0)
+            receiver, sender = self._mp.Pipe(duplex=False)
+            job.process = self._mp.Process(
+                target=_train_worker, args=(job.kind, job.params, self.model_dir, sender),
+                name=f"train-{job.id[:8]}", daemon=True
+            )
+            job.status = "running"
+            job.started_at = time.time()
+            job.process.start()
+            sender.close()
+            threading.Thread(target=self._monitor, args=(job, receiver), daemon=True).start()
+            running += 1
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        for stage in job.stages.values():
+            if stage["status"] == "running":
+                stage["status"] = "cancelled" if status == "cancelled" else "failed"
+                stage["seconds"] = job.finished_at - stage["started_at"]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(len(finished) - KEEP_FINISHED, 0)]:
+            del self._jobs[job_id]
+
+    def _monitor(self, job, receiver):
+        """Apply the worker's stage reports until it exits, then hand over the saved model."""
+        outcome, detail = "failed", "training process exited unexpectedly"
+        while True:
+            try:
+                kind, value, ts = receiver.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                if kind == "start":
+                    job.stages[value].update(status="running", started_at=ts)
+                elif kind == "finish":
+                    stage = job.stages[value]
+                    stage.update(status="done", seconds=ts - stage["started_at"])
+                elif kind == "info":
+                    job.info = value
+                else:
+                    outcome, detail = kind, value
+        receiver.close()
+        job.process.join()
+
+        with self._lock:
+            handover = outcome == "done" and job.status == "running"
+            if handover:
+                job.version = detail
+        if handover:
+            try:
+                if self.on_done is not None:
+                    self.on_done(job)
+            except Exception as e:
+                outcome, detail = "failed", f"{type(e).__name__}: {e}"
+        with self._lock:
+            if job.status == "cancelled":
+                self._finish(job, "cancelled")
+            elif outcome == "done":
+                self._finish(job, "done")
+            else:
+                self._finish(job, "failed", detail)
+            print(f"Training job {job.id[:8]} {job.status}" + (f": {job.error}" if job.error else ""))
+            self._start_queued()